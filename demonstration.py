@@ -13,7 +13,7 @@ import matplotlib.colors as colors
 def plot_contours(chart: voyager.Chart):
 
 
-    data = chart.grid.weighted_mask
+    data = chart.grid.weighted_mask.copy()
     data[np.isnan(data)] = 1000
     # data = chart.grid.weighted_mask
 
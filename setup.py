@@ -17,4 +17,5 @@ setup(name='voyager',
                         'geopy',
                         'scipy',
                         'dask',
-                        'netcdf4'])
\ No newline at end of file
+                        'netcdf4'],
+      extras_require={'jit': ['numba']})
\ No newline at end of file
@@ -1,4 +1,7 @@
 from .traverser import Traverser
 from .chart import Chart
 from .models import Model
-from .vessel import Vessel
\ No newline at end of file
+from .vessel import Vessel
+from .raster import Accumulator
+from .index import TrajectoryIndex
+from .nested import NestedChart
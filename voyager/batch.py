@@ -0,0 +1,158 @@
+import gc
+
+import pandas as pd
+from typing import *
+
+from .chart import Chart
+from .models import Model
+from .vessel import Vessel
+from . import utils
+
+# Defaults of a trajectory spec. They follow Traverser.trajectory, except for the mode, "drifting" as named in the vessel
+# configuration rather than "drift", and the timestep, an hour rather than the single second of Traverser.trajectory
+DEFAULTS = {"mode": "drifting", "craft": 1, "duration": 60, "timestep": 3600, "destination": None, "speed": 2}
+
+class Window(NamedTuple):
+    """A launch date interpolated once, for the longest duration of the specs launched on it."""
+
+    date: pd.Timestamp
+    duration: int
+    specs: List[int]
+
+class Load(NamedTuple):
+    """A chart loaded once for a bounding box and date range, and the windows interpolated from it in date order."""
+
+    bbox: Tuple[float, ...]
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+    windows: List[Window]
+
+class BatchPlanner:
+    """
+    The BatchPlanner groups a list of trajectory specs by the chart loads and launch windows they share.
+
+    Specs with the same bounding box share a chart when their windows fit within a maximal chart span, found greedily from the
+    earliest launch date. Specs launched on the same date share one interpolated window, of the longest of their durations.
+    Every chart is loaded once, its windows are interpolated once in date order, and it is released before the next one.
+    """
+
+    def __init__(self, specs: List[Dict], chart_days: int = 30) -> None:
+        """
+        Args:
+            specs (List[Dict]): Trajectory specs, with the parameters of Traverser.trajectory: "mode", "craft", "duration",
+                                "timestep", "destination", "speed", "date", "bbox" and "departure_point", see DEFAULTS
+            chart_days (int, optional): Maximal span in days of a chart, unless a single window is longer. Defaults to 30.
+        """
+
+        self.specs = [{**DEFAULTS, **spec} for spec in specs]
+        self.chart_days = chart_days
+
+    def plan(self) -> List[Load]:
+        """Plans the chart loads and windows covering the specs.
+
+        Returns:
+            List[Load]: The chart loads, each with its windows
+        """
+
+        by_bbox: Dict[Tuple, List[int]] = {}
+        for index, spec in enumerate(self.specs):
+            by_bbox.setdefault(tuple(spec["bbox"]), []).append(index)
+
+        loads = []
+        for bbox, indices in by_bbox.items():
+
+            remaining = sorted(indices, key=lambda index: pd.Timestamp(self.specs[index]["date"]))
+
+            while remaining:
+
+                # The chart starts at the earliest remaining launch, and takes every window ending within its span
+                start_date = pd.Timestamp(self.specs[remaining[0]]["date"])
+                limit = start_date + pd.Timedelta(max(self.chart_days, self.specs[remaining[0]]["duration"]), 'D')
+
+                covered = [index for index in remaining if self._end(index) <= limit]
+                remaining = [index for index in remaining if self._end(index) > limit]
+
+                windows: Dict[pd.Timestamp, List[int]] = {}
+                for index in covered:
+                    windows.setdefault(pd.Timestamp(self.specs[index]["date"]), []).append(index)
+
+                loads.append(Load(bbox, start_date, max(self._end(index) for index in covered),
+                                  [Window(date, max(self.specs[index]["duration"] for index in specs), specs)
+                                   for date, specs in sorted(windows.items())]))
+
+        return loads
+
+    def _end(self, index: int) -> pd.Timestamp:
+
+        spec = self.specs[index]
+        return pd.Timestamp(spec["date"]) + pd.Timedelta(spec["duration"], 'D')
+
+    def order(self) -> List[int]:
+        """The indices of the specs in the order of the plan.
+
+        Returns:
+            List[int]: Indices of the specs, by chart load and window
+        """
+
+        return [index for load in self.plan() for window in load.windows for index in window.specs]
+
+    def run(self, data_directory: str, vessel_config = 'configs/vessels.yml', chart_kwargs: Dict = {}, model_kwargs: Dict = {}) -> List[Dict]:
+        """Simulates the specs by the plan.
+
+        Args:
+            data_directory (str): The root directory of the velocity data
+            vessel_config (optional): The vessel configuration, as a file or a dictionary. Defaults to 'configs/vessels.yml'.
+            chart_kwargs (Dict, optional): Parameters for loading the charts. Defaults to {}.
+            model_kwargs (Dict, optional): Parameters for the models. Defaults to {}.
+
+        Returns:
+            List[Dict]: The trajectory of every spec as GeoJSON compliant dictionary, in the order of the specs
+        """
+
+        vessel_params = utils.load_vessel_config(vessel_config)
+
+        results: List[Optional[Dict]] = [None] * len(self.specs)
+
+        for load in self.plan():
+
+            chart = Chart(list(load.bbox), load.start_date, load.end_date).load(data_directory, **chart_kwargs)
+
+            # Routes only depend on the grid cells of the departure and destination
+            routes = {}
+
+            for window in load.windows:
+
+                chart.interpolate(window.date, window.duration)
+
+                for index in window.specs:
+
+                    spec = self.specs[index]
+
+                    route = None
+                    if spec["destination"]:
+                        key = (chart.position(*spec["departure_point"]), chart.position(*spec["destination"]))
+                        if key not in routes:
+                            routes[key] = Vessel.plan_route(tuple(spec["departure_point"]), chart, tuple(spec["destination"]))
+                        route = list(routes[key])
+
+                    vessel = Vessel(*spec["departure_point"],
+                                    craft = spec["craft"],
+                                    mode = spec["mode"],
+                                    route = route,
+                                    destination = spec["destination"],
+                                    speed = spec["speed"],
+                                    params = vessel_params[spec["mode"]][spec["craft"]])
+
+                    model = Model(spec["duration"], spec["timestep"], **model_kwargs).use(chart)
+                    vessel = model.run(vessel)
+
+                    start_date = window.date.strftime('%Y-%m-%d')
+                    stop_date  = (window.date + pd.Timedelta((vessel.steps + 1) * spec["timestep"], unit='s')).strftime('%Y-%m-%d')
+
+                    results[index] = vessel.to_GeoJSON(start_date, stop_date, spec["timestep"])
+
+            # Release the chart before loading the next
+            del chart, routes
+            gc.collect()
+
+        return results
@@ -1,23 +1,47 @@
 import pandas as pd
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
 import dask
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
 
+from . import geo
 from . import utils
 from . import search
+from . import field
+from .tiles import TileCache, TiledField
 
 class Chart:
     """
     The Chart object symbolizes the map, including wind and current data, as well as the grid used for path finding.
 
     A chart at any moment is a bounding box of the underlying available data at a specific date interval.
+
+    The velocity fields are stored with a given precision: "float64", "float32", or "int16" packed with a scale and offset 
+    the way netCDF packs them, and dequantized when sampled.
+
+    With a tile size, the chart is tiled: the velocity fields are not loaded up front, but tile by tile when 
+    the vessels first sample them, keeping at most a number of tiles in memory.
+
+    With a snapshot budget, the interpolated fields cache the 2-D snapshot of every time step sampled, shared by all vessels
+    launched on the date, see field.SnapshotField.
     """
 
-    def __init__(self, bbox, start_date, end_date) -> None:
+    def __init__(self, bbox, start_date, end_date, precision="float64", tile_size=None, max_tiles=64, tile_margin=1.0, snapshot_bytes=None) -> None:
         
+        if precision not in field.PRECISIONS:
+            raise ValueError(f"Precision must be one of {', '.join(field.PRECISIONS)}")
+
         self.bbox = bbox
         self.start_date = start_date
         self.end_date = end_date
+        self.precision = precision
+
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.tile_margin = tile_margin
+        self.tiles = None
+
+        self.snapshot_bytes = snapshot_bytes
 
         self.u_current_all = None
         self.v_current_all = None
@@ -27,13 +51,24 @@ class Chart:
         self.longitudes = None
         self.latitudes  = None
         self.grid = None
+        self.astar = None
 
 
-    def load(self, data_dir: str, **kwargs):
+    def load(self, data_dir: str, cluster_size: int = None, landmarks: int = None, cluster_margin: int = 0, tolerance: float = None, cache_dir: str = search.CACHE_DIR, **kwargs):
         """Loads the Chart data for dynamical updating. Updated the winds, currents and the weighted grid.
 
         Args:
             data_dir (str): The root directory of the velocity data
+            cluster_size (int, optional): Cluster size for hierarchical path finding, recommended for large regions. 
+                                          Defaults to None, using A* on the full grid.
+            landmarks (int, optional): Number of landmarks precomputed for the A* heuristic, recommended for many route queries,
+                                       also used by hierarchical path finding. Defaults to None, using the Manhattan distance.
+            cluster_margin (int, optional): Number of clusters around the corridor of hierarchical path finding. Defaults to 0.
+            tolerance (float, optional): Relative tolerance of hierarchical route costs above the flat A* cost, applied to goals
+                                         whose cost-to-go field is cached on the grid, see search.HierarchicalAstar. Defaults to None.
+            cache_dir (str, optional): Directory caching the shoreline weighted grid on disk, see search.WeightedGrid.from_map.
+                                       Defaults to the VOYAGER_CACHE_DIR environment variable, or no cache if unset.
+            kwargs: Parameters of the shoreline weights, see search.WeightedGrid.from_map
 
         Returns:
             Chart: The Chart instance
@@ -41,31 +76,99 @@ class Chart:
 
         self.data_dir = data_dir
 
-        with dask.config.set(**{'array.slicing.split_large_chunks': True}):
+        if self.tile_size:
 
-            self.u_current_all, self.v_current_all  = utils.load_data(start=self.start_date, 
-                                                                    end=self.end_date,
-                                                                    bbox=self.bbox,
-                                                                    data_directory=self.data_dir,
-                                                                    source="currents")
+            # Only the first day of currents is needed for the coordinates and the land
+            u, _ = utils.load_data(start=self.start_date,
+                                   end=self.start_date,
+                                   bbox=self.bbox,
+                                   data_directory=self.data_dir,
+                                   source="currents")
 
-            self.u_wind_all, self.v_wind_all        = utils.load_data(start=self.start_date, 
-                                                                    end=self.end_date,
-                                                                    bbox=self.bbox,
-                                                                    data_directory=self.data_dir,
-                                                                    source="winds")
+            map = u.sel(time=self.start_date)
 
+            self.tiles = TileCache(self.bbox, self.start_date, self.end_date, self.data_dir, 
+                                   tile_size=self.tile_size, 
+                                   max_tiles=self.max_tiles, 
+                                   margin=self.tile_margin, 
+                                   precision=self.precision)
 
-        map          = self.u_current_all.sel(time=self.start_date)
+        else:
+            map = self._load_all()
 
         self.longitudes = map.longitude.values
         self.latitudes  = map.latitude.values
 
-        self.grid    = search.WeightedGrid.from_map(map, **kwargs)
+        self.grid    = search.WeightedGrid.from_map(map, cache_dir=cache_dir, **kwargs)
+
+        heuristic = search.Landmarks.for_grid(self.grid, landmarks).heuristic if landmarks else None
+
+        if cluster_size:
+            self.astar = search.HierarchicalAstar(self.grid, cluster_size=cluster_size, margin=cluster_margin, tolerance=tolerance, heuristic=heuristic)
+        elif heuristic is not None:
+            self.astar = search.Astar(self.grid, heuristic=heuristic)
+        else:
+            self.astar = search.Astar(self.grid)
 
 
         return self
 
+    def position(self, longitude: float, latitude: float) -> search.Position:
+        """The position on the grid closest to a longitude and latitude.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Returns:
+            search.Position: The position on the grid
+        """
+
+        return (geo.closest_coordinate_index(self.latitudes, latitude), geo.closest_coordinate_index(self.longitudes, longitude))
+
+    def coordinates(self, id: search.Position) -> Tuple[float, float]:
+        """The longitude and latitude of a position on the grid.
+
+        Args:
+            id (search.Position): The position on the grid
+
+        Returns:
+            Tuple[float, float]: The longitude and latitude
+        """
+
+        j, i = id
+        return (self.longitudes[i], self.latitudes[j])
+
+    def _load_all(self):
+        """Loads the velocity fields of the full bounding box.
+
+        Returns:
+            xr.DataArray: The currents at the start date
+        """
+
+        with dask.config.set(**{'array.slicing.split_large_chunks': True}):
+
+            # Currents and winds are independent, load them at the same time
+            with ThreadPoolExecutor(max_workers=2) as executor:
+
+                currents = executor.submit(utils.load_data, start=self.start_date, 
+                                                            end=self.end_date,
+                                                            bbox=self.bbox,
+                                                            data_directory=self.data_dir,
+                                                            source="currents")
+
+                winds    = executor.submit(utils.load_data, start=self.start_date, 
+                                                            end=self.end_date,
+                                                            bbox=self.bbox,
+                                                            data_directory=self.data_dir,
+                                                            source="winds")
+
+                self.u_current_all, self.v_current_all  = (field.pack(x, self.precision) for x in currents.result())
+                self.u_wind_all, self.v_wind_all        = (field.pack(x, self.precision) for x in winds.result())
+
+
+        return field.unpack(self.u_current_all.sel(time=self.start_date))
+
     def interpolate(self, date: pd.Timestamp, duration: int):
         """Interpolates the loaded data for a certain timestamp, and a duration in days.
 
@@ -79,21 +182,31 @@ class Chart:
 
         end_date = date + pd.Timedelta(duration, 'D')
 
-        self.u_current = _interpolate(self.u_current_all, date, end_date) 
-        self.v_current = _interpolate(self.v_current_all, date, end_date) 
+        if self.tiles is not None:
+
+            self.u_current = TiledField(self.tiles, "currents", "u", date, end_date)
+            self.v_current = TiledField(self.tiles, "currents", "v", date, end_date)
+
+            self.u_wind = TiledField(self.tiles, "winds", "u", date, end_date)
+            self.v_wind = TiledField(self.tiles, "winds", "v", date, end_date)
+
+            return self
+
+        self.u_current = _interpolate(self.u_current_all, date, end_date, self.snapshot_bytes) 
+        self.v_current = _interpolate(self.v_current_all, date, end_date, self.snapshot_bytes) 
             
         # Interpolate the wind speeds for the current day
-        self.u_wind = _interpolate(self.u_wind_all, date, end_date) 
-        self.v_wind = _interpolate(self.v_wind_all, date, end_date) 
+        self.u_wind = _interpolate(self.u_wind_all, date, end_date, self.snapshot_bytes) 
+        self.v_wind = _interpolate(self.v_wind_all, date, end_date, self.snapshot_bytes) 
 
         return self
         
 
-def _interpolate(x, start_date, end_date):
+def _interpolate(x, start_date, end_date, snapshot_bytes=None):
 
     X = x.sel(time=slice(start_date, end_date))
 
-    return RegularGridInterpolator((np.arange(X.shape[0]), x.longitude, x.latitude), 
-                                    np.transpose(X.values, (0, 2, 1)), 
-                                    bounds_error=False, 
-                                    fill_value=np.nan)
\ No newline at end of file
+    if snapshot_bytes:
+        return field.SnapshotField.from_xarray(X, max_bytes=snapshot_bytes)
+
+    return field.Field.from_xarray(X)
\ No newline at end of file
@@ -0,0 +1,130 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import *
+
+R_EARTH = 6371 # km
+
+def to_unit_sphere(longitude: np.ndarray, latitude: np.ndarray) -> np.ndarray:
+    """Converts WGS84 coordinates to points on the unit sphere.
+
+    Args:
+        longitude (np.ndarray): Longitudes
+        latitude (np.ndarray): Latitudes
+
+    Returns:
+        np.ndarray: Points with shape (N, 3)
+    """
+
+    lon = np.deg2rad(np.asarray(longitude, dtype=float))
+    lat = np.deg2rad(np.asarray(latitude, dtype=float))
+
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))).reshape(-1, 3)
+
+
+class Destinations:
+    """
+    The Destinations are a set of candidate targets, such as harbours or coast segments, where vessels count as arrived
+    when they come within a radius of any of them.
+
+    The targets are indexed in a KD-tree on the unit sphere, such that the arrival of a batch of positions is checked
+    with a single radius query, see query. Coast segments are densified into points along the segment.
+
+    Model.run_batch steps the vessels of an ensemble together and checks all vessels at sea with one query per step,
+    while Model.run, simulating a single vessel, checks its position with reached.
+    """
+
+    def __init__(self, targets: List, radius: float = 10, names: List[str] = None) -> None:
+        """
+        Args:
+            targets (List): Targets, either points as [longitude, latitude] or coast segments as lists of points
+            radius (float, optional): Distance in km from a target counting as arrived. Defaults to 10.
+            names (List[str], optional): Names of the targets. Defaults to their indices.
+        """
+
+        self.targets = targets
+        self.radius  = radius
+        self.names   = names if names is not None else [str(i) for i in range(len(targets))]
+
+        points, owners = [], []
+        for index, target in enumerate(targets):
+
+            target = np.asarray(target, dtype=float).reshape(-1, 2)
+            target = self.densify(target, radius / 2)
+
+            points.append(target)
+            owners.append(np.full(len(target), index))
+
+        points = np.concatenate(points) if points else np.zeros((0, 2))
+
+        self.owners = np.concatenate(owners) if owners else np.zeros(0, dtype=int)
+        self.tree   = cKDTree(to_unit_sphere(points[:, 0], points[:, 1]))
+
+        # Chord length on the unit sphere corresponding to the radius
+        self.chord = 2 * np.sin(radius / R_EARTH / 2)
+
+    @staticmethod
+    def densify(line: np.ndarray, spacing: float) -> np.ndarray:
+        """Adds points along a line such that no two consecutive points are further apart than a spacing.
+
+        Args:
+            line (np.ndarray): Points with shape (N, 2) as longitude, latitude
+            spacing (float): Maximal spacing in km
+
+        Returns:
+            np.ndarray: Points with shape (M, 2)
+        """
+
+        if len(line) < 2:
+            return line
+
+        a, b = line[:-1], line[1:]
+
+        # Approximate length of every segment in km
+        length = R_EARTH * np.hypot(np.deg2rad(b[:, 0] - a[:, 0]) * np.cos(np.deg2rad((a[:, 1] + b[:, 1]) / 2)),
+                                    np.deg2rad(b[:, 1] - a[:, 1]))
+
+        n = np.maximum(np.ceil(length / spacing).astype(int), 1)
+
+        points = [a[i] + (b[i] - a[i]) * np.arange(n[i])[:, None] / n[i] for i in range(len(a))]
+
+        return np.vstack(points + [line[-1:]])
+
+    def query(self, longitude: np.ndarray, latitude: np.ndarray) -> np.ndarray:
+        """Finds the target reached by each of a batch of positions.
+
+        Args:
+            longitude (np.ndarray): Longitudes (WGS84)
+            latitude (np.ndarray): Latitudes (WGS84)
+
+        Returns:
+            np.ndarray: Index of the closest target within the radius of every position, -1 if none is reached
+        """
+
+        longitude, latitude = np.broadcast_arrays(np.asarray(longitude, dtype=float), np.asarray(latitude, dtype=float))
+
+        reached = np.full(longitude.size, -1)
+
+        if self.tree.n == 0:
+            return reached.reshape(longitude.shape)
+
+        _, nearest = self.tree.query(to_unit_sphere(longitude.ravel(), latitude.ravel()), distance_upper_bound=self.chord)
+
+        found = nearest < self.tree.n
+        reached[found] = self.owners[nearest[found]]
+
+        return reached.reshape(longitude.shape)
+
+    def reached(self, longitude: float, latitude: float) -> Optional[int]:
+        """Finds the target reached by a single position.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Returns:
+            Optional[int]: Index of the closest target within the radius, or None
+        """
+
+        index = int(self.query(np.ravel(longitude)[:1], np.ravel(latitude)[:1])[0])
+
+        return index if index >= 0 else None
@@ -0,0 +1,335 @@
+import threading
+
+import numpy as np
+import xarray as xr
+from typing import *
+
+PRECISIONS = ("float64", "float32", "int16")
+
+# Packed values marking missing data, such as land
+INT16_FILL = -32767
+INT16_MAX  = 32766
+
+def pack(x: xr.DataArray, precision: str = "float64") -> xr.DataArray:
+    """Stores a velocity field with a given precision. Packed int16 fields follow the netCDF convention,
+    keeping the scale_factor, add_offset and _FillValue in the attributes.
+
+    Args:
+        x (xr.DataArray): A velocity field
+        precision (str, optional): Either "float64", "float32" or "int16". Defaults to "float64".
+
+    Raises:
+        ValueError: Raised if the precision is not float64, float32 or int16
+
+    Returns:
+        xr.DataArray: The velocity field with the given precision
+    """
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precision must be one of {', '.join(PRECISIONS)}")
+
+    if precision != "int16":
+        return x.astype(precision)
+
+    values = x.values
+    finite = np.isfinite(values)
+
+    low  = float(values[finite].min()) if finite.any() else 0.0
+    high = float(values[finite].max()) if finite.any() else 0.0
+
+    offset = (high + low) / 2
+    scale  = (high - low) / (2 * INT16_MAX) if high > low else 1.0
+
+    packed = np.full(values.shape, INT16_FILL, dtype=np.int16)
+    packed[finite] = np.round((values[finite] - offset) / scale)
+
+    return x.copy(data=packed).assign_attrs(scale_factor=scale, add_offset=offset, _FillValue=INT16_FILL)
+
+def unpack(x: xr.DataArray) -> xr.DataArray:
+    """Converts a velocity field of any precision to float64, with missing data as NaN.
+
+    Args:
+        x (xr.DataArray): A velocity field from pack
+
+    Returns:
+        xr.DataArray: The velocity field as float64
+    """
+
+    return x.copy(data=dequantize(x.values, **scaling(x)))
+
+def scaling(x: xr.DataArray) -> Dict[str, float]:
+    """The packing parameters of a velocity field.
+
+    Args:
+        x (xr.DataArray): A velocity field from pack
+
+    Returns:
+        Dict[str, float]: The scale, offset and fill value
+    """
+
+    if x.dtype != np.int16:
+        return {"scale": 1.0, "offset": 0.0, "fill": None}
+
+    return {"scale": x.attrs["scale_factor"], "offset": x.attrs["add_offset"], "fill": x.attrs["_FillValue"]}
+
+def dequantize(values: np.ndarray, scale: float = 1.0, offset: float = 0.0, fill: Optional[int] = None) -> np.ndarray:
+    """Converts stored values to float64, with missing data as NaN.
+
+    Args:
+        values (np.ndarray): Stored values
+        scale (float, optional): Scale factor of packed values. Defaults to 1.0.
+        offset (float, optional): Offset of packed values. Defaults to 0.0.
+        fill (Optional[int], optional): Packed value of missing data. Defaults to None.
+
+    Returns:
+        np.ndarray: The values as float64
+    """
+
+    out = values.astype(np.float64)
+
+    if fill is not None:
+        out[values == fill] = np.nan
+
+    if scale != 1.0 or offset != 0.0:
+        out = out * scale + offset
+
+    return out
+
+
+class Field:
+    """
+    The Field samples a velocity field stored as (time, latitude, longitude) by trilinear interpolation,
+    in the same manner as a RegularGridInterpolator over (time, longitude, latitude) with NaN outside the grid.
+
+    The field is sampled in its stored order and precision, and only the interpolated corners are converted to float64,
+    so float32 and packed int16 fields are never expanded in memory.
+    """
+
+    def __init__(self, values: np.ndarray,
+                       longitudes: np.ndarray,
+                       latitudes: np.ndarray,
+                       scale: float = 1.0,
+                       offset: float = 0.0,
+                       fill: Optional[int] = None) -> None:
+
+        self.values = values
+        self.times  = np.arange(values.shape[0], dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.latitudes  = np.asarray(latitudes, dtype=np.float64)
+
+        self.scale  = scale
+        self.offset = offset
+        self.fill   = fill
+
+    @classmethod
+    def from_xarray(cls, x: xr.DataArray):
+        """Creates a Field from a velocity field from pack.
+
+        Args:
+            x (xr.DataArray): A velocity field with (time, latitude, longitude) dimensions
+
+        Returns:
+            Field: A Field instance
+        """
+
+        x = x.transpose("time", "latitude", "longitude")
+
+        return cls(x.values, x.longitude.values, x.latitude.values, **scaling(x))
+
+    @staticmethod
+    def locate(coordinates: np.ndarray, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Finds the interval and the interpolation weight of every value along a coordinate axis.
+
+        Args:
+            coordinates (np.ndarray): Ascending coordinates
+            x (np.ndarray): Values to locate
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Lower indices, weights of the upper indices, and whether the values are inside the axis
+        """
+
+        if len(coordinates) == 1:
+            return np.zeros(x.shape, dtype=np.intp), np.zeros(x.shape), x == coordinates[0]
+
+        i = np.clip(np.searchsorted(coordinates, x, side="right") - 1, 0, len(coordinates) - 2)
+        w = (x - coordinates[i]) / (coordinates[i + 1] - coordinates[i])
+
+        inside = (x >= coordinates[0]) & (x <= coordinates[-1])
+
+        return i, w, inside
+
+    def __call__(self, points) -> np.ndarray:
+        """Samples the field.
+
+        Args:
+            points: A tuple of (time, longitude, latitude), or an array with the last dimension of size 3
+
+        Returns:
+            np.ndarray: The sampled values, NaN outside the field
+        """
+
+        if isinstance(points, tuple):
+            t, longitude, latitude = np.broadcast_arrays(*(np.asarray(p, dtype=np.float64) for p in points))
+        else:
+            points = np.asarray(points, dtype=np.float64)
+            t, longitude, latitude = points[..., 0], points[..., 1], points[..., 2]
+
+        shape = t.shape
+
+        it, wt, inside_t = self.locate(self.times, t.ravel())
+        ix, wx, inside_x = self.locate(self.longitudes, longitude.ravel())
+        iy, wy, inside_y = self.locate(self.latitudes, latitude.ravel())
+
+        # Upper corners, staying on the axis if it has a single coordinate
+        jt = np.minimum(it + 1, len(self.times) - 1)
+        jx = np.minimum(ix + 1, len(self.longitudes) - 1)
+        jy = np.minimum(iy + 1, len(self.latitudes) - 1)
+
+        out = np.zeros(it.shape)
+        for t_index, t_weight in ((it, 1 - wt), (jt, wt)):
+            for y_index, y_weight in ((iy, 1 - wy), (jy, wy)):
+                for x_index, x_weight in ((ix, 1 - wx), (jx, wx)):
+
+                    corner = dequantize(self.values[t_index, y_index, x_index], self.scale, self.offset, self.fill)
+
+                    out += t_weight * y_weight * x_weight * corner
+
+        out[~(inside_t & inside_x & inside_y)] = np.nan
+
+        return out.reshape(shape)
+
+
+class SnapshotField(Field):
+    """
+    The SnapshotField is a Field caching the time-interpolated 2-D snapshot of every time it is sampled at.
+
+    All vessels launched on a date with the same timestep sample the field at the same times, so with the snapshots
+    shared, every vessel only interpolates bilinearly on them. The snapshots are made the first time a time is sampled,
+    and kept within a memory budget. The vessels sample the times in the same order one after the other, for which evicting 
+    the least recently used snapshot would miss every time, so once the budget is spent the cached snapshots are kept and
+    the other times are sampled as by a Field.
+    """
+
+    def __init__(self, values: np.ndarray,
+                       longitudes: np.ndarray,
+                       latitudes: np.ndarray,
+                       scale: float = 1.0,
+                       offset: float = 0.0,
+                       fill: Optional[int] = None,
+                       max_bytes: int = 2**28) -> None:
+
+        super().__init__(values, longitudes, latitudes, scale=scale, offset=offset, fill=fill)
+
+        self.max_bytes = max_bytes
+        self.snapshots: Dict[float, np.ndarray] = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_xarray(cls, x: xr.DataArray, max_bytes: int = 2**28):
+        """Creates a SnapshotField from a velocity field from pack.
+
+        Args:
+            x (xr.DataArray): A velocity field with (time, latitude, longitude) dimensions
+            max_bytes (int, optional): Memory budget of the snapshots. Defaults to 256 MB.
+
+        Returns:
+            SnapshotField: A SnapshotField instance
+        """
+
+        x = x.transpose("time", "latitude", "longitude")
+
+        return cls(x.values, x.longitude.values, x.latitude.values, max_bytes=max_bytes, **scaling(x))
+
+    def __getstate__(self):
+
+        # Worker processes make their own snapshots
+        state = self.__dict__.copy()
+        state.update(snapshots={}, nbytes=0, hits=0, misses=0)
+        del state["lock"]
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def snapshot(self, t: float) -> Optional[np.ndarray]:
+        """The field interpolated at a time, as a (latitude, longitude) array.
+
+        Args:
+            t (float): Time
+
+        Returns:
+            Optional[np.ndarray]: The snapshot, None outside the times of the field or beyond the memory budget
+        """
+
+        with self.lock:
+            snapshot = self.snapshots.get(t)
+            full = self.nbytes + self.values[0].size * 8 > self.max_bytes
+
+            if snapshot is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if snapshot is not None:
+            return snapshot
+
+        it, wt, inside = self.locate(self.times, np.array([t]))
+
+        if full or not inside[0]:
+            return None
+
+        it, wt = int(it[0]), float(wt[0])
+        jt = min(it + 1, len(self.times) - 1)
+
+        snapshot = (1 - wt) * dequantize(self.values[it], self.scale, self.offset, self.fill) + \
+                        wt  * dequantize(self.values[jt], self.scale, self.offset, self.fill)
+
+        with self.lock:
+            if t not in self.snapshots:
+                self.snapshots[t] = snapshot
+                self.nbytes += snapshot.nbytes
+
+        return snapshot
+
+    def __call__(self, points) -> np.ndarray:
+        """Samples the field, bilinearly on the snapshot if all points are at the same time.
+
+        Args:
+            points: A tuple of (time, longitude, latitude), or an array with the last dimension of size 3
+
+        Returns:
+            np.ndarray: The sampled values, NaN outside the field
+        """
+
+        if isinstance(points, tuple):
+            t, longitude, latitude = np.broadcast_arrays(*(np.asarray(p, dtype=np.float64) for p in points))
+        else:
+            points = np.asarray(points, dtype=np.float64)
+            t, longitude, latitude = points[..., 0], points[..., 1], points[..., 2]
+
+        if t.size == 0 or not np.all(t == t.flat[0]):
+            return super().__call__(points)
+
+        snapshot = self.snapshot(float(t.flat[0]))
+
+        if snapshot is None:
+            return super().__call__(points)
+
+        ix, wx, inside_x = self.locate(self.longitudes, longitude.ravel())
+        iy, wy, inside_y = self.locate(self.latitudes, latitude.ravel())
+
+        jx = np.minimum(ix + 1, len(self.longitudes) - 1)
+        jy = np.minimum(iy + 1, len(self.latitudes) - 1)
+
+        out = (1 - wy) * ((1 - wx) * snapshot[iy, ix] + wx * snapshot[iy, jx]) + \
+                   wy  * ((1 - wx) * snapshot[jy, ix] + wx * snapshot[jy, jx])
+
+        out[~(inside_x & inside_y)] = np.nan
+
+        return out.reshape(t.shape)
@@ -0,0 +1,333 @@
+import json
+import os
+
+import numpy as np
+from typing import *
+
+from . import simplify
+
+R_EARTH = 6371 # km
+
+class TrajectoryIndex:
+    """
+    The TrajectoryIndex answers spatial queries over stored campaign trajectories, such as which trajectories passed within
+    a distance of a point, through a bounding box, or crossed a line, and when.
+
+    The segments of all trajectories are bucketed by the grid cells their bounding boxes overlap. The coordinates are stored
+    in a flat array on disk and memory mapped, so that a query only reads the segments in the buckets it touches.
+    """
+
+    def __init__(self, coordinates: np.ndarray,
+                       times: np.ndarray,
+                       offsets: np.ndarray,
+                       dates: List[str],
+                       keys: np.ndarray,
+                       segments: np.ndarray,
+                       cell_size: float) -> None:
+
+        self.coordinates = coordinates
+        self.times       = times
+        self.offsets     = offsets
+        self.dates       = dates
+        self.keys        = keys
+        self.segments    = segments
+        self.cell_size   = cell_size
+
+    @classmethod
+    def from_trajectories(cls, trajectories: List[np.ndarray], times: List[np.ndarray], dates: List[str], cell_size: float = 0.5):
+        """Creates an index in memory.
+
+        Args:
+            trajectories (List[np.ndarray]): Trajectories as arrays of longitude, latitude
+            times (List[np.ndarray]): Time in seconds after launch of every vertex
+            dates (List[str]): Launch date of every trajectory
+            cell_size (float, optional): Size in degrees of the grid cells bucketing the segments. Defaults to 0.5.
+
+        Returns:
+            TrajectoryIndex: A TrajectoryIndex instance
+        """
+
+        trajectories = [np.asarray(t, dtype=float).reshape(-1, 2) for t in trajectories]
+
+        lengths = np.array([len(t) for t in trajectories], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        coordinates = np.concatenate(trajectories) if trajectories else np.zeros((0, 2))
+        vertex_times = np.concatenate([np.asarray(t, dtype=float) for t in times]) if times else np.zeros(0)
+
+        # A segment starts at every vertex but the last of each trajectory
+        starts = np.ones(len(coordinates), dtype=bool)
+        starts[offsets[1:] - 1] = False
+        starts = np.flatnonzero(starts)
+
+        a, b = coordinates[starts], coordinates[starts + 1]
+
+        low  = np.floor(np.minimum(a, b) / cell_size).astype(np.int64)
+        high = np.floor(np.maximum(a, b) / cell_size).astype(np.int64)
+
+        # Every segment is added to all the cells of its bounding box
+        n_x = high[:, 0] - low[:, 0] + 1
+        n_y = high[:, 1] - low[:, 1] + 1
+        count = n_x * n_y
+
+        segment = np.repeat(np.arange(len(starts)), count)
+        local   = np.arange(len(segment)) - np.repeat(np.cumsum(count) - count, count)
+
+        cx = low[segment, 0] + local % n_x[segment]
+        cy = low[segment, 1] + local // n_x[segment]
+
+        keys  = cls._key(cx, cy)
+        order = np.argsort(keys, kind="stable")
+
+        return cls(coordinates, vertex_times, offsets, list(dates), keys[order], starts[segment[order]], cell_size)
+
+    @classmethod
+    def from_GeoJSON(cls, filename: str, cell_size: float = 0.5):
+        """Creates an index from a GeoJSON file of trajectories, such as from utils.save_to_GeoJSON.
+
+        Args:
+            filename (str): The GeoJSON file
+            cell_size (float, optional): Size in degrees of the grid cells bucketing the segments. Defaults to 0.5.
+
+        Returns:
+            TrajectoryIndex: A TrajectoryIndex instance
+        """
+
+        with open(filename, 'r') as file:
+            features = json.load(file)["features"]
+
+        trajectories, times, dates = [], [], []
+        for feature in features:
+
+            properties = feature["properties"]
+
+            if feature.get("geometry") is not None:
+                coordinates = np.asarray(feature["geometry"]["coordinates"], dtype=float)
+            else:
+                coordinates = simplify.delta_decode(properties["encoded"], properties["precision"])
+
+            if "times" in properties:
+                vertex_times = np.asarray(properties["times"], dtype=float)
+            else:
+                vertex_times = np.arange(len(coordinates)) * properties["timestep"]
+
+            trajectories.append(coordinates)
+            times.append(vertex_times)
+            dates.append(properties["start_date"])
+
+        return cls.from_trajectories(trajectories, times, dates, cell_size)
+
+    def save(self, directory: str):
+        """Saves the index to a directory.
+
+        Args:
+            directory (str): The index directory
+        """
+
+        os.makedirs(directory, exist_ok=True)
+
+        np.save(os.path.join(directory, "coordinates.npy"), self.coordinates)
+        np.save(os.path.join(directory, "times.npy"), self.times)
+        np.savez(os.path.join(directory, "index.npz"), offsets=self.offsets, keys=self.keys, segments=self.segments)
+
+        with open(os.path.join(directory, "index.json"), 'w') as file:
+            json.dump({"dates": self.dates, "cell_size": self.cell_size}, file)
+
+    @classmethod
+    def load(cls, directory: str):
+        """Loads an index from a directory, memory mapping the coordinates.
+
+        Args:
+            directory (str): The index directory
+
+        Returns:
+            TrajectoryIndex: A TrajectoryIndex instance
+        """
+
+        with open(os.path.join(directory, "index.json"), 'r') as file:
+            meta = json.load(file)
+
+        index = np.load(os.path.join(directory, "index.npz"))
+
+        return cls(np.load(os.path.join(directory, "coordinates.npy"), mmap_mode='r'),
+                   np.load(os.path.join(directory, "times.npy"), mmap_mode='r'),
+                   index["offsets"],
+                   meta["dates"],
+                   index["keys"],
+                   index["segments"],
+                   meta["cell_size"])
+
+    @staticmethod
+    def _key(cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+        return (np.asarray(cx, dtype=np.int64) + 2**20) * 2**22 + (np.asarray(cy, dtype=np.int64) + 2**20)
+
+    def candidates(self, bbox: List[float]) -> np.ndarray:
+        """The segments bucketed in the cells overlapping a bounding box.
+
+        Args:
+            bbox (List[float]): Bounding box as [lon_min, lat_min, lon_max, lat_max]
+
+        Returns:
+            np.ndarray: Sorted indices of the first vertex of the candidate segments
+        """
+
+        x0, y0 = np.floor(np.array(bbox[:2]) / self.cell_size).astype(np.int64)
+        x1, y1 = np.floor(np.array(bbox[2:]) / self.cell_size).astype(np.int64)
+
+        cx, cy = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+        keys = self._key(cx.ravel(), cy.ravel())
+
+        left  = np.searchsorted(self.keys, keys, side='left')
+        right = np.searchsorted(self.keys, keys, side='right')
+
+        if not len(keys) or (right - left).sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.unique(np.concatenate([self.segments[l:r] for l, r in zip(left, right)]))
+
+    def _hits(self, segments: np.ndarray, s: np.ndarray, distance: np.ndarray = None) -> List[Dict]:
+        """Collects the first hit of every trajectory from hit segments and the position along them,
+        or the closest hit when the distances of the hits are given.
+
+        Args:
+            segments (np.ndarray): First vertex of the hit segments
+            s (np.ndarray): Position along the segments between 0 and 1
+            distance (np.ndarray, optional): Distance in km of every hit. Defaults to None.
+
+        Returns:
+            List[Dict]: For every trajectory hit, its id, launch date and the time in seconds after launch of the first
+                        or closest hit, and the distance of the closest hit if the distances are given
+        """
+
+        times = self.times[segments] + s * (self.times[segments + 1] - self.times[segments])
+        trajectory = np.searchsorted(self.offsets, segments, side='right') - 1
+
+        # Hits are ranked by time, or by distance and then time
+        ranks = times if distance is None else list(zip(distance, times))
+
+        hits = {}
+        for k, (t, rank) in enumerate(zip(trajectory, ranks)):
+            if t not in hits or rank < ranks[hits[t]]:
+                hits[t] = k
+
+        if distance is None:
+            return [{"trajectory": int(t), "date": self.dates[t], "time": float(times[hits[t]])} for t in sorted(hits)]
+
+        return [{"trajectory": int(t), "date": self.dates[t], "time": float(times[hits[t]]), "distance": float(distance[hits[t]])} 
+                for t in sorted(hits)]
+
+    def within_radius(self, longitude: float, latitude: float, radius: float) -> List[Dict]:
+        """Finds the trajectories passing within a distance of a point.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+            radius (float): Distance in km
+
+        Returns:
+            List[Dict]: For every trajectory, its id, launch date, and the time in seconds after launch and the distance in km
+                        of its closest passage
+        """
+
+        d_lat = np.rad2deg(radius / R_EARTH)
+        d_lon = d_lat / max(np.cos(np.deg2rad(latitude)), 1e-6)
+
+        segments = self.candidates([longitude - d_lon, latitude - d_lat, longitude + d_lon, latitude + d_lat])
+
+        if not len(segments):
+            return []
+
+        # Local plane in km around the point
+        scale = np.deg2rad(1) * R_EARTH * np.array([np.cos(np.deg2rad(latitude)), 1])
+        a = (np.asarray(self.coordinates[segments]) - [longitude, latitude]) * scale
+        b = (np.asarray(self.coordinates[segments + 1]) - [longitude, latitude]) * scale
+
+        ab = b - a
+        length = (ab ** 2).sum(axis=1)
+        s = np.clip(-(a * ab).sum(axis=1) / np.where(length > 0, length, 1), 0, 1)
+
+        distance = np.linalg.norm(a + s[:, None] * ab, axis=1)
+        close = distance <= radius
+
+        return self._hits(segments[close], s[close], distance[close])
+
+    def within_bbox(self, bbox: List[float]) -> List[Dict]:
+        """Finds the trajectories passing through a bounding box.
+
+        Args:
+            bbox (List[float]): Bounding box as [lon_min, lat_min, lon_max, lat_max]
+
+        Returns:
+            List[Dict]: For every trajectory, its id, launch date and the time in seconds after launch it entered the bounding box
+        """
+
+        segments = self.candidates(bbox)
+
+        if not len(segments):
+            return []
+
+        a = np.asarray(self.coordinates[segments])
+        b = np.asarray(self.coordinates[segments + 1])
+
+        # Clip the segments to the bounding box (Liang-Barsky)
+        d = b - a
+        s_in  = np.zeros(len(a))
+        s_out = np.ones(len(a))
+
+        for axis, (low, high) in enumerate(((bbox[0], bbox[2]), (bbox[1], bbox[3]))):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s_low  = (low - a[:, axis]) / d[:, axis]
+                s_high = (high - a[:, axis]) / d[:, axis]
+
+            parallel = d[:, axis] == 0
+            outside  = parallel & ((a[:, axis] < low) | (a[:, axis] > high))
+
+            s_in  = np.where(parallel, s_in, np.maximum(s_in, np.minimum(s_low, s_high)))
+            s_out = np.where(parallel, s_out, np.minimum(s_out, np.maximum(s_low, s_high)))
+            s_out = np.where(outside, -1, s_out)
+
+        inside = s_in <= s_out
+
+        return self._hits(segments[inside], s_in[inside])
+
+    def crossing(self, line: List[Tuple[float, float]]) -> List[Dict]:
+        """Finds the trajectories crossing a line, such as a strait.
+
+        Args:
+            line (List[Tuple[float, float]]): The line as a list of [longitude, latitude] points
+
+        Returns:
+            List[Dict]: For every trajectory, its id, launch date and the time in seconds after launch of its first crossing
+        """
+
+        line = np.asarray(line, dtype=float).reshape(-1, 2)
+
+        hit_segments, hit_s = [], []
+        for p, q in zip(line[:-1], line[1:]):
+
+            segments = self.candidates([*np.minimum(p, q), *np.maximum(p, q)])
+
+            if not len(segments):
+                continue
+
+            a = np.asarray(self.coordinates[segments])
+            b = np.asarray(self.coordinates[segments + 1])
+
+            # Solve a + s (b - a) = p + u (q - p)
+            r = b - a
+            e = q - p
+            denominator = r[:, 0] * e[1] - r[:, 1] * e[0]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s = ((p[0] - a[:, 0]) * e[1] - (p[1] - a[:, 1]) * e[0]) / denominator
+                u = ((p[0] - a[:, 0]) * r[:, 1] - (p[1] - a[:, 1]) * r[:, 0]) / denominator
+
+            crosses = (denominator != 0) & (s >= 0) & (s <= 1) & (u >= 0) & (u <= 1)
+
+            hit_segments.append(segments[crosses])
+            hit_s.append(s[crosses])
+
+        if not hit_segments:
+            return []
+
+        return self._hits(np.concatenate(hit_segments), np.concatenate(hit_s))
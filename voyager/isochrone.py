@@ -0,0 +1,289 @@
+import numpy as np
+from typing import *
+
+from .chart import Chart
+from .move import Displacement, sailing_factor
+
+R_EARTH = 6371e3 # m
+N_SECONDS_IN_DAY = 86400
+
+class IsochroneRouter:
+    """
+    The IsochroneRouter finds the fastest route for a paddling or sailing craft under the winds and currents of a Chart,
+    by propagating isochrones in time from the departure.
+
+    At every timestep each point on the current isochrone is advanced along a fan of headings at once. The new isochrone
+    keeps the point furthest from the departure in each sector of bearings, and the route is traced back from the first point
+    reaching the destination.
+
+    The chart must be interpolated for the launch date before routing.
+    """
+
+    def __init__(self, chart: Chart,
+                       mode: str,
+                       params: Dict,
+                       speed: float = 2,
+                       craft: int = 1,
+                       timestep: float = 3600,
+                       duration: float = 60,
+                       headings: int = 36,
+                       sectors: int = 180,
+                       target_tol: float = 10) -> None:
+        """
+        Args:
+            chart (Chart): An interpolated Chart object
+            mode (str): The mode of propulsion, either 'paddling' or 'sailing'
+            params (Dict): The craft parameters from the vessel configuration
+            speed (float, optional): Paddling speed in m/s. Defaults to 2.
+            craft (int, optional): The craft type. Defaults to 1.
+            timestep (float, optional): Timestep in seconds between isochrones. Defaults to 3600.
+            duration (float, optional): Maximal duration in days. Defaults to 60.
+            headings (int, optional): Number of headings tried from every point. Defaults to 36.
+            sectors (int, optional): Number of bearing sectors the isochrone is pruned to. Defaults to 180.
+            target_tol (float, optional): Distance in km from the destination counting as arrived. Defaults to 10.
+
+        Raises:
+            ValueError: Raised if the mode is not paddling or sailing
+        """
+
+        if mode not in ('paddling', 'sailing'):
+            raise ValueError("Isochrone routing requires a mode of paddling or sailing")
+
+        self.chart      = chart
+        self.mode       = mode
+        self.params     = params
+        self.speed      = speed
+        self.craft      = craft
+        self.dt         = timestep
+        self.duration   = duration
+        self.headings   = np.deg2rad(np.arange(headings) * 360 / headings)
+        self.sectors    = sectors
+        self.target_tol = target_tol
+
+    def fields(self, t: float, longitude: np.ndarray, latitude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Interpolates the current and wind velocities at a time and a set of positions.
+
+        Args:
+            t (float): Time in days after launch
+            longitude (np.ndarray): Longitudes (WGS84)
+            latitude (np.ndarray): Latitudes (WGS84)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Current and wind velocities with shape (2, N)
+        """
+
+        points = np.column_stack((np.full(longitude.shape, t), longitude, latitude))
+
+        c = np.vstack((self.chart.u_current(points), self.chart.v_current(points)))
+        w = np.vstack((self.chart.u_wind(points), self.chart.v_wind(points)))
+
+        return c, w
+
+    def drift_velocity(self, w: np.ndarray) -> np.ndarray:
+        """The expected leeway velocity from the wind, averaging the deflections to the left and right of the wind.
+
+        Args:
+            w (np.ndarray): Wind velocities with shape (2, N)
+
+        Returns:
+            np.ndarray: Leeway velocities with shape (2, N)
+        """
+
+        w = Displacement.si_to_knots(w)
+
+        if self.craft == 7:
+            w_abs  = np.abs(w)
+            leeway = np.select([w_abs < 1, w_abs <= 3, w_abs <= 6, w_abs <= 10, w_abs <= 16, w_abs <= 21, w_abs <= 27, w_abs <= 33, w_abs <= 40],
+                               [0, 0.5, 1, 2, 3, 4.5, 6, 7, 6], 
+                               default=4.5)
+            return Displacement.knots_to_si(leeway * np.sign(w))
+
+        Sl = self.params["Sl"]
+        Yt = self.params["Yt"]
+        Da = np.deg2rad(self.params["Da"])
+
+        leeway = np.where(np.abs(w) > 6, Sl * w + Yt, (Sl + Yt / 6) * w)
+
+        # Rotations by +Da and -Da are equally likely, their mean scales the leeway
+        return np.cos(Da) * Displacement.knots_to_si(leeway)
+
+    def sailing_speed(self, heading: np.ndarray, w: np.ndarray) -> np.ndarray:
+        """The sailing speed along a heading from the wind, following the wind factors of the craft.
+
+        Args:
+            heading (np.ndarray): Headings in radians, clockwise from north
+            w (np.ndarray): Wind velocities with shape (2, N)
+
+        Returns:
+            np.ndarray: Speed in m/s along the headings
+        """
+
+        # Angle between the heading and the wind
+        b = np.abs(np.rad2deg(np.arctan2(w[0], w[1]) - heading))
+        b = np.where(b > 180, 360 - b, b)
+
+        factor = sailing_factor(b, self.params["mt"], self.params["wf 0-40"], self.params["wf 40-80"], self.params["wf 80-100"],
+                                self.params["wf 100-110"], self.params["wf 110-120"])
+
+        return factor * np.linalg.norm(w, axis=0)
+
+    def velocity(self, heading: np.ndarray, c: np.ndarray, w: np.ndarray) -> np.ndarray:
+        """The velocity over ground of the craft along a set of headings.
+
+        Args:
+            heading (np.ndarray): Headings in radians, clockwise from north
+            c (np.ndarray): Current velocities with shape (2, N)
+            w (np.ndarray): Wind velocities with shape (2, N)
+
+        Returns:
+            np.ndarray: Velocities with shape (2, N)
+        """
+
+        direction = np.vstack((np.sin(heading), np.cos(heading)))
+
+        if self.mode == 'paddling':
+            return c + self.drift_velocity(w) + self.speed * direction
+
+        return c + self.sailing_speed(heading, w) * direction
+
+    def crosses_land(self, t: float, longitude: np.ndarray, latitude: np.ndarray, new_longitude: np.ndarray, new_latitude: np.ndarray) -> np.ndarray:
+        """Whether the legs of a timestep cross land or leave the chart. Every leg is sampled at every half grid cell
+        it spans, up to and including its end, and crosses land if the currents are missing at any of the samples.
+
+        Args:
+            t (float): Time in days after launch at the start of the legs
+            longitude (np.ndarray): Longitudes at the start of the legs (WGS84)
+            latitude (np.ndarray): Latitudes at the start of the legs (WGS84)
+            new_longitude (np.ndarray): Longitudes at the end of the legs (WGS84)
+            new_latitude (np.ndarray): Latitudes at the end of the legs (WGS84)
+
+        Returns:
+            np.ndarray: Boolean array, True for the legs crossing land
+        """
+
+        dlon = new_longitude - longitude
+        dlat = new_latitude - latitude
+
+        # Number of grid cells spanned by the longest leg
+        cells = max(np.max(np.abs(dlon), initial=0) / np.min(np.abs(np.diff(self.chart.longitudes)), initial=np.inf),
+                    np.max(np.abs(dlat), initial=0) / np.min(np.abs(np.diff(self.chart.latitudes)), initial=np.inf))
+
+        crossed = np.zeros(longitude.shape, dtype=bool)
+
+        for f in np.linspace(0, 1, int(np.ceil(2 * cells)) + 1)[1:]:
+            c, _ = self.fields(t + f * self.dt / N_SECONDS_IN_DAY, longitude + f * dlon, latitude + f * dlat)
+            crossed |= np.isnan(c).any(axis=0)
+
+        return crossed
+
+    def search(self, start: Tuple[float, float], destination: Tuple[float, float]) -> Tuple[List[Tuple[float, float]], List[float]]:
+        """Finds the fastest route from a start to a destination.
+
+        Args:
+            start (Tuple[float, float]): Departure in WGS84
+            destination (Tuple[float, float]): Destination in WGS84
+
+        Raises:
+            RuntimeError: Raised if the destination cannot be reached within the duration
+
+        Returns:
+            Tuple[List[Tuple[float, float]], List[float]]: The route as positions at every timestep, and their times in days after launch
+        """
+
+        lon0, lat0 = start
+
+        # The isochrones, with the index of the parent of every point in the previous isochrone
+        longitudes = [np.array([lon0], dtype=float)]
+        latitudes  = [np.array([lat0], dtype=float)]
+        parents    = [np.array([-1])]
+
+        n_headings = len(self.headings)
+        n_steps    = int(self.duration * N_SECONDS_IN_DAY / self.dt)
+
+        for step in range(n_steps):
+
+            t = step * self.dt / N_SECONDS_IN_DAY
+
+            lon = np.repeat(longitudes[-1], n_headings)
+            lat = np.repeat(latitudes[-1], n_headings)
+            heading = np.tile(self.headings, len(longitudes[-1]))
+            parent  = np.repeat(np.arange(len(longitudes[-1])), n_headings)
+
+            c, w = self.fields(t, lon, lat)
+            v = self.velocity(heading, c, w)
+
+            # Advance every point along every heading
+            new_lat = lat + np.rad2deg(v[1] * self.dt / R_EARTH)
+            new_lon = lon + np.rad2deg(v[0] * self.dt / R_EARTH) / np.cos(np.deg2rad(lat))
+
+            # Discard legs crossing land or leaving the chart
+            feasible = ~np.isnan(v).any(axis=0)
+            feasible[feasible] = ~self.crosses_land(t, lon[feasible], lat[feasible], new_lon[feasible], new_lat[feasible])
+
+            if not feasible.any():
+                break
+
+            new_lon, new_lat, parent = new_lon[feasible], new_lat[feasible], parent[feasible]
+
+            # Arrival at the destination
+            remaining = _distance(new_lon, new_lat, *destination)
+            if remaining.min() <= self.target_tol * 1e3:
+
+                best = np.argmin(remaining)
+
+                longitudes.append(new_lon[[best]])
+                latitudes.append(new_lat[[best]])
+                parents.append(parent[[best]])
+
+                return self._backtrack(longitudes, latitudes, parents)
+
+            # Prune to the furthest point in every sector of bearings from the start
+            bearing = np.arctan2(np.deg2rad(new_lon - lon0) * np.cos(np.deg2rad(lat0)), np.deg2rad(new_lat - lat0))
+            sector  = ((bearing + np.pi) / (2 * np.pi) * self.sectors).astype(int) % self.sectors
+            reach   = _distance(new_lon, new_lat, lon0, lat0)
+
+            order = np.lexsort((-reach, sector))
+            keep  = order[np.r_[True, sector[order][1:] != sector[order][:-1]]]
+
+            longitudes.append(new_lon[keep])
+            latitudes.append(new_lat[keep])
+            parents.append(parent[keep])
+
+        raise RuntimeError("No possible route")
+
+    def route(self, start: Tuple[float, float], destination: Tuple[float, float]) -> List[Tuple[float, float]]:
+        """Finds the fastest sequence of waypoints from a start to a destination.
+
+        Args:
+            start (Tuple[float, float]): Departure in WGS84
+            destination (Tuple[float, float]): Destination in WGS84
+
+        Returns:
+            List[Tuple[float, float]]: The route as positions at every timestep
+        """
+
+        route, _ = self.search(start, destination)
+
+        return route
+
+    def _backtrack(self, longitudes, latitudes, parents) -> Tuple[List[Tuple[float, float]], List[float]]:
+
+        route = []
+        index = 0
+        for step in range(len(longitudes) - 1, -1, -1):
+            route.append((float(longitudes[step][index]), float(latitudes[step][index])))
+            index = parents[step][index]
+
+        route.reverse()
+        times = [step * self.dt / N_SECONDS_IN_DAY for step in range(len(route))]
+
+        return route, times
+
+
+def _distance(longitude: np.ndarray, latitude: np.ndarray, lon0: float, lat0: float) -> np.ndarray:
+    """Equirectangular distance in metres, accurate for the short distances between isochrone points."""
+
+    x = np.deg2rad(longitude - lon0) * np.cos(np.deg2rad((latitude + lat0) / 2))
+    y = np.deg2rad(latitude - lat0)
+
+    return R_EARTH * np.hypot(x, y)
@@ -0,0 +1,488 @@
+import math
+
+import numpy as np
+from typing import *
+
+from .field import Field
+from .move import sailing_factor
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+MODES = {"drifting": 0, "paddling": 1, "sailing": 2}
+
+PARAMS = ("Sl", "Yt", "Da", "mt", "wf 0-40", "wf 40-80", "wf 80-100", "wf 100-110", "wf 110-120")
+
+N_SECONDS_IN_DAY = 86400
+
+# WGS-84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+def jit(function):
+    """Compiles a function with Numba when it is installed, and leaves it as Python otherwise."""
+
+    if NUMBA_AVAILABLE:
+        return numba.njit(cache=True)(function)
+
+    return function
+
+@jit
+def _locate_index(n, x):
+    """Locates a value along the axis 0, 1, ..., n - 1, as Field.locate."""
+
+    if n == 1:
+        return 0, 0, 0.0, x == 0
+
+    i = min(max(int(math.floor(x)), 0), n - 2)
+
+    return i, i + 1, x - i, (x >= 0) and (x <= n - 1)
+
+@jit
+def _locate(coordinates, x):
+
+    n = coordinates.shape[0]
+
+    if n == 1:
+        return 0, 0, 0.0, x == coordinates[0]
+
+    i = np.searchsorted(coordinates, x, side="right") - 1
+    i = min(max(i, 0), n - 2)
+
+    w = (x - coordinates[i]) / (coordinates[i + 1] - coordinates[i])
+
+    return i, i + 1, w, (x >= coordinates[0]) and (x <= coordinates[n - 1])
+
+@jit
+def _sample(values, longitudes, latitudes, scale, offset, fill, t, longitude, latitude):
+    """Trilinear sample of a (time, latitude, longitude) field, as Field.__call__."""
+
+    it, jt, wt, inside_t = _locate_index(values.shape[0], t)
+    ix, jx, wx, inside_x = _locate(longitudes, longitude)
+    iy, jy, wy, inside_y = _locate(latitudes, latitude)
+
+    if not (inside_t and inside_x and inside_y):
+        return np.nan
+
+    out = 0.0
+    for t_index, t_weight in ((it, 1 - wt), (jt, wt)):
+        for y_index, y_weight in ((iy, 1 - wy), (jy, wy)):
+            for x_index, x_weight in ((ix, 1 - wx), (jx, wx)):
+
+                value = values[t_index, y_index, x_index]
+
+                if value == fill:
+                    corner = np.nan
+                else:
+                    corner = float(value) * scale + offset
+
+                out += t_weight * y_weight * x_weight * corner
+
+    return out
+
+@jit
+def _destination(longitude, latitude, bearing, distance):
+    """Solves the direct geodesic problem on the WGS-84 ellipsoid with Vincenty's formulae.
+
+    Args:
+        longitude (float): Longitude of the origin in degrees
+        latitude (float): Latitude of the origin in degrees
+        bearing (float): Bearing in degrees
+        distance (float): Distance in metres
+
+    Returns:
+        Tuple[float, float]: Longitude and latitude of the destination in degrees
+    """
+
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+
+    alpha1 = math.radians(bearing)
+    sin_alpha1, cos_alpha1 = math.sin(alpha1), math.cos(alpha1)
+
+    tan_u1 = (1 - f) * math.tan(math.radians(latitude))
+    cos_u1 = 1 / math.sqrt(1 + tan_u1 * tan_u1)
+    sin_u1 = tan_u1 * cos_u1
+
+    sigma1 = math.atan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1 * sin_alpha1
+    cos2_alpha = 1 - sin_alpha * sin_alpha
+    u2 = cos2_alpha * (a * a - b * b) / (b * b)
+
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+    sigma = distance / (b * A)
+    for _ in range(100):
+
+        cos_2sigma_m = math.cos(2 * sigma1 + sigma)
+        sin_sigma, cos_sigma = math.sin(sigma), math.cos(sigma)
+
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+                      B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+
+        previous = sigma
+        sigma = distance / (b * A) + delta_sigma
+
+        if abs(sigma - previous) < 1e-12:
+            break
+
+    cos_2sigma_m = math.cos(2 * sigma1 + sigma)
+    sin_sigma, cos_sigma = math.sin(sigma), math.cos(sigma)
+
+    x = sin_u1 * sin_sigma - cos_u1 * cos_sigma * cos_alpha1
+    latitude2 = math.atan2(sin_u1 * cos_sigma + cos_u1 * sin_sigma * cos_alpha1, (1 - f) * math.sqrt(sin_alpha * sin_alpha + x * x))
+
+    lam = math.atan2(sin_sigma * sin_alpha1, cos_u1 * cos_sigma - sin_u1 * sin_sigma * cos_alpha1)
+    C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+    L = lam - (1 - C) * f * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+
+    longitude2 = (longitude + math.degrees(L) + 540) % 360 - 180
+
+    return longitude2, math.degrees(latitude2)
+
+@jit
+def _distance(longitude1, latitude1, longitude2, latitude2):
+    """Solves the inverse geodesic problem on the WGS-84 ellipsoid with Vincenty's formulae.
+
+    Returns:
+        float: The distance in km
+    """
+
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+
+    L = math.radians(longitude2 - longitude1)
+
+    tan_u1 = (1 - f) * math.tan(math.radians(latitude1))
+    cos_u1 = 1 / math.sqrt(1 + tan_u1 * tan_u1)
+    sin_u1 = tan_u1 * cos_u1
+
+    tan_u2 = (1 - f) * math.tan(math.radians(latitude2))
+    cos_u2 = 1 / math.sqrt(1 + tan_u2 * tan_u2)
+    sin_u2 = tan_u2 * cos_u2
+
+    lam = L
+    sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sigma_m = 0.0, 1.0, 0.0, 1.0, 0.0
+    for _ in range(200):
+
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+
+        sin_sigma = math.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+
+        if sin_sigma == 0:
+            return 0.0
+
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha * sin_alpha
+        cos_2sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha if cos2_alpha != 0 else 0.0
+
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+
+        previous = lam
+        lam = L + (1 - C) * f * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+
+        if abs(lam - previous) < 1e-12:
+            break
+
+    u2 = cos2_alpha * (a * a - b * b) / (b * b)
+
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+                  B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+
+    return b * A * (sigma - delta_sigma) / 1e3
+
+@jit
+def _bearing(longitude, latitude, target_longitude, target_latitude):
+    """The bearing in radians from a position to a target, as geo.bearing_from_lonlat."""
+
+    lat_pos = math.radians(latitude)
+    lat_tgt = math.radians(target_latitude)
+    d_lon   = math.radians(longitude - target_longitude)
+
+    x = math.sin(d_lon) * math.cos(lat_tgt)
+    y = math.cos(lat_pos) * math.sin(lat_tgt) - math.sin(lat_pos) * math.cos(lat_tgt) * math.cos(d_lon)
+
+    return math.radians((math.degrees(math.atan2(x, y)) + 360) % 360)
+
+@jit
+def _leeway(w, Sl, Yt):
+    """The leeway in m/s of one wind component in m/s, as Displacement.leeway_velocity."""
+
+    w = w * 1.94
+
+    if abs(w) > 6:
+        leeway = Sl * w + Yt
+    else:
+        leeway = (Sl + Yt / 6) * w
+
+    return leeway / 1.94
+
+@jit
+def _levison_leeway(w):
+    """The leeway in m/s of one wind component in m/s, as Displacement.levison_leeway_displacement."""
+
+    w = w * 1.94
+    w_abs = abs(w)
+
+    if w_abs < 1:
+        leeway = 0.0
+    elif w_abs <= 3:
+        leeway = 0.5
+    elif w_abs <= 6:
+        leeway = 1.0
+    elif w_abs <= 10:
+        leeway = 2.0
+    elif w_abs <= 16:
+        leeway = 3.0
+    elif w_abs <= 21:
+        leeway = 4.5
+    elif w_abs <= 27:
+        leeway = 6.0
+    elif w_abs <= 33:
+        leeway = 7.0
+    elif w_abs <= 40:
+        leeway = 6.0
+    else:
+        leeway = 4.5
+
+    return leeway * np.sign(w) / 1.94
+
+_sailing_factor = jit(sailing_factor)
+
+@jit
+def _drift(cu, cv, wu, wv, dt, levison, Sl, Yt, Da, flip):
+    """The displacement in metres from drifting, as Displacement.from_drift."""
+
+    if levison:
+        return cu * dt + _levison_leeway(wu) * dt, cv * dt + _levison_leeway(wv) * dt
+
+    lu = _leeway(wu, Sl, Yt) * dt
+    lv = _leeway(wv, Sl, Yt) * dt
+
+    angle = math.radians(Da) * flip
+
+    return (cu * dt + math.cos(angle) * lu - math.sin(angle) * lv,
+            cv * dt + math.sin(angle) * lu + math.cos(angle) * lv)
+
+@jit
+def _simulate(times, dt, longitude, latitude, mode, levison, params, speed, targets, target_tol, noise, flips,
+              u_current, v_current, current_longitudes, current_latitudes, current_scaling,
+              u_wind, v_wind, wind_longitudes, wind_latitudes, wind_scaling):
+    """The time loop of Model.run for a single vessel.
+
+    Args:
+        times (np.ndarray): Times of the steps in days
+        dt (float): Timestep in seconds
+        longitude (float): Start longitude
+        latitude (float): Start latitude
+        mode (int): Index of the mode in MODES
+        levison (bool): Whether the drift leeway follows Levison
+        params (np.ndarray): Vessel parameters ordered as PARAMS
+        speed (float): Paddling speed
+        targets (np.ndarray): Targets of the route with shape (N, 2), in the order they are reached
+        target_tol (float): Distance in km counting as reaching a target
+        noise (np.ndarray): Noise in metres added to the displacement of every step, with shape (len(times), 2)
+        flips (np.ndarray): Side of the wind deflected to at every step
+        u_current, v_current, u_wind, v_wind (np.ndarray): Velocity fields as stored in a Field
+        current_scaling, wind_scaling (np.ndarray): Scale, offset and fill value of the u and v fields, with shape (2, 3)
+
+    Returns:
+        Tuple: Positions with shape (len(times) + 1, 2), number of steps taken, distance in km,
+               whether the vessel arrived, and the steps at which targets were passed
+    """
+
+    Sl, Yt, Da = params[0], params[1], params[2]
+
+    positions = np.empty((times.shape[0] + 1, 2))
+    positions[0, 0] = longitude
+    positions[0, 1] = latitude
+
+    distance = 0.0
+    target   = 0
+    arrived  = False
+    n        = 0
+
+    # Step at which each target was passed
+    switches = np.full(targets.shape[0], -1)
+
+    for k in range(times.shape[0]):
+
+        t = times[k]
+
+        cu = _sample(u_current, current_longitudes, current_latitudes, current_scaling[0, 0], current_scaling[0, 1], current_scaling[0, 2], t, longitude, latitude)
+        cv = _sample(v_current, current_longitudes, current_latitudes, current_scaling[1, 0], current_scaling[1, 1], current_scaling[1, 2], t, longitude, latitude)
+
+        # Land or outside the chart
+        if np.isnan(cu) or np.isnan(cv):
+            break
+
+        wu = _sample(u_wind, wind_longitudes, wind_latitudes, wind_scaling[0, 0], wind_scaling[0, 1], wind_scaling[0, 2], t, longitude, latitude)
+        wv = _sample(v_wind, wind_longitudes, wind_latitudes, wind_scaling[1, 0], wind_scaling[1, 1], wind_scaling[1, 2], t, longitude, latitude)
+
+        if mode == 0:
+            dx, dy = _drift(cu, cv, wu, wv, dt, levison, Sl, Yt, Da, flips[k])
+
+        elif mode == 1:
+            a = _bearing(longitude, latitude, targets[target, 0], targets[target, 1])
+            dx, dy = _drift(cu, cv, wu, wv, dt, levison, Sl, Yt, Da, flips[k])
+            dx += speed * dt * -math.sin(a)
+            dy += speed * dt * math.cos(a)
+
+        else:
+            a = _bearing(longitude, latitude, targets[target, 0], targets[target, 1])
+            bx, by = math.cos(a), math.sin(a)
+
+            # Angle between bearing and wind
+            b = abs(math.degrees(math.atan2(bx * wv - by * wu, bx * wu + by * wv)))
+
+            sailing_velocity = _sailing_factor(b, params[3], params[4], params[5], params[6], params[7], params[8])
+            displacement     = sailing_velocity * math.sqrt(wu * wu + wv * wv) * dt
+
+            dx = displacement * -math.sin(a) + cu * dt
+            dy = displacement * math.cos(a) + cv * dt
+
+        # Noise, and metres to km
+        dx = (dx + noise[k, 0]) / 1e3
+        dy = (dy + noise[k, 1]) / 1e3
+
+        bearing = 90 - math.degrees(math.atan2(dy, dx))
+        step    = math.sqrt(dx * dx + dy * dy)
+
+        longitude, latitude = _destination(longitude, latitude, bearing, step * 1e3)
+
+        distance += step
+        n += 1
+
+        positions[n, 0] = longitude
+        positions[n, 1] = latitude
+
+        # Check progress along route
+        if target < targets.shape[0]:
+            if _distance(longitude, latitude, targets[target, 0], targets[target, 1]) <= target_tol:
+                if target + 1 < targets.shape[0]:
+                    switches[target] = n
+                    target += 1
+                else:
+                    arrived = True
+                    break
+
+    return positions, n, distance, arrived, switches[:target]
+
+def supports(model, vessel) -> bool:
+    """Whether a simulation can run in the compiled kernel. Tiled charts, candidate destinations, replanning,
+    backtracking and unknown modes are only simulated in Python.
+
+    Args:
+        model (Model): A Model object
+        vessel (Vessel): A Vessel object
+
+    Returns:
+        bool: Whether the simulation is supported
+    """
+
+    fields = (model.chart.u_current, model.chart.v_current, model.chart.u_wind, model.chart.v_wind)
+
+    return (NUMBA_AVAILABLE
+            and all(isinstance(f, Field) for f in fields)
+            and model.destinations is None
+            and model.replan is None and model.patience is None
+            and not model.backward
+            and vessel.mode in MODES
+            and (vessel.mode == 'drifting' or vessel.target is not None))
+
+def _scaling(u: Field, v: Field) -> np.ndarray:
+    return np.array([[f.scale, f.offset, f.fill if f.fill is not None else np.nan] for f in (u, v)])
+
+def run(model, vessel):
+    """Simulates a vessel in the compiled kernel, in the same manner as Model.run.
+
+    The random deflections and noise of every step are drawn up front with NumPy, unless the vessel has a noise path.
+
+    Args:
+        model (Model): A Model object with a chart
+        vessel (Vessel): Vessel object with initial position
+
+    Returns:
+        Vessel: A modified vessel object with full trajectory
+    """
+
+    np.random.seed()
+
+    chart = model.chart
+    times = np.arange(start=0, stop=model.duration, step=model.dt/N_SECONDS_IN_DAY)
+
+    if vessel.noise is not None:
+        steps = slice(vessel.steps, vessel.steps + len(times))
+        noise = model.sigma * vessel.noise.normal[steps]
+        flips = np.asarray(vessel.noise.flips[steps], dtype=float)
+    else:
+        noise = np.random.normal(0, model.sigma, size=(len(times), 2))
+        flips = np.random.choice((1, -1), size=len(times)).astype(float)
+
+    params  = np.array([float(vessel.params.get(p, np.nan)) for p in PARAMS])
+    targets = [vessel.target, *reversed(vessel.route)] if vessel.target is not None else []
+    targets = np.array(targets, dtype=float).reshape(-1, 2)
+
+    target_tol = (model.dt) * model.tolerance
+
+    positions, n, distance, arrived, switches = _simulate(times, float(model.dt), float(vessel.x), float(vessel.y),
+                                                        MODES[vessel.mode], vessel.craft == 7, params, float(vessel.speed),
+                                                        targets, target_tol, noise, flips,
+                                                        chart.u_current.values, chart.v_current.values,
+                                                        chart.u_current.longitudes, chart.u_current.latitudes, _scaling(chart.u_current, chart.v_current),
+                                                        chart.u_wind.values, chart.v_wind.values,
+                                                        chart.u_wind.longitudes, chart.u_wind.latitudes, _scaling(chart.u_wind, chart.v_wind))
+
+    # Targets passed along the route
+    for _ in range(len(switches)):
+        vessel.target = vessel.route.pop()
+
+    if model.accumulator is not None:
+        for k in range(n + 1):
+            model.accumulator.visit(positions[k, 0], positions[k, 1], times[k - 1] + model.dt/N_SECONDS_IN_DAY if k else 0)
+        model.accumulator.end(positions[n, 0], positions[n, 1])
+
+    if n > 0:
+
+        # The positions recorded in the recording mode of the model
+        steps = np.arange(1, n + 1)
+
+        if model.record == "full":
+            recorded = steps
+        elif model.record == "decimate":
+            recorded = steps[(vessel.steps + steps) % model.record_every == 0]
+        elif model.record == "waypoints":
+            recorded = switches
+        else:
+            recorded = steps[:0]
+
+        vessel.trajectory.extend(positions[recorded].tolist())
+
+        if vessel.recorded_steps is not None:
+            vessel.recorded_steps.extend((vessel.steps + recorded).tolist())
+
+        vessel.x, vessel.y = float(positions[n, 0]), float(positions[n, 1])
+        vessel.steps += n
+        vessel.distance += distance
+        vessel.update_mean_speed(model.dt)
+
+    if arrived:
+        vessel.arrived = True
+
+    if model.record != "full":
+        vessel.record_position()
+
+    if model.precision is not None:
+        vessel.compact(model.precision)
+
+    return vessel
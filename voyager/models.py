@@ -1,18 +1,56 @@
-from typing import Tuple
+from typing import List, Optional, Tuple, Union
 import numpy as np
 
-from .vessel import Vessel
+from .vessel import Vessel, Summary
 from .chart import Chart
 from .move import Displacement
+from .raster import Accumulator
+from .destinations import Destinations
+from .replan import Replanner
+from . import kernel
+
+RECORDING_MODES = ("full", "summary", "decimate", "waypoints")
+
+N_SECONDS_IN_DAY = 86400
 
 class Model:
 
-    def __init__(self, duration: int, dt: float, sigma = 2000.0, tolerance = 0.5e-3) -> None:
+    def __init__(self, duration: int, dt: float, sigma = 2000.0, tolerance = 0.5e-3, precision = None, jit = False, record = "full", record_every = 1,
+                       replan = None, patience = None, backward = False) -> None:
+        
+        if record not in RECORDING_MODES:
+            raise ValueError(f"Recording mode must be one of {', '.join(RECORDING_MODES)}")
+
+        if record_every < 1:
+            raise ValueError("Recording interval record_every must be at least 1")
+
         self.duration = duration
         self.dt       = dt
         self.chart = None
         self.sigma = sigma
         self.tolerance = tolerance
+        self.accumulator = None
+        self.destinations = None
+
+        # Precision of the recorded trajectories, None to keep them as lists of float64 pairs
+        self.precision = precision
+
+        # Run the time loop in the compiled kernel when Numba is installed
+        self.jit = jit
+
+        # Which positions are recorded to the trajectories: every step, only the start and end for a summary, 
+        # every record_every steps, or where the vessel turns to the next waypoint. The end is always recorded.
+        self.record = record
+        self.record_every = record_every
+
+        # Replan the route of vessels further than replan km from it, or not closer to their target for patience steps,
+        # see Replanner. None to keep the route planned at launch.
+        self.replan = replan
+        self.patience = patience
+
+        # Drift back in time from the end of the interpolated window, against the winds and currents,
+        # to find where drifting vessels arriving at their position may have come from
+        self.backward = backward
 
     def use(self, chart: Chart):
         """Use a supplied chart object of winds and currents.
@@ -28,6 +66,35 @@ class Model:
 
         return self
 
+    def accumulate(self, accumulator: Accumulator):
+        """Use a supplied accumulator to record the visits of vessels on the chart grid while they are simulated.
+
+        Args:
+            accumulator (Accumulator): An Accumulator object, or None to stop accumulating
+
+        Returns:
+            Model: The Model instance
+        """
+
+        self.accumulator = accumulator
+
+        return self
+
+    def arrive_at(self, destinations: Destinations):
+        """Use a set of candidate destinations, where vessels count as arrived at whichever they reach first.
+        The positions are checked against the destinations after every step, for a whole ensemble at once with run_batch.
+
+        Args:
+            destinations (Destinations): A Destinations object, or None to only use the destination of each vessel
+
+        Returns:
+            Model: The Model instance
+        """
+
+        self.destinations = destinations
+
+        return self
+
     def velocity(self, t, longitude, latitude) -> Tuple[np.ndarray, np.ndarray]:
         """Calculate a tuple of (current, wind) velocities at a specific time and set of
         WGS84 coordinates through interpolation.
@@ -68,60 +135,258 @@ class Model:
 
         Assumes a spherical Earth.
 
+        The positions recorded to the trajectory follow the recording mode of the model. With a summary, see Vessel.summary,
+        only the start and end are recorded. With a precision, the positions are recorded into an array of that precision
+        while simulating, see Vessel.reserve.
+
+        With jit, the time loop runs in a compiled kernel, see kernel.run. It falls back to Python when Numba is not installed,
+        and for tiled charts or candidate destinations.
+
+        Backward, the vessel starts at the end of the chart window and steps back to its start with the reversed displacement
+        of the winds and currents, with the same random deflections and noise. Every step back is predicted with the velocity
+        where the vessel is, and taken with the velocity at the predicted position, such that it inverts the forward step. Visits are accumulated with the days of drift
+        before the end of the window, and the end of the trajectory is where the vessel may have been launched.
+
         Args:
             vessel (Vessel): Vessel object with initial position
 
+        Raises:
+            ValueError: Raised if a vessel that is not drifting is simulated backward
+            ValueError: Raised if the route of a vessel is to be replanned on a chart without a WeightedGrid
+
         Returns:
             Vessel: A modified vessel object with full trajectory
         """
 
+        self._prepare(vessel)
+
+        if self.jit and kernel.supports(self, vessel):
+            return kernel.run(self, vessel)
+
         # Set random seed
         # Important, otherwise all virtual threads will return the same result
         np.random.seed()
 
-        longitude = vessel.x
-        latitude  = vessel.y
+        displacement, replanner = self._launch(vessel)
 
-        # Constant
-        N_SECONDS_IN_DAY = 86400
+        for t in self._times():
 
-        # Initialization
-        dx = 0
-        dy = 0
+            elapsed = self._step(vessel, displacement, replanner, t)
 
-        target_tol = (self.dt) * self.tolerance # 1/1000 is a good value
+            if elapsed is None:
+                break
 
-        # The type of displacement is handled by the vessel mode of traversal
-        displacement = Displacement(vessel, self.dt)
+            # Check arrival at any of the candidate destinations
+            if self.destinations is not None:
+
+                target = self.destinations.reached(vessel.x, vessel.y)
+
+                if target is not None:
+                    self._make_landfall(vessel, target, elapsed)
+                    break
+
+        return self._finish(vessel)
+
+    def run_batch(self, vessels: List[Vessel]) -> List[Vessel]:
+        """Calculates the trajectories of an ensemble of vessels launched together, stepping all vessels still at sea at once.
+
+        With candidate destinations, the arrival of every vessel at sea is checked with a single query of the destinations
+        after every step, see Destinations.query. The vessels are otherwise simulated as in run, and without candidate
+        destinations each is simply run on its own.
+
+        Args:
+            vessels (List[Vessel]): Vessel objects with initial positions
+
+        Raises:
+            ValueError: Raised if a vessel that is not drifting is simulated backward
+            ValueError: Raised if the route of a vessel is to be replanned on a chart without a WeightedGrid
+
+        Returns:
+            List[Vessel]: The modified vessel objects, in the same order
+        """
+
+        if self.destinations is None:
+            return [self.run(vessel) for vessel in vessels]
+
+        for vessel in vessels:
+            self._prepare(vessel)
+
+        np.random.seed()
+
+        states = [self._launch(vessel) for vessel in vessels]
+        active = list(range(len(vessels)))
+
+        for t in self._times():
+
+            # Step the vessels at sea, dropping those reaching land or their own destination
+            moved, elapsed = [], None
+            for i in active:
 
-        for t in np.arange(start=0, stop=self.duration, step=self.dt/N_SECONDS_IN_DAY):
-            
-            # Calculate interpolated velocity at current coordinates
-            c, w = self.velocity(t, longitude, latitude)
+                days = self._step(vessels[i], *states[i], t)
 
-            # If return is None, we have reached land
-            if c is None or w is None:
+                if days is not None:
+                    moved.append(i)
+                    elapsed = days
+
+            if not moved:
                 break
 
-            # Calculate displacement
-            dx, dy = displacement.move(c, w)\
-                                 .with_uncertainty(sigma=self.sigma)\
-                                 .km()
-               
-            # print(dx, dy)
-            # Calculate new longitude, latitude from displacement
-            # Using great circle distances
-            longitude, latitude = displacement.to_lonlat(dx, dy, longitude, latitude)
-
-            # Update vessel data
-            vessel.update_distance(dx, dy)\
-                  .update_position(longitude, latitude)\
-                  .update_mean_speed(self.dt)
-
-            # Check progress along route
-            is_arrived = vessel.has_arrived(longitude, latitude, target_tol)
-
-            if is_arrived:
+            targets = self.destinations.query([vessels[i].x for i in moved], [vessels[i].y for i in moved])
+
+            for i, target in zip(moved, targets):
+                if target >= 0:
+                    self._make_landfall(vessels[i], int(target), elapsed)
+
+            active = [i for i, target in zip(moved, targets) if target < 0]
+
+            if not active:
                 break
 
+        return [self._finish(vessel) for vessel in vessels]
+
+    def _prepare(self, vessel: Vessel):
+        """Checks that a vessel can be simulated, and prepares its trajectory for the recording mode."""
+
+        if self.backward and vessel.mode != "drifting":
+            raise ValueError("Only drifting vessels can be simulated backward")
+
+        if self.record != "full":
+            vessel.recorded_steps = [vessel.steps]
+
+        # Record into an array of the precision, sized for the positions recorded in the recording mode
+        if self.precision is not None:
+            n_steps = int(np.ceil(self.duration * N_SECONDS_IN_DAY / self.dt))
+            vessel.reserve({"full": n_steps, "decimate": n_steps // self.record_every + 1}.get(self.record, 2), self.precision)
+
+    def _launch(self, vessel: Vessel) -> Tuple[Displacement, Replanner]:
+        """Starts the simulation of a vessel, returning its displacement and its replanner, None without replanning."""
+
+        # The type of displacement is handled by the vessel mode of traversal
+        displacement = Displacement(vessel, self.dt)
+
+        replanner = None
+        if (self.replan is not None or self.patience is not None) and vessel.target is not None and vessel.destination is not None:
+            replanner = Replanner(self.chart, vessel, distance=self.replan if self.replan is not None else np.inf, patience=self.patience)
+
+        if self.accumulator is not None:
+            self.accumulator.visit(vessel.x, vessel.y, 0)
+
+        return displacement, replanner
+
+    def _times(self) -> np.ndarray:
+        """The times of the steps in days, each step going from t to t + step, or backward from t + step to t."""
+
+        times = np.arange(start=0, stop=self.duration, step=self.dt/N_SECONDS_IN_DAY)
+
+        return times[::-1] if self.backward else times
+
+    def _step(self, vessel: Vessel, displacement: Displacement, replanner: Replanner, t: float) -> Optional[float]:
+        """Takes a step of a vessel at a time.
+
+        Returns:
+            Optional[float]: Days since the start of the trajectory after the step, or None if the vessel reached land 
+                             or arrived at its destination
+        """
+
+        longitude = vessel.x
+        latitude  = vessel.y
+
+        step       = self.dt/N_SECONDS_IN_DAY
+        target_tol = (self.dt) * self.tolerance # 1/1000 is a good value
+
+        # Calculate interpolated velocity at current coordinates, backward at the end of the step where the vessel is
+        c, w = self.velocity(t + step if self.backward else t, longitude, latitude)
+
+        # If return is None, we have reached land
+        if c is None or w is None:
+            return None
+
+        # Backward, the velocity where the vessel is predicts where it was at t, and it steps back with the velocity
+        # there, as the forward step from that position would have been taken. Both drift to the same side of the wind.
+        if self.backward:
+            flip = vessel.noise.flips[vessel.steps] if vessel.noise is not None else np.random.choice((1, -1))
+
+            dx, dy = displacement.from_drift(c, w, flip).reverse().km()
+            c_t, w_t = self.velocity(t, *displacement.to_lonlat(dx, dy, longitude, latitude))
+
+            if c_t is not None and w_t is not None:
+                c, w = c_t, w_t
+
+        # Days since the start of the trajectory after the step
+        elapsed = self.duration - t if self.backward else t + step
+
+        # Calculate displacement
+        if self.backward:
+            displacement.from_drift(c, w, flip).reverse()
+        else:
+            displacement.move(c, w)
+
+        dx, dy = displacement.with_uncertainty(sigma=self.sigma)\
+                             .km()
+           
+        # Calculate new longitude, latitude from displacement
+        # Using great circle distances
+        longitude, latitude = displacement.to_lonlat(dx, dy, longitude, latitude)
+
+        record = self.record == "full" or (self.record == "decimate" and (vessel.steps + 1) % self.record_every == 0)
+
+        # Update vessel data
+        vessel.update_distance(dx, dy)\
+              .update_position(longitude, latitude, record)\
+              .update_mean_speed(self.dt)
+
+        if self.accumulator is not None:
+            self.accumulator.visit(longitude, latitude, elapsed)
+
+        # Check progress along route
+        target = vessel.target
+        is_arrived = vessel.has_arrived(longitude, latitude, target_tol)
+
+        if self.record == "waypoints" and vessel.target is not target:
+            vessel.record_position()
+
+        if is_arrived:
+            vessel.arrived = True
+            return None
+
+        if replanner is not None:
+            replanner.update(longitude, latitude)
+
+        return elapsed
+
+    def _make_landfall(self, vessel: Vessel, target: int, elapsed: float):
+        """Marks a vessel as arrived at one of the candidate destinations."""
+
+        vessel.arrived  = True
+        vessel.landfall = {"target": target, 
+                           "name": self.destinations.names[target], 
+                           "time": float(elapsed)}
+
+    def _finish(self, vessel: Vessel) -> Vessel:
+        """Ends the simulation of a vessel, recording its last position."""
+
+        if self.accumulator is not None:
+            self.accumulator.end(vessel.x, vessel.y)
+
+        if self.record != "full":
+            vessel.record_position()
+
+        if self.precision is not None:
+            vessel.compact(self.precision)
+
         return vessel
+
+    def run_vessel(self, vessel: Vessel) -> Union[Vessel, Summary]:
+        """Runs a vessel, returning only its fixed-size record when the model records summaries.
+        Used to map the vessels of an ensemble over a process pool.
+
+        Args:
+            vessel (Vessel): A Vessel object
+
+        Returns:
+            Union[Vessel, Summary]: The simulated vessel, or its Summary
+        """
+
+        vessel = self.run(vessel)
+
+        return vessel.summary() if self.record == "summary" else vessel
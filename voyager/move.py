@@ -2,6 +2,31 @@ from . import geo
 import numpy as np
 from typing import *
 
+def sailing_factor(b, mt, wf_0_40, wf_40_80, wf_80_100, wf_100_110, wf_110_120):
+    """The sailing speed per unit of wind speed at an angle between the course and the wind, following the wind factors
+    of the craft. Beyond the maximal angle the craft tacks, making good the cosine of the angle exceeding it.
+
+    Shared by Displacement.from_sailing, the isochrone router and the jit kernel, it works on floats and arrays alike.
+
+    Args:
+        b: Angle in degrees between the course and the wind, between 0 and 180
+        mt: Maximal angle in degrees sailed without tacking
+        wf_0_40, wf_40_80, wf_80_100, wf_100_110, wf_110_120: Wind factors of the angle bands
+
+    Returns:
+        The speed in m/s per m/s of wind
+    """
+
+    factor = (wf_0_40    * (b <= 40)
+            + wf_40_80   * ((b > 40) & (b <= 80))
+            + wf_80_100  * ((b > 80) & (b <= 100))
+            + wf_100_110 * ((b > 100) & (b <= 110))
+            + wf_110_120 * (b > 110))
+
+    tacking = np.maximum(np.deg2rad(b - mt), 0.0)
+
+    return factor * np.cos(tacking)
+
 class Displacement:
 
     def __init__(self, vessel, dt) -> None:
@@ -163,12 +188,14 @@ class Displacement:
 
         return r.dot(x)
 
-    def from_drift(self, c: np.ndarray, w: np.ndarray):
+    def from_drift(self, c: np.ndarray, w: np.ndarray, flip: float = None):
         """Generate displacement due to only drifting with the winds and currents. 
 
         Args:
             c (np.ndarray): Current velocity
             w (np.ndarray): Wind velocity
+            flip (float, optional): Side of the wind deflected to, 1 or -1. Defaults to None, taken from the noise path
+                                    of the vessel or drawn at random.
 
         Returns:
             Displacement: The Displacement instance
@@ -189,7 +216,10 @@ class Displacement:
 
             # the deflections due to Da half right
             ## and half left of the wind
-            flip = np.random.choice((1, -1))
+            if flip is None and self.vessel.noise is not None:
+                flip = self.vessel.noise.flips[self.vessel.steps]
+            elif flip is None:
+                flip = np.random.choice((1, -1))
 
             # Calculate the leeway speed and displacement
             dxy_leeway = Displacement.leeway_displacement(w, Sl, Yt, self.dt)
@@ -246,9 +276,6 @@ class Displacement:
             position (np.ndarray): Current position coordinates
             target (np.ndarray): Destination position coordinates
 
-        Raises:
-            ValueError: Raised if the angle between the bearing and reference is a non-positive number
-
         Returns:
             Displacement: The Displacement instance
         """
@@ -277,33 +304,11 @@ class Displacement:
         w_abs = np.linalg.norm(w)
         # print("wind velocity:", np.linalg.norm(w))
 
-        mt          = self.vessel.params["mt"]
-        wf_0_40     = self.vessel.params["wf 0-40"]
-        wf_40_80    = self.vessel.params["wf 40-80"]
-        wf_80_100   = self.vessel.params["wf 80-100"]
-        wf_100_110  = self.vessel.params["wf 100-110"]
-        wf_110_120  = self.vessel.params["wf 110-120"]
-
-        if b  <= 40:
-            sailing_velocity = wf_0_40 
-        elif b > 40 or b <= 80:
-            sailing_velocity = wf_40_80 
-        elif b > 80 or b <= 100:
-            sailing_velocity = wf_80_100 
-        elif b > 100 or b <= 110:
-            sailing_velocity = wf_100_110 
-        elif b > 110:
-            sailing_velocity = wf_110_120 
-        else:
-            raise ValueError(f"Invalid angle b={b}")
+        params = self.vessel.params
+        sailing_velocity = sailing_factor(b, params["mt"], params["wf 0-40"], params["wf 40-80"], params["wf 80-100"], 
+                                          params["wf 100-110"], params["wf 110-120"]) * w_abs
 
-        sailing_velocity *= w_abs
-
-        if b <= mt:
-            displacement = sailing_velocity * self.dt
-        else:
-            tacking = np.deg2rad(b-mt)
-            displacement = np.cos(tacking)*sailing_velocity*self.dt
+        displacement = sailing_velocity * self.dt
 
         dxy_sailing = displacement * np.array([-np.sin(a), np.cos(a)])
 
@@ -341,7 +346,7 @@ class Displacement:
         return si * 1.94
 
     def with_uncertainty(self, sigma=1) -> np.ndarray:
-        """Adds normal distributed noise to the current position.
+        """Adds normal distributed noise to the current position, pre-drawn for the vessel if it has a noise path.
 
         Args:
             sigma (float): The standard deviation of the added noise. Default: 1.
@@ -350,10 +355,24 @@ class Displacement:
             Displacement: The Displacement object
         """
 
-        self.dxy += np.random.normal(0, sigma, size=self.dxy.shape)
+        if self.vessel.noise is not None:
+            self.dxy += sigma * self.vessel.noise.normal[self.vessel.steps]
+        else:
+            self.dxy += np.random.normal(0, sigma, size=self.dxy.shape)
         
         return self
 
+    def reverse(self):
+        """Reverses the displacement, to step back in time against the winds and currents.
+
+        Returns:
+            Displacement: The Displacement object
+        """
+
+        self.dxy = -self.dxy
+
+        return self
+
     def km(self):
         """Returns the displacement in kilometres, from metres.
 
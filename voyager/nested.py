@@ -0,0 +1,453 @@
+import numpy as np
+import pandas as pd
+import dask
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from scipy import ndimage
+from scipy.spatial import cKDTree
+from typing import *
+
+from . import utils
+from . import search
+from . import field
+from .chart import Chart, _interpolate
+
+# A node of a nested grid, as the level and the position on the grid of the level
+Node = Tuple[int, int, int]
+
+class Level:
+    """
+    A level of a nested chart: the velocity fields and the weighted grid at one resolution,
+    covering a bounding box of the chart.
+    """
+
+    def __init__(self, bbox: List[float], fields: Dict[str, xr.DataArray], grid: search.WeightedGrid) -> None:
+        """
+        Args:
+            bbox (List[float]): Bounding box owned by the level, where it is the finest level
+            fields (Dict[str, xr.DataArray]): Packed velocity fields by name, as u_current, v_current, u_wind and v_wind
+            grid (search.WeightedGrid): The weighted grid on the currents of the level
+        """
+
+        self.bbox   = bbox
+        self.fields = fields
+        self.grid   = grid
+
+        self.longitudes = fields["u_current"].longitude.values
+        self.latitudes  = fields["u_current"].latitude.values
+        self.spacing    = float(np.diff(self.longitudes).mean()) if len(self.longitudes) > 1 else 1.0
+
+    def contains(self, longitude: np.ndarray, latitude: np.ndarray) -> np.ndarray:
+        """Whether positions are within the bounding box of the level."""
+
+        return (longitude >= self.bbox[0]) & (longitude <= self.bbox[2]) & \
+               (latitude  >= self.bbox[1]) & (latitude  <= self.bbox[3])
+
+
+class NestedField:
+    """
+    The NestedField samples a velocity field from the finest of a number of levels at every position,
+    with the same interface as a Field.
+    """
+
+    def __init__(self, levels: List[Tuple[Level, field.Field]]) -> None:
+        """
+        Args:
+            levels (List[Tuple[Level, field.Field]]): The levels with their field, the finest first
+        """
+
+        self.levels = levels
+
+    def __call__(self, points) -> np.ndarray:
+        """Samples the field.
+
+        Args:
+            points: A tuple of (time, longitude, latitude), or an array with the last dimension of size 3
+
+        Returns:
+            np.ndarray: The sampled values, NaN outside the field
+        """
+
+        if isinstance(points, tuple):
+            t, longitude, latitude = np.broadcast_arrays(*(np.asarray(p, dtype=np.float64) for p in points))
+        else:
+            points = np.asarray(points, dtype=np.float64)
+            t, longitude, latitude = points[..., 0], points[..., 1], points[..., 2]
+
+        shape = t.shape
+        t, longitude, latitude = t.ravel(), longitude.ravel(), latitude.ravel()
+
+        out = np.full(t.shape, np.nan)
+        remaining = np.ones(t.shape, dtype=bool)
+
+        for level, f in self.levels:
+
+            selected = remaining & level.contains(longitude, latitude)
+
+            if selected.any():
+                out[selected] = f((t[selected], longitude[selected], latitude[selected]))
+                remaining &= ~selected
+
+        return out.reshape(shape)
+
+
+class NestedGrid:
+    """
+    The NestedGrid joins the weighted grids of the levels of a nested chart into one graph for path finding.
+
+    A node of a level is active where the level is the finest one. The active nodes on the border of a level are linked
+    to the nearby active nodes of the other levels. The cost of a move is the weight of the cell entered times the length of the move
+    in cells of the finest level, such that long moves on coarse levels cost as much as the fine moves they replace.
+    Lengths are Euclidean, so that among the many routes of equal moves the straightest one is found.
+    """
+
+    def __init__(self, levels: List[Level]) -> None:
+        """
+        Args:
+            levels (List[Level]): The levels, the coarsest first
+        """
+
+        self.levels  = levels
+        self.spacing = min(level.spacing for level in levels)
+
+        self.active = []
+        for k, level in enumerate(levels):
+
+            latitude, longitude = np.meshgrid(level.latitudes, level.longitudes, indexing="ij")
+
+            owned = level.contains(longitude, latitude)
+
+            # Finer levels take over their bounding box, and among equally fine levels the first one does
+            for other in levels[k + 1:] if k == 0 else levels[1:k]:
+                owned &= ~other.contains(longitude, latitude)
+
+            self.active.append(owned & ~level.grid.walls)
+
+        self.links: Dict[Node, List[Node]] = {}
+        self._link_levels()
+
+        weights = [np.nanmin(level.grid.weights[active]) for level, active in zip(levels, self.active) if active.any()]
+        self.minimum_cost = min(weights) if weights else 1
+
+    def _link_levels(self):
+        """Links the active nodes on the border of every level to the active nodes of other levels within the spacing of the coarser one,
+        where the cells crossed by the link are passable, see _clear."""
+
+        nodes = []
+        for k, active in enumerate(self.active):
+
+            # Active nodes next to an inactive node or the edge of the grid
+            inactive = np.pad(~active, 1, constant_values=True)
+            border = active & ndimage.binary_dilation(inactive, structure=np.ones((3, 3)))[1:-1, 1:-1]
+
+            nodes.extend((k, j, i) for j, i in zip(*np.nonzero(border)))
+
+        if not nodes:
+            return
+
+        coordinates = np.array([self.coordinates(node) for node in nodes])
+        radius = max(level.spacing for level in self.levels)
+
+        for a, b in cKDTree(coordinates).query_pairs(radius * (1 + 1e-9), p=np.inf):
+
+            u, v = nodes[a], nodes[b]
+
+            if u[0] == v[0]:
+                continue
+
+            if np.abs(coordinates[a] - coordinates[b]).max() <= max(self.levels[u[0]].spacing, self.levels[v[0]].spacing) * (1 + 1e-9) \
+               and self._clear(u, v):
+                self.links.setdefault(u, []).append(v)
+                self.links.setdefault(v, []).append(u)
+
+    def _clear(self, u: Node, v: Node) -> bool:
+        """Whether the segment between two nodes of different levels only crosses passable cells. The segment is sampled
+        every half cell of the finer level, and every sample is checked on the finer level where its grid covers it,
+        and on the coarser level elsewhere.
+
+        Args:
+            u (Node): A node
+            v (Node): A node of another level
+
+        Returns:
+            bool: Whether no sample falls on land
+        """
+
+        a, b = np.array(self.coordinates(u)), np.array(self.coordinates(v))
+        fine, coarse = sorted((self.levels[u[0]], self.levels[v[0]]), key=lambda level: level.spacing)
+
+        n = int(np.ceil(2 * np.abs(b - a).max() / fine.spacing)) + 1
+        samples = a + np.linspace(0, 1, n)[:, None] * (b - a)
+
+        for longitude, latitude in samples:
+
+            level = fine if (fine.longitudes.min() <= longitude <= fine.longitudes.max() and 
+                             fine.latitudes.min()  <= latitude  <= fine.latitudes.max()) else coarse
+
+            j = int(np.abs(level.latitudes - latitude).argmin())
+            i = int(np.abs(level.longitudes - longitude).argmin())
+
+            if level.grid.walls[j, i]:
+                return False
+
+        return True
+
+    def coordinates(self, node: Node) -> Tuple[float, float]:
+        """The longitude and latitude of a node."""
+
+        k, j, i = node
+        return (float(self.levels[k].longitudes[i]), float(self.levels[k].latitudes[j]))
+
+    def locate(self, longitude: float, latitude: float) -> Node:
+        """The active node closest to a position, on the finest level containing it.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Raises:
+            ValueError: Raised if no level has an active node
+
+        Returns:
+            Node: The closest node
+        """
+
+        order = sorted(range(len(self.levels)), key=lambda k: (not self.levels[k].contains(longitude, latitude), self.levels[k].spacing))
+
+        for k in order:
+
+            active = self.active[k]
+            if not active.any():
+                continue
+
+            level = self.levels[k]
+            j = int(np.abs(level.latitudes - latitude).argmin())
+            i = int(np.abs(level.longitudes - longitude).argmin())
+
+            if not active[j, i]:
+                _, indices = ndimage.distance_transform_edt(~active, return_indices=True)
+                j, i = int(indices[0][j, i]), int(indices[1][j, i])
+
+            return (k, j, i)
+
+        raise ValueError("No passable node in the nested grid")
+
+    def neighbors(self, id: Node) -> Iterator[Node]:
+
+        k, j, i = id
+        active = self.active[k]
+
+        neighbors = [(k, j + dj, i + di) for dj, di in search.MOVES
+                     if 0 <= j + dj < active.shape[0] and 0 <= i + di < active.shape[1] and active[j + dj, i + di]]
+
+        # As in Grid.neighbors, alternating the order avoids ugly paths
+        if (j + i) % 2 == 0: neighbors.reverse()
+
+        return iter(neighbors + self.links.get(id, []))
+
+    def cost(self, from_node: Node, to_node: Node) -> float:
+
+        (x1, y1), (x2, y2) = self.coordinates(from_node), self.coordinates(to_node)
+        length = np.hypot(x1 - x2, y1 - y2) / self.spacing
+
+        return self.levels[to_node[0]].grid.weights[to_node[1:]] * length
+
+    def heuristic(self, a: Node, b: Node) -> float:
+        """Admissible distance measure between two nodes, in cells of the finest level."""
+
+        (x1, y1), (x2, y2) = self.coordinates(a), self.coordinates(b)
+
+        return self.minimum_cost * np.hypot(x1 - x2, y1 - y2) / self.spacing
+
+
+class NestedChart(Chart):
+    """
+    The NestedChart is a Chart at a coarse resolution over the bounding box, with patches at the full resolution of the data
+    around the coastlines, or in given regions.
+
+    The velocity fields are sampled from the finest level at every position, and routes are searched on a graph joining the
+    grids of all levels, so open ocean is crossed in coarse steps while straits and fjords keep their detail.
+
+    Without given patches, the bounding box is split into square patches, and those with sea within a coast distance
+    of the land on the coarse level are loaded at full resolution.
+    """
+
+    def __init__(self, bbox, start_date, end_date, factor=4, patches=None, patch_size=2.0, coast_distance=1, precision="float64") -> None:
+        """
+        Args:
+            bbox (List): Bounding box of the chart
+            start_date (pd.Timestamp): Start date of the chart
+            end_date (pd.Timestamp): End date of the chart
+            factor (int, optional): Decimation of the coarse level in grid cells. Defaults to 4.
+            patches (List[List[float]], optional): Bounding boxes of the full resolution patches. Defaults to None, around the coastlines.
+            patch_size (float, optional): Width and height in degrees of the patches around the coastlines. Defaults to 2.0.
+            coast_distance (int, optional): Distance to the land in coarse cells of the sea covered by patches. Defaults to 1.
+            precision (str, optional): Precision the velocity fields are stored with. Defaults to "float64".
+        """
+
+        super().__init__(bbox, start_date, end_date, precision=precision)
+
+        self.factor         = factor
+        self.patches        = patches
+        self.patch_size     = patch_size
+        self.coast_distance = coast_distance
+
+        self.levels: List[Level] = []
+
+    def load(self, data_dir: str, **kwargs):
+        """Loads the coarse level and the patches, and joins their grids for path finding.
+
+        Args:
+            data_dir (str): The root directory of the velocity data
+            kwargs: Parameters of the shoreline weights, see WeightedGrid.from_map
+
+        Returns:
+            NestedChart: The NestedChart instance
+        """
+
+        self.data_dir = data_dir
+
+        # The full resolution is only held while the levels are cut from it
+        with dask.config.set(**{'array.slicing.split_large_chunks': True}):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+
+                currents = executor.submit(utils.load_data, start=self.start_date,
+                                                            end=self.end_date,
+                                                            bbox=self.bbox,
+                                                            data_directory=self.data_dir,
+                                                            source="currents")
+
+                winds    = executor.submit(utils.load_data, start=self.start_date,
+                                                            end=self.end_date,
+                                                            bbox=self.bbox,
+                                                            data_directory=self.data_dir,
+                                                            source="winds")
+
+                data = dict(zip(("u_current", "v_current", "u_wind", "v_wind"), (*currents.result(), *winds.result())))
+
+        coarse = self._level(data, self.bbox, self.factor, **kwargs)
+
+        patches = self.patches if self.patches is not None else self.coastal_patches(coarse)
+
+        # Patches are cut with a margin of a coarse cell, so they interpolate up to their edges
+        margin = coarse.spacing
+        levels = []
+        for bbox in patches:
+
+            bbox = [max(bbox[0], self.bbox[0]), max(bbox[1], self.bbox[1]), min(bbox[2], self.bbox[2]), min(bbox[3], self.bbox[3])]
+
+            level = self._level(data, [max(bbox[0] - margin, self.bbox[0]), max(bbox[1] - margin, self.bbox[1]),
+                                       min(bbox[2] + margin, self.bbox[2]), min(bbox[3] + margin, self.bbox[3])], 1, **kwargs)
+            level.bbox = bbox
+
+            levels.append(level)
+
+        self.levels = [coarse, *levels]
+
+        self.longitudes = coarse.longitudes
+        self.latitudes  = coarse.latitudes
+
+        self.grid  = NestedGrid(self.levels)
+        self.astar = search.Astar(self.grid, heuristic=self.grid.heuristic)
+
+        return self
+
+    def _level(self, data: Dict[str, xr.DataArray], bbox: List[float], factor: int, **kwargs) -> Level:
+        """Cuts a level from the velocity fields at full resolution, keeping every factor-th grid cell in a bounding box.
+
+        The widths of the shoreline bands are given in cells of the full resolution, and are divided by the factor,
+        such that the bands are equally wide in degrees on every level.
+
+        Args:
+            data (Dict[str, xr.DataArray]): The velocity fields at full resolution by name
+            bbox (List[float]): Bounding box of the level
+            factor (int): Decimation in grid cells
+            kwargs: Parameters of the shoreline weights, see WeightedGrid.from_map
+
+        Returns:
+            Level: The loaded level
+        """
+
+        fields = {}
+        for name, x in data.items():
+
+            x = x.sel(longitude=slice(bbox[0], bbox[2]), latitude=slice(bbox[1], bbox[3]))
+            x = x.isel(longitude=slice(None, None, factor), latitude=slice(None, None, factor))
+
+            # Copied, so the full resolution data is released
+            fields[name] = field.pack(x.copy(), self.precision)
+
+        # The default band widths of WeightedGrid.from_map, in cells of the level
+        iterations = [iters / factor for iters in kwargs.pop("iterations", [1, 4])]
+
+        map  = field.unpack(fields["u_current"].sel(time=self.start_date))
+        grid = search.WeightedGrid.from_map(map, iterations=iterations, **kwargs)
+
+        return Level(bbox, fields, grid)
+
+    def coastal_patches(self, coarse: Level) -> List[List[float]]:
+        """The patches with sea within the coast distance of the land on the coarse level.
+
+        Args:
+            coarse (Level): The coarse level
+
+        Returns:
+            List[List[float]]: Bounding boxes of the patches
+        """
+
+        land = coarse.grid.walls
+
+        if not land.any():
+            return []
+
+        distance = ndimage.distance_transform_cdt(~land, metric="chessboard")
+        j, i = np.nonzero(~land & (distance <= self.coast_distance))
+
+        x = np.floor((coarse.longitudes[i] - self.bbox[0]) / self.patch_size).astype(int)
+        y = np.floor((coarse.latitudes[j]  - self.bbox[1]) / self.patch_size).astype(int)
+
+        return [[self.bbox[0] + a * self.patch_size, self.bbox[1] + b * self.patch_size,
+                 self.bbox[0] + (a + 1) * self.patch_size, self.bbox[1] + (b + 1) * self.patch_size]
+                for a, b in sorted(set(zip(x, y)))]
+
+    def position(self, longitude: float, latitude: float) -> Node:
+
+        return self.grid.locate(longitude, latitude)
+
+    def coordinates(self, id: Node) -> Tuple[float, float]:
+
+        return self.grid.coordinates(id)
+
+    def interpolate(self, date: pd.Timestamp, duration: int):
+        """Interpolates the loaded data of every level for a certain timestamp, and a duration in days.
+
+        Args:
+            date (pd.Timestamp): Date to start interpolating from
+            duration (int): Duration of the interpolation in days
+
+        Returns:
+            NestedChart: The NestedChart instance
+        """
+
+        end_date = date + pd.Timedelta(duration, 'D')
+
+        # The patches are sampled before the coarse level
+        levels = [*self.levels[1:], self.levels[0]]
+
+        for name in ("u_current", "v_current", "u_wind", "v_wind"):
+            setattr(self, name, NestedField([(level, _interpolate(level.fields[name], date, end_date)) for level in levels]))
+
+        return self
+
+    def cells(self) -> Dict[str, int]:
+        """The number of grid cells stored by the chart, and by a uniform chart at full resolution.
+
+        Returns:
+            Dict[str, int]: The cells of the coarse level, of the patches, in total, and of the uniform chart
+        """
+
+        coarse  = self.levels[0].grid.width * self.levels[0].grid.height
+        patches = sum(level.grid.width * level.grid.height for level in self.levels[1:])
+
+        return {"coarse": coarse, "patches": patches, "total": coarse + patches,
+                "uniform": coarse * self.factor ** 2}
@@ -0,0 +1,303 @@
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import *
+
+from .chart import Chart
+from .models import Model
+from .vessel import Vessel
+from .destinations import Destinations
+from .sampling import Sampler
+from . import geo, search, utils
+
+N_SECONDS_IN_DAY = 86400
+
+class ODMatrix:
+    """
+    The ODMatrix simulates the voyages between every pair of a list of ports, and collects the arrival probability,
+    the quantiles of the transit time and the mean distance of every origin and destination.
+
+    The chart is loaded once. One cost-to-go field per destination is computed over the shared WeightedGrid, from which the
+    route from any origin is read off without further search. Every launch window is interpolated once and shared by all pairs.
+    Drifting vessels do not head for a destination, so one ensemble per origin arrives at whichever port it reaches first.
+    """
+
+    def __init__(self, ports: List[Tuple[float, float]],
+                       names: List[str] = None,
+                       mode = 'drifting',
+                       craft = 1,
+                       speed = 2,
+                       duration = 60,
+                       timestep = 1,
+                       start_date = '',
+                       end_date = '',
+                       launch_freq = 5,
+                       bbox = [],
+                       data_directory = '',
+                       vessel_config = 'configs/vessels.yml',
+                       replicates = 10,
+                       radius = 10,
+                       quantiles = (0.25, 0.5, 0.75),
+                       interval = 5,
+                       sampling = 'random',
+                       stratified = False,
+                       seed = None) -> None:
+        """
+        Args:
+            ports (List[Tuple[float, float]]): Positions of the ports as [longitude, latitude]
+            names (List[str], optional): Names of the ports. Defaults to their indices.
+            radius (float, optional): Distance in km from a port counting as arrived, for drifting vessels. Defaults to 10.
+            replicates (int, optional): Number of vessels per origin, destination and launch date. Defaults to 10.
+            quantiles (tuple, optional): Quantiles of the transit time. Defaults to (0.25, 0.5, 0.75).
+            interval (int, optional): Interval of the route targets. Defaults to 5.
+            sampling (str, optional): Sampling of the noise paths of the replicates, see Sampler. Defaults to 'random'.
+            stratified (bool, optional): Whether to stratify the deflection signs of the replicates. Defaults to False.
+            seed (int, optional): Seed of the noise paths, making the matrices reproducible. Defaults to None.
+        """
+
+        self.ports       = [tuple(port) for port in ports]
+        self.names       = names if names is not None else [str(i) for i in range(len(ports))]
+        self.mode        = mode
+        self.craft       = craft
+        self.speed       = speed
+        self.duration    = duration
+        self.dt          = timestep
+        self.replicates  = replicates
+        self.radius      = radius
+        self.quantiles   = quantiles
+        self.interval    = interval
+        self.sampling    = sampling
+        self.stratified  = stratified
+        self.seed        = seed
+
+        self.vessel_params  = utils.load_vessel_config(vessel_config)
+        self.data_directory = data_directory
+        self.bbox           = bbox
+
+        self.start_date = pd.to_datetime(start_date)
+        self.end_date   = pd.to_datetime(end_date)
+        self.dates      = pd.date_range(self.start_date, self.end_date)
+        self.launch_day_frequency = launch_freq
+
+        n = len(self.ports)
+
+        self.launched  = np.zeros((n, n), dtype=int)
+        self.arrivals  = np.zeros((n, n), dtype=int)
+        self.distances = np.zeros((n, n))
+        self.times     = [[[] for _ in range(n)] for _ in range(n)]
+
+    def routes(self, chart: Chart) -> List[List[Optional[List[Tuple[float, float]]]]]:
+        """Plans the routes between all ports from one cost-to-go field per destination.
+
+        Args:
+            chart (Chart): A loaded Chart object
+
+        Returns:
+            List[List[Optional[List[Tuple[float, float]]]]]: The route from every origin to every destination in reverse order,
+                                                             as from Vessel.plan_route, or None if there is no route
+        """
+
+        grid = chart.grid
+
+        cells = [search.nearest_passable(grid, (geo.closest_coordinate_index(chart.latitudes, y),
+                                                geo.closest_coordinate_index(chart.longitudes, x)))
+                 for x, y in self.ports]
+
+        fields = search.cost_fields(grid, cells)
+
+        routes = [[None] * len(cells) for _ in cells]
+        for o, origin in enumerate(cells):
+            for d, field in enumerate(fields):
+
+                if o == d or not np.isfinite(field[origin]):
+                    continue
+
+                route = search.descend(grid, field, origin)
+                route = [(chart.longitudes[i], chart.latitudes[j]) for j, i in route]
+                route = [route[0], *route[1:-2:self.interval], route[-1]]
+                route.reverse()
+
+                routes[o][d] = route
+
+        return routes
+
+    def run(self, model_kwargs={}, chart_kwargs={}, parallel=False):
+        """Simulates the voyages between all ports for every launch date.
+
+        Args:
+            model_kwargs (dict, optional): Parameters for the model. Defaults to {}.
+            chart_kwargs (dict, optional): Parameter for the chart. Defaults to {}.
+            parallel (bool, optional): Whether to simulate the vessels of a launch date in a process pool. Defaults to False.
+
+        Returns:
+            ODMatrix: The ODMatrix instance
+        """
+
+        chart = Chart(self.bbox, self.start_date, self.end_date).load(self.data_directory, **chart_kwargs)
+
+        # Only the fixed-size records are needed
+        model  = Model(self.duration, self.dt, **{"record": "summary", **model_kwargs})
+        params = self.vessel_params[self.mode][self.craft]
+
+        drifting = self.mode == 'drifting'
+        routes   = None if drifting else self.routes(chart)
+
+        # Drifting vessels arrive at any other port than their origin
+        destinations = [Destinations([p for d, p in enumerate(self.ports) if d != o], self.radius,
+                                     names=[str(d) for d in range(len(self.ports)) if d != o])
+                        for o in range(len(self.ports))] if drifting else None
+
+        # Pairs of origin and destination simulated, the destination None for drifting
+        pairs = [(o, None) for o in range(len(self.ports))] if drifting else \
+                [(o, d) for o in range(len(self.ports)) for d in range(len(self.ports)) if routes[o][d] is not None]
+
+        n_steps = len(np.arange(start=0, stop=self.duration, step=self.dt/N_SECONDS_IN_DAY))
+
+        pool = mp.Pool(mp.cpu_count()) if parallel else None
+
+        try:
+            for k, date in enumerate(self.dates[::self.launch_day_frequency]):
+
+                chart.interpolate(date, self.duration)
+                model.use(chart)
+
+                for o, d in pairs:
+
+                    if drifting:
+                        model.arrive_at(destinations[o])
+
+                    sampler = Sampler(self.sampling, self.stratified,
+                                      seed=None if self.seed is None else (self.seed, k, o, len(self.ports) if d is None else d))
+
+                    vessels = [Vessel(*self.ports[o],
+                                      craft = self.craft,
+                                      mode = self.mode,
+                                      route = list(routes[o][d]) if d is not None else None,
+                                      destination = self.ports[d] if d is not None else None,
+                                      speed = self.speed,
+                                      params = params)
+                               for _ in range(self.replicates)]
+
+                    for vessel, noise in zip(vessels, sampler.paths(self.replicates, n_steps)):
+                        vessel.noise = noise
+
+                    # The ensemble is stepped together, checking the arrivals at the ports with one query per step
+                    if pool is not None:
+                        size    = -(-len(vessels) // mp.cpu_count())
+                        vessels = [vessel for chunk in pool.map(model.run_batch, [vessels[i:i+size] for i in range(0, len(vessels), size)])
+                                          for vessel in chunk]
+                    else:
+                        vessels = model.run_batch(vessels)
+
+                    self.tally(o, d, [vessel.summary() for vessel in vessels])
+
+        finally:
+            if pool is not None:
+                pool.close()
+
+        return self
+
+    def tally(self, origin: int, destination: Optional[int], summaries: List):
+        """Adds the records of an ensemble launched from an origin.
+
+        Args:
+            origin (int): Index of the origin
+            destination (Optional[int]): Index of the destination, None if the vessels arrive at any port
+            summaries (List[Summary]): The records of the simulated vessels
+
+        Returns:
+            ODMatrix: The ODMatrix instance
+        """
+
+        if destination is None:
+            self.launched[origin, np.arange(len(self.ports)) != origin] += len(summaries)
+        else:
+            self.launched[origin, destination] += len(summaries)
+
+        for summary in summaries:
+
+            if not summary.arrived:
+                continue
+
+            if destination is None:
+                d = int(summary.landfall["name"])
+                t = summary.landfall["time"]
+            else:
+                d = destination
+                t = summary.steps * self.dt / N_SECONDS_IN_DAY
+
+            self.arrivals[origin, d]  += 1
+            self.distances[origin, d] += summary.distance
+            self.times[origin][d].append(t)
+
+        return self
+
+    def probability(self) -> np.ndarray:
+        """The arrival probability between every origin and destination.
+
+        Returns:
+            np.ndarray: Matrix with shape (N, N), NaN where no vessels were launched
+        """
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.launched > 0, self.arrivals / self.launched, np.nan)
+
+    def transit_times(self) -> np.ndarray:
+        """The quantiles of the transit time in days of the arrived vessels.
+
+        Returns:
+            np.ndarray: Matrices with shape (len(quantiles), N, N), NaN where no vessels arrived
+        """
+
+        n = len(self.ports)
+        out = np.full((len(self.quantiles), n, n), np.nan)
+
+        for o in range(n):
+            for d in range(n):
+                if self.times[o][d]:
+                    out[:, o, d] = np.quantile(self.times[o][d], self.quantiles)
+
+        return out
+
+    def distance(self) -> np.ndarray:
+        """The mean distance in km travelled by the arrived vessels.
+
+        Returns:
+            np.ndarray: Matrix with shape (N, N), NaN where no vessels arrived
+        """
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.arrivals > 0, self.distances / self.arrivals, np.nan)
+
+    def to_xarray(self) -> xr.Dataset:
+        """The matrices as an xarray Dataset.
+
+        Returns:
+            xr.Dataset: Dataset with probability, transit_time, distance, launched and arrivals over origin and destination
+        """
+
+        coords = {"origin": self.names, "destination": self.names, "quantile": list(self.quantiles)}
+
+        return xr.Dataset({
+            "probability": (("origin", "destination"), self.probability()),
+            "transit_time": (("quantile", "origin", "destination"), self.transit_times()),
+            "distance": (("origin", "destination"), self.distance()),
+            "launched": (("origin", "destination"), self.launched),
+            "arrivals": (("origin", "destination"), self.arrivals),
+        }, coords=coords, attrs={
+            "mode": self.mode,
+            "craft": self.craft,
+            "start_date": self.start_date.strftime('%Y-%m-%d'),
+            "end_date": self.end_date.strftime('%Y-%m-%d'),
+        })
+
+    def to_netcdf(self, filename: str):
+        """Saves the matrices to a NetCDF file.
+
+        Args:
+            filename (str): The NetCDF file
+        """
+
+        self.to_xarray().to_netcdf(filename)
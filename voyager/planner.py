@@ -0,0 +1,326 @@
+import json
+import multiprocessing as mp
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import *
+
+from . import utils, search
+from .field import Field
+from .models import Model
+from .vessel import Vessel
+
+N_SECONDS_IN_DAY = 86400
+
+# Variables of the velocity components in the raw data files
+VARIABLES = {"currents": "uo_oras", "winds": "u10"}
+
+# Bytes of a recorded position kept as a Python list of two floats
+BYTES_PER_LISTED_POSITION = 120
+
+# Bytes per node held in the A* dictionaries and priority queue
+BYTES_PER_ASTAR_NODE = 250
+
+class Planner:
+    """
+    The Planner estimates the resources of a campaign before it is started: the peak memory, the runtime
+    for a number of cores and the size of the output.
+
+    Only the metadata of the netCDF files are read. The costs of a simulation step and of an A* node are
+    calibrated with a short micro-benchmark on the current machine.
+    """
+
+    def __init__(self, bbox: List[float],
+                       start_date,
+                       end_date,
+                       duration: int,
+                       timestep: float,
+                       departure_points: List[Tuple[float, float]],
+                       data_directory: str,
+                       launch_freq: int = 1,
+                       replicates: int = 1,
+                       mode: str = 'drifting',
+                       craft: int = 1,
+                       destination: Tuple[float, float] = None,
+                       precision: str = "float64",
+                       tile_size: float = None,
+                       max_tiles: int = 64,
+                       tile_margin: float = 1.0) -> None:
+
+        self.bbox             = bbox
+        self.start_date       = pd.Timestamp(start_date)
+        self.end_date         = pd.Timestamp(end_date)
+        self.duration         = duration
+        self.dt               = timestep
+        self.departure_points = departure_points
+        self.data_directory   = data_directory
+        self.launch_freq      = launch_freq
+        self.replicates       = replicates
+        self.mode             = mode
+        self.craft            = craft
+        self.destination      = destination
+        self.precision        = precision
+        self.tile_size        = tile_size
+        self.max_tiles        = max_tiles
+        self.tile_margin      = tile_margin
+
+    @classmethod
+    def from_traverser(cls, traverser, replicates: int = 1, **chart_kwargs):
+        """Creates a Planner for the campaign of a Traverser.
+
+        Args:
+            traverser (Traverser): A Traverser object
+            replicates (int, optional): Number of vessels per departure point and date. Defaults to 1.
+            chart_kwargs: Parameters of the chart, such as precision and tile_size
+
+        Returns:
+            Planner: A Planner instance
+        """
+
+        return cls(traverser.bbox, traverser.start_date, traverser.end_date, traverser.duration, traverser.dt,
+                   traverser.departure_points, traverser.data_directory,
+                   launch_freq=traverser.launch_day_frequency,
+                   replicates=replicates,
+                   mode=traverser.mode,
+                   craft=traverser.craft,
+                   destination=traverser.destination,
+                   **chart_kwargs)
+
+    def grid(self, source: str) -> Dict:
+        """Reads the dimensions of the velocity fields of a source within the bounding box and date range from the file metadata.
+
+        Args:
+            source (str): Data source, either "currents" or "winds"
+
+        Raises:
+            FileNotFoundError: Raised if a month in the date range has no data file
+
+        Returns:
+            Dict: The number of times, latitudes and longitudes, the grid spacing, and the bytes per value in the files
+        """
+
+        filenames = utils.select_files(utils.index_files(self.data_directory, source), self.start_date, self.end_date)
+
+        # Opening is lazy, only the coordinates are read
+        with xr.open_dataset(filenames[0]) as data:
+
+            longitudes = data.longitude.values
+            latitudes  = data.latitude.values
+            itemsize   = data[VARIABLES[source]].dtype.itemsize
+
+        if source == "winds":
+            longitudes = utils.normalize_longitude(longitudes)
+
+        longitudes = np.sort(longitudes[(longitudes >= self.bbox[0]) & (longitudes <= self.bbox[2])])
+        latitudes  = np.sort(latitudes[(latitudes >= self.bbox[1]) & (latitudes <= self.bbox[3])])
+
+        return {
+            "times": len(pd.date_range(self.start_date, self.end_date)),
+            "latitudes": len(latitudes),
+            "longitudes": len(longitudes),
+            "spacing": float(np.diff(longitudes).mean()) if len(longitudes) > 1 else 1.0,
+            "itemsize": itemsize
+        }
+
+    def tasks(self) -> Dict:
+        """Counts the tasks of the campaign.
+
+        Returns:
+            Dict: The number of launch dates, vessels, steps per vessel, total steps and A* searches
+        """
+
+        dates   = len(pd.date_range(self.start_date, self.end_date)[::self.launch_freq])
+        vessels = dates * len(self.departure_points) * self.replicates
+        steps   = len(np.arange(start=0, stop=self.duration, step=self.dt/N_SECONDS_IN_DAY))
+
+        # Routes are planned for every departure point and date when there is a destination
+        searches = dates * len(self.departure_points) if self.destination else 0
+
+        return {"dates": dates, "vessels": vessels, "steps_per_vessel": steps, "steps": vessels * steps, "searches": searches}
+
+    @staticmethod
+    def calibrate(n_steps: int = 2000, grid_size: int = 100, jit: bool = False, vessel_config: str = 'configs/vessels.yml', 
+                  mode: str = 'drifting', craft: int = 1) -> Dict[str, float]:
+        """Measures the cost of a simulation step and of an A* node on the current machine, on synthetic data.
+        Paddling and sailing craft are timed along a route of milestones, as they steer to their targets.
+
+        Args:
+            n_steps (int, optional): Number of simulation steps to time. Defaults to 2000.
+            grid_size (int, optional): Width and height of the grid to search. Defaults to 100.
+            jit (bool, optional): Whether to time the compiled kernel. Defaults to False.
+            vessel_config (str, optional): The vessel configuration. Defaults to 'configs/vessels.yml'.
+            mode (str, optional): The mode of propulsion timed. Defaults to 'drifting'.
+            craft (int, optional): The craft type timed. Defaults to 1.
+
+        Returns:
+            Dict[str, float]: Seconds per step and per A* node, and bytes per position of GeoJSON output
+        """
+
+        rng = np.random.default_rng(0)
+
+        # A calm synthetic chart, large enough that the vessels stay in it
+        longitudes = np.linspace(-20, 20, 81)
+        latitudes  = np.linspace(40, 70, 61)
+        fields = {name: Field(rng.normal(0, 0.1, (31, 61, 81)), longitudes, latitudes)
+                  for name in ("u_current", "v_current", "u_wind", "v_wind")}
+
+        chart = SimpleNamespace(**fields)
+        model = Model(30, 3600, sigma=10, jit=jit).use(chart)
+        params = utils.load_vessel_config(vessel_config)[mode][craft]
+
+        # Ten milestones towards a destination, in reverse order as planned by Vessel.plan_route
+        destination = (15.0, 65.0)
+        route = [(float(x), float(y)) for x, y in np.linspace((0, 55), destination, 11)[1:]][::-1] if mode != "drifting" else None
+
+        def launch():
+            return Vessel(0, 55, craft=craft, mode=mode, params=params, speed=2,
+                          route=list(route) if route is not None else None,
+                          destination=destination if route is not None else None)
+
+        # Compile outside of the timing
+        model.run(launch())
+
+        steps, elapsed, trajectory = 0, 0.0, None
+        while steps < n_steps:
+            vessel = launch()
+
+            start = time.perf_counter()
+            model.run(vessel)
+            elapsed += time.perf_counter() - start
+
+            steps += len(vessel.trajectory) - 1
+            trajectory = vessel.coordinates()
+
+        # A* from corner to corner on an open grid
+        grid  = search.WeightedGrid(grid_size, grid_size)
+        astar = search.Astar(grid)
+
+        start = time.perf_counter()
+        _, cost_so_far = astar.search((0, 0), (grid_size - 1, grid_size - 1))
+        astar_elapsed = time.perf_counter() - start
+
+        output = json.dumps({"type": "LineString", "coordinates": trajectory}, indent=4)
+
+        return {
+            "step": elapsed / steps,
+            "astar_node": astar_elapsed / len(cost_so_far),
+            "output_position": len(output) / len(trajectory)
+        }
+
+    def estimate(self, calibration: Dict[str, float] = None, cores: List[int] = None) -> Dict:
+        """Estimates the resources of the campaign. The runtime and output are upper bounds,
+        as vessels stopping early at land or at their destination are counted for the full duration.
+
+        Args:
+            calibration (Dict[str, float], optional): Costs from calibrate. Defaults to None, calibrating now.
+            cores (List[int], optional): Numbers of cores to estimate the runtime for. Defaults to powers of two up to the cores of the machine.
+
+        Returns:
+            Dict: Bytes of memory by component and at peak, seconds of runtime by number of cores, and bytes of output
+        """
+
+        calibration = calibration if calibration is not None else self.calibrate(mode=self.mode, craft=self.craft)
+        cores       = cores if cores is not None else sorted({2 ** i for i in range(int(np.log2(mp.cpu_count())) + 1)} | {mp.cpu_count()})
+
+        tasks    = self.tasks()
+        itemsize = np.dtype("int16" if self.precision == "int16" else self.precision).itemsize
+
+        grids = {source: self.grid(source) for source in ("currents", "winds")}
+
+        load, fields, windows = 0, 0, 0
+        for source, g in grids.items():
+
+            cells = g["latitudes"] * g["longitudes"]
+
+            # Both components, as read from the files and as stored in the chart
+            raw    = 2 * g["times"] * cells * g["itemsize"]
+            stored = 2 * g["times"] * cells * itemsize
+
+            if self.tile_size:
+                tile_cells = ((self.tile_size + 2 * self.tile_margin) / g["spacing"] + 1) ** 2
+                stored = min(stored, self.max_tiles * 2 * g["times"] * tile_cells * itemsize)
+                raw    = 0
+
+            fields  += stored
+            windows += 2 * min(self.duration + 1, g["times"]) * cells * itemsize if not self.tile_size else 0
+
+            # The files of a source are decoded and concatenated before being stored
+            load += 2 * raw + stored
+
+        # Weights and walls of the shoreline grid, on the grid of the currents
+        cells = grids["currents"]["latitudes"] * grids["currents"]["longitudes"]
+        grid  = cells * (np.dtype(float).itemsize + 1)
+
+        # A* expands roughly the cells of the rectangle between a departure point and the destination
+        spacing = grids["currents"]["spacing"]
+        nodes = [max(abs(x - self.destination[0]) / spacing, 1) * max(abs(y - self.destination[1]) / spacing, 1)
+                 for x, y in self.departure_points] if self.destination else [0]
+        astar = max(nodes) * BYTES_PER_ASTAR_NODE
+
+        positions = tasks["vessels"] * (tasks["steps_per_vessel"] + 1)
+        results   = positions * BYTES_PER_LISTED_POSITION
+
+        memory = {
+            "loading": int(load),
+            "fields": int(fields),
+            "window": int(windows),
+            "grid": int(grid),
+            "astar": int(astar),
+            "results": int(results),
+        }
+
+        # Workers each hold a copy of the interpolated window
+        peak = {n: int(max(load + grid, fields + grid + astar + (1 + n) * windows + results)) for n in cores}
+
+        search_time = tasks["searches"] * np.mean(nodes) * calibration["astar_node"]
+
+        runtime = {n: float(search_time + tasks["steps"] * calibration["step"] / n) for n in cores}
+
+        return {
+            "grids": grids,
+            "tasks": tasks,
+            "memory": memory,
+            "peak_memory": peak,
+            "runtime": runtime,
+            "output": int(positions * calibration["output_position"])
+        }
+
+    def report(self, calibration: Dict[str, float] = None, cores: List[int] = None) -> str:
+        """Estimates the resources of the campaign as a readable report.
+
+        Args:
+            calibration (Dict[str, float], optional): Costs from calibrate. Defaults to None, calibrating now.
+            cores (List[int], optional): Numbers of cores to estimate the runtime for. Defaults to None.
+
+        Returns:
+            str: The report
+        """
+
+        estimate = self.estimate(calibration, cores)
+        tasks    = estimate["tasks"]
+
+        lines = [f"{tasks['dates']} dates, {tasks['vessels']} vessels, {tasks['steps']} steps, {tasks['searches']} route searches"]
+
+        for source, g in estimate["grids"].items():
+            lines.append(f"{source}: {g['times']} x {g['latitudes']} x {g['longitudes']}")
+
+        lines.append("memory: " + ", ".join(f"{name} {_bytes(b)}" for name, b in estimate["memory"].items()))
+
+        for n in estimate["runtime"]:
+            lines.append(f"{n} cores: peak memory {_bytes(estimate['peak_memory'][n])}, runtime {pd.Timedelta(estimate['runtime'][n], unit='s')}")
+
+        lines.append(f"output: {_bytes(estimate['output'])}")
+
+        return "\n".join(lines)
+
+def _bytes(n: float) -> str:
+
+    for unit in ("B", "kB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+    return f"{n:.1f} TB"
@@ -0,0 +1,247 @@
+import numpy as np
+import xarray as xr
+import pandas as pd
+from typing import *
+
+from . import geo
+
+
+class Accumulator:
+    """
+    The Accumulator collapses trajectories into rasters on the chart grid while the vessels are simulated,
+    so that large ensembles never need to keep their trajectories.
+
+    For every launch date it keeps the number of visits in each cell, the earliest time (in days after launch) any vessel
+    visited the cell, the number of vessels ending in each cell, and per departure point the number of launched and arrived vessels.
+    Backtracked vessels, see Model, end where they may have been launched, so their ends are the origin density of the arrival date.
+    """
+
+    def __init__(self, longitudes: np.ndarray, latitudes: np.ndarray) -> None:
+
+        self.longitudes = np.asarray(longitudes)
+        self.latitudes  = np.asarray(latitudes)
+
+        self.visits:      Dict[str, np.ndarray] = {}
+        self.first_visit: Dict[str, np.ndarray] = {}
+        self.ends:        Dict[str, np.ndarray] = {}
+        self.launched:    Dict[str, Dict[int, int]] = {}
+        self.arrived:     Dict[str, Dict[int, int]] = {}
+
+        self.date = None
+
+    @classmethod
+    def from_chart(cls, chart):
+        """Creates an empty Accumulator on the grid of a loaded Chart.
+
+        Args:
+            chart (Chart): A loaded Chart object
+
+        Returns:
+            Accumulator: An Accumulator instance
+        """
+
+        return cls(chart.longitudes, chart.latitudes)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.latitudes), len(self.longitudes))
+
+    def empty(self):
+        """Creates an empty Accumulator on the same grid, at the same launch date.
+
+        Returns:
+            Accumulator: An Accumulator instance
+        """
+
+        other = Accumulator(self.longitudes, self.latitudes)
+
+        if self.date is not None:
+            other.start(self.date)
+
+        return other
+
+    def start(self, date: str):
+        """Starts accumulating for a launch date. Subsequent visits are recorded for that date.
+
+        Args:
+            date (str): Launch date as a YYYY-MM-DD string
+
+        Returns:
+            Accumulator: The Accumulator instance
+        """
+
+        self.date = date
+
+        if date not in self.visits:
+            self.visits[date]      = np.zeros(self.shape, dtype=np.int64)
+            self.first_visit[date] = np.full(self.shape, np.inf)
+            self.ends[date]        = np.zeros(self.shape, dtype=np.int64)
+            self.launched[date]    = {}
+            self.arrived[date]     = {}
+
+        return self
+
+    def cell(self, longitude: float, latitude: float) -> Optional[Tuple[int, int]]:
+        """Finds the grid cell of a position.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Returns:
+            Optional[Tuple[int, int]]: The (latitude, longitude) indices of the cell, or None if outside the grid
+        """
+
+        longitude = float(np.squeeze(longitude))
+        latitude  = float(np.squeeze(latitude))
+
+        if not (self.longitudes[0] <= longitude <= self.longitudes[-1] and self.latitudes[0] <= latitude <= self.latitudes[-1]):
+            return None
+
+        i = geo.closest_coordinate_index(self.longitudes, longitude)
+        j = geo.closest_coordinate_index(self.latitudes, latitude)
+
+        return j, i
+
+    def visit(self, longitude: float, latitude: float, t: float):
+        """Records a visit of a vessel at a position and time.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+            t (float): Time in days after launch
+
+        Returns:
+            Accumulator: The Accumulator instance
+        """
+
+        assert self.date is not None
+
+        cell = self.cell(longitude, latitude)
+
+        if cell is not None:
+            self.visits[self.date][cell] += 1
+            self.first_visit[self.date][cell] = min(self.first_visit[self.date][cell], t)
+
+        return self
+
+    def end(self, longitude: float, latitude: float):
+        """Records the position where a vessel ended its trajectory.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Returns:
+            Accumulator: The Accumulator instance
+        """
+
+        assert self.date is not None
+
+        cell = self.cell(longitude, latitude)
+
+        if cell is not None:
+            self.ends[self.date][cell] += 1
+
+        return self
+
+    def tally(self, departure: int, arrived: bool):
+        """Records the outcome of a vessel launched from a departure point at the current launch date.
+
+        Args:
+            departure (int): Index of the departure point
+            arrived (bool): Whether the vessel arrived to its destination
+
+        Returns:
+            Accumulator: The Accumulator instance
+        """
+
+        assert self.date is not None
+
+        launched = self.launched[self.date]
+        launched[departure] = launched.get(departure, 0) + 1
+
+        if arrived:
+            tally = self.arrived[self.date]
+            tally[departure] = tally.get(departure, 0) + 1
+
+        return self
+
+    def merge(self, other):
+        """Merges the rasters and tallies of another Accumulator on the same grid into this one.
+
+        Args:
+            other (Accumulator): Another Accumulator
+
+        Returns:
+            Accumulator: The Accumulator instance
+        """
+
+        for date in other.visits:
+
+            self.start(date)
+
+            self.visits[date] += other.visits[date]
+            self.ends[date]   += other.ends[date]
+            np.minimum(self.first_visit[date], other.first_visit[date], out=self.first_visit[date])
+
+            for tally, others in ((self.launched[date], other.launched[date]), (self.arrived[date], other.arrived[date])):
+                for departure, count in others.items():
+                    tally[departure] = tally.get(departure, 0) + count
+
+        self.date = other.date if self.date is None else self.date
+
+        return self
+
+    def to_xarray(self) -> xr.Dataset:
+        """Converts the accumulated rasters to an XArray Dataset.
+
+        The visit counts, first visit times and end counts have dimensions (date, latitude, longitude),
+        the arrival tallies and probabilities have dimensions (date, departure).
+
+        Returns:
+            xr.Dataset: The rasters as a Dataset
+        """
+
+        dates      = sorted(self.visits)
+        departures = sorted({d for date in dates for d in self.launched[date]})
+
+        launched = np.array([[self.launched[date].get(d, 0) for d in departures] for date in dates]).reshape(len(dates), len(departures))
+        arrived  = np.array([[self.arrived[date].get(d, 0) for d in departures] for date in dates]).reshape(len(dates), len(departures))
+
+        visits      = np.stack([self.visits[date] for date in dates]) if dates else np.zeros((0, *self.shape), dtype=np.int64)
+        first_visit = np.stack([self.first_visit[date] for date in dates]) if dates else np.zeros((0, *self.shape))
+        ends        = np.stack([self.ends[date] for date in dates]) if dates else np.zeros((0, *self.shape), dtype=np.int64)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            probability = np.where(launched > 0, arrived / launched, np.nan)
+
+        return xr.Dataset(
+            {
+                "visits":      (("date", "latitude", "longitude"), visits),
+                "first_visit": (("date", "latitude", "longitude"), np.where(np.isinf(first_visit), np.nan, first_visit).astype(np.float32)),
+                "ends":        (("date", "latitude", "longitude"), ends),
+                "launched":    (("date", "departure"), launched),
+                "arrived":     (("date", "departure"), arrived),
+                "probability": (("date", "departure"), probability),
+            },
+            coords={
+                "date":      pd.to_datetime(dates),
+                "departure": departures,
+                "latitude":  self.latitudes,
+                "longitude": self.longitudes,
+            },
+            attrs={"first_visit_units": "days since launch"}
+        )
+
+    def to_netcdf(self, filename: str):
+        """Saves the accumulated rasters to a compressed NetCDF file.
+
+        Args:
+            filename (str): The NetCDF file
+        """
+
+        data     = self.to_xarray()
+        encoding = {name: {"zlib": True} for name in data.data_vars}
+
+        data.to_netcdf(filename, encoding=encoding)
@@ -0,0 +1,171 @@
+import numpy as np
+from typing import *
+
+from .vessel import Summary
+
+def _segments(trajectories: Iterable[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Collects the line segments of a batch of trajectories.
+
+    Args:
+        trajectories (Iterable[np.ndarray]): Trajectories as arrays of longitude, latitude
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Start and end points of the segments, each with shape (N, 2)
+    """
+
+    starts, ends = [], []
+    for trajectory in trajectories:
+
+        trajectory = np.asarray(trajectory, dtype=float).reshape(-1, 2)
+
+        if len(trajectory) == 1:
+            trajectory = np.repeat(trajectory, 2, axis=0)
+
+        starts.append(trajectory[:-1])
+        ends.append(trajectory[1:])
+
+    if not starts:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+
+    return np.concatenate(starts), np.concatenate(ends)
+
+def rasterize(trajectories: Iterable, bbox: List, shape: Tuple[int, int] = (1000, 2000), batch_size: int = 1000) -> np.ndarray:
+    """Rasterizes trajectories into a line density image over a bounding box.
+
+    Every segment is sampled at least once per pixel it passes, and the samples are accumulated,
+    such that the image counts how much of the trajectories passed through every pixel.
+    The trajectories are processed in batches, so that they may be streamed from a generator.
+
+    Args:
+        trajectories (Iterable): Trajectories as arrays or lists of [longitude, latitude], or Vessel objects
+        bbox (List): Bounding box of the image
+        shape (Tuple[int, int], optional): Height and width of the image in pixels. Defaults to (1000, 2000).
+        batch_size (int, optional): Number of trajectories rasterized at once. Defaults to 1000.
+
+    Raises:
+        TypeError: Raised for a Summary record, which keeps no trajectory
+
+    Returns:
+        np.ndarray: The line density image, with the first row at the lowest latitude
+    """
+
+    height, width = shape
+    image = np.zeros(height * width)
+
+    scale  = np.array([width / (bbox[2] - bbox[0]), height / (bbox[3] - bbox[1])])
+    origin = np.array([bbox[0], bbox[1]])
+
+    batch = []
+    for trajectory in trajectories:
+
+        if isinstance(trajectory, Summary):
+            raise TypeError("Summary records keep no trajectory to rasterize, run the Model with another record mode than 'summary'")
+
+        batch.append(getattr(trajectory, "trajectory", trajectory))
+
+        if len(batch) == batch_size:
+            image += _rasterize_batch(batch, origin, scale, shape)
+            batch = []
+
+    if batch:
+        image += _rasterize_batch(batch, origin, scale, shape)
+
+    return image.reshape(shape)
+
+def _rasterize_batch(batch: List, origin: np.ndarray, scale: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+
+    height, width = shape
+
+    a, b = _segments(batch)
+
+    # Segments in pixel coordinates
+    a = (a - origin) * scale
+    b = (b - origin) * scale
+
+    # Sample every segment at least once per pixel, excluding its end point which starts the next segment
+    length    = np.abs(b - a).max(axis=1)
+    valid     = np.isfinite(length)
+    n_samples = np.where(valid, np.ceil(np.nan_to_num(length)).clip(min=1), 0).astype(int)
+
+    segment = np.repeat(np.arange(len(a)), n_samples)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+    s       = offsets / n_samples[segment]
+
+    points = a[segment] + s[:, None] * (b[segment] - a[segment])
+
+    # Every sample carries its share of the length of the segment in pixels
+    weight = length[segment] / n_samples[segment]
+
+    x = np.floor(points[:, 0]).astype(int)
+    y = np.floor(points[:, 1]).astype(int)
+
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+
+    return np.bincount(y[inside] * width + x[inside], weights=weight[inside], minlength=height * width)
+
+def render(image: np.ndarray,
+           bbox: List,
+           filename: str = None,
+           weighted_mask: np.ndarray = None,
+           longitudes: np.ndarray = None,
+           latitudes: np.ndarray = None,
+           cmap: str = 'magma',
+           dpi: int = 100):
+    """Renders a line density image with logarithmic scaling, optionally overlaid with the coastlines of a weighted mask.
+
+    Args:
+        image (np.ndarray): A line density image from rasterize
+        bbox (List): Bounding box of the image
+        filename (str, optional): File to save the image to, such as a PNG. Defaults to None.
+        weighted_mask (np.ndarray, optional): Weighted mask of a WeightedGrid, with land as NaN. Defaults to None.
+        longitudes (np.ndarray, optional): Longitudes of the weighted mask. Defaults to None.
+        latitudes (np.ndarray, optional): Latitudes of the weighted mask. Defaults to None.
+        cmap (str, optional): Matplotlib colormap. Defaults to 'magma'.
+        dpi (int, optional): Resolution of the saved image. Defaults to 100.
+
+    Returns:
+        fig, ax: Matplotlib figure and axis tuples, or None with a filename, as the figure is closed once saved
+    """
+
+    import matplotlib.pyplot as plt
+
+    height, width = image.shape
+
+    fig, ax = plt.subplots(figsize=(width / dpi, height / dpi), dpi=dpi)
+
+    ax.imshow(np.log1p(image), origin='lower', extent=[bbox[0], bbox[2], bbox[1], bbox[3]], cmap=cmap, interpolation='nearest', aspect='auto')
+
+    if weighted_mask is not None:
+        ax.contour(longitudes, latitudes, np.isnan(weighted_mask).astype(float), levels=[0.5], colors='white', linewidths=0.5)
+
+    ax.set_xlim(bbox[0], bbox[2])
+    ax.set_ylim(bbox[1], bbox[3])
+
+    if filename is not None:
+        fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+        plt.close(fig)
+
+        return None
+
+    return fig, ax
+
+def render_chart(trajectories: Iterable, chart, filename: str = None, shape: Tuple[int, int] = (1000, 2000), **kwargs):
+    """Rasterizes and renders trajectories over the bounding box of a Chart, with its coastlines.
+
+    Args:
+        trajectories (Iterable): Trajectories as arrays or lists of [longitude, latitude], or Vessel objects
+        chart (Chart): A loaded Chart object
+        filename (str, optional): File to save the image to, such as a PNG. Defaults to None.
+        shape (Tuple[int, int], optional): Height and width of the image in pixels. Defaults to (1000, 2000).
+
+    Returns:
+        fig, ax: Matplotlib figure and axis tuples, or None with a filename, see render
+    """
+
+    image = rasterize(trajectories, chart.bbox, shape)
+
+    return render(image, chart.bbox, filename,
+                  weighted_mask=chart.grid.weighted_mask,
+                  longitudes=chart.longitudes,
+                  latitudes=chart.latitudes,
+                  **kwargs)
@@ -0,0 +1,150 @@
+import numpy as np
+from typing import *
+
+from . import search
+
+R_EARTH = 6371 # km
+
+class Replanner:
+    """
+    The Replanner keeps a vessel on a route to its destination while the winds and currents push it around.
+
+    When the vessel has drifted further than a distance from the leg of the route it is on, or has not come closer to its
+    target for a number of steps, the remaining route is read off the cost-to-go field of the destination from the cell of
+    the vessel. The field is computed once per destination and grid and shared by all vessels, so replanning only costs
+    a walk down the field.
+    """
+
+    def __init__(self, chart, vessel, distance: float = 50, patience: int = None, interval: int = 5) -> None:
+        """
+        Args:
+            chart (Chart): The chart the route was planned on
+            vessel (Vessel): A vessel with a destination
+            distance (float, optional): Distance in km from the leg of the route at which to replan. Defaults to 50.
+            patience (int, optional): Number of steps without coming closer to the target at which to replan. Defaults to None, never.
+            interval (int, optional): Interval of the replanned route targets, see Vessel.plan_route. Defaults to 5.
+
+        Raises:
+            ValueError: Raised if the chart has no WeightedGrid, such as a NestedChart or an interpolated window of the SimulationService
+        """
+
+        if not isinstance(getattr(chart, "grid", None), search.WeightedGrid):
+            raise ValueError("Routes can only be replanned on a chart with a WeightedGrid")
+
+        self.chart    = chart
+        self.vessel   = vessel
+        self.distance = distance
+        self.patience = patience
+        self.interval = interval
+
+        self.goal  = search.nearest_passable(chart.grid, chart.position(*vessel.destination))
+        self.field = search.cost_field(chart.grid, self.goal)
+
+        self._start_leg((vessel.x, vessel.y))
+
+    def _start_leg(self, start: Tuple[float, float]):
+
+        self.leg_start = start
+        self.target    = self.vessel.target
+        self.closest   = np.inf
+        self.stalled   = 0
+
+    def deviation(self, longitude: float, latitude: float) -> float:
+        """The distance in km from a position to the leg of the route, from its start to the current target.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Returns:
+            float: The distance to the leg
+        """
+
+        # Positions on a local plane in km, centered on the position
+        scale = np.deg2rad(1) * R_EARTH * np.array([np.cos(np.deg2rad(latitude)), 1])
+
+        a = (np.asarray(self.leg_start, dtype=float) - (longitude, latitude)) * scale
+        b = (np.asarray(self.target, dtype=float) - (longitude, latitude)) * scale
+
+        ab = b - a
+        length = ab.dot(ab)
+
+        s = np.clip(-a.dot(ab) / length, 0, 1) if length > 0 else 0
+
+        return float(np.linalg.norm(a + s * ab))
+
+    def update(self, longitude: float, latitude: float) -> bool:
+        """Follows the vessel after a step, replanning its route if it is off its leg or stalled.
+
+        Args:
+            longitude (float): Longitude of the vessel (WGS84)
+            latitude (float): Latitude of the vessel (WGS84)
+
+        Returns:
+            bool: Whether the route was replanned
+        """
+
+        # A waypoint was reached, the next leg starts from it
+        if self.vessel.target is not self.target:
+            self._start_leg(self.target)
+
+        if self.target is None:
+            return False
+
+        remaining = np.hypot(*((np.asarray(self.target, dtype=float) - (longitude, latitude)) *
+                               [np.cos(np.deg2rad(latitude)), 1]))
+
+        if remaining < self.closest:
+            self.closest, self.stalled = remaining, 0
+        else:
+            self.stalled += 1
+
+        if self.deviation(longitude, latitude) > self.distance or (self.patience is not None and self.stalled >= self.patience):
+            return self.replan(longitude, latitude)
+
+        return False
+
+    def route(self, longitude: float, latitude: float) -> Optional[List[Tuple[float, float]]]:
+        """The cheapest route from a position to the destination, read off the cost-to-go field.
+
+        Args:
+            longitude (float): Longitude (WGS84)
+            latitude (float): Latitude (WGS84)
+
+        Returns:
+            Optional[List[Tuple[float, float]]]: The route in reverse order, as from Vessel.plan_route, or None if the destination cannot be reached
+        """
+
+        start = search.nearest_passable(self.chart.grid, self.chart.position(longitude, latitude))
+
+        if not np.isfinite(self.field[start]):
+            return None
+
+        # The first target is an interval ahead, not the cells around the vessel
+        route = search.descend(self.chart.grid, self.field, start)
+        route = [*route[self.interval:-1:self.interval], route[-1]]
+        route = [self.chart.coordinates(id) for id in route]
+        route.reverse()
+
+        return route
+
+    def replan(self, longitude: float, latitude: float) -> bool:
+        """Replaces the remaining route of the vessel with the cheapest route from its position.
+
+        Args:
+            longitude (float): Longitude of the vessel (WGS84)
+            latitude (float): Latitude of the vessel (WGS84)
+
+        Returns:
+            bool: Whether the route was replanned, False if the destination cannot be reached
+        """
+
+        route = self.route(longitude, latitude)
+
+        if route is None:
+            return False
+
+        self.vessel.reroute(route)
+        self._start_leg((longitude, latitude))
+
+        return True
@@ -0,0 +1,109 @@
+import warnings
+
+import numpy as np
+from scipy import stats
+from scipy.stats import qmc
+from typing import *
+
+STRATEGIES = ("random", "antithetic", "sobol")
+
+# Largest dimension of the Sobol sequence in scipy
+SOBOL_MAX_DIMENSION = 21201
+
+class NoisePath(NamedTuple):
+    """
+    The random terms of every step of one vessel: the side of the wind the leeway is deflected to, and the standard normal
+    noise of the displacement, scaled by the sigma of the model.
+    """
+
+    flips: np.ndarray
+    normal: np.ndarray
+
+class Sampler:
+    """
+    The Sampler draws the noise paths of a batch of replicate vessels, such that ensemble statistics converge with fewer vessels:
+
+        random      independent draws
+        antithetic  pairs of replicates with opposite noise and deflections
+        sobol       scrambled Sobol points over the noise of all steps, the leading steps first
+
+    With stratification, the deflection signs of every step are split evenly between the replicates of a batch.
+    The paths are reproducible for a given seed, and successive batches continue the same sequence.
+    """
+
+    def __init__(self, strategy: str = "random", stratified: bool = False, seed = None) -> None:
+        """
+        Args:
+            strategy (str, optional): Either "random", "antithetic" or "sobol". Defaults to "random".
+            stratified (bool, optional): Whether to stratify the deflection signs. Defaults to False.
+            seed (optional): Seed of the paths, anything accepted by np.random.default_rng. Defaults to None.
+
+        Raises:
+            ValueError: Raised if the strategy is not random, antithetic or sobol
+        """
+
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Strategy must be one of {', '.join(STRATEGIES)}")
+
+        self.strategy   = strategy
+        self.stratified = stratified
+        self.rng        = np.random.default_rng(seed)
+        self.engine     = None
+
+    def _uniform(self, n: int, n_steps: int) -> np.ndarray:
+        """Draws uniform variates for the flips and noise of every step.
+
+        Returns:
+            np.ndarray: Variates with shape (n, n_steps, 3)
+        """
+
+        if self.strategy != "sobol":
+            return self.rng.random((n, n_steps, 3))
+
+        dimension = min(3 * n_steps, SOBOL_MAX_DIMENSION)
+
+        if self.engine is None or self.engine.d != dimension:
+            self.engine = qmc.Sobol(dimension, scramble=True, seed=self.rng)
+
+        # The balance of the points is best for powers of two, but any batch size is a valid sample
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            points = self.engine.random(n)
+
+        # Steps beyond the dimensions of the sequence are padded with random draws
+        rest = self.rng.random((n, 3 * n_steps - dimension))
+
+        return np.concatenate((points, rest), axis=1).reshape(n, n_steps, 3)
+
+    def paths(self, n: int, n_steps: int) -> List[NoisePath]:
+        """Draws the noise paths of a batch of replicates.
+
+        Args:
+            n (int): Number of replicates, even for antithetic pairs
+            n_steps (int): Number of steps of the simulation
+
+        Returns:
+            List[NoisePath]: A noise path for every replicate
+        """
+
+        m = -(-n // 2) if self.strategy == "antithetic" else n
+
+        u = self._uniform(m, n_steps)
+
+        # Uniform variates strictly inside (0, 1) for the normal quantiles
+        u = np.clip(u, 1e-12, 1 - 1e-12)
+
+        flips  = np.where(u[..., 0] < 0.5, -1.0, 1.0)
+        normal = stats.norm.ppf(u[..., 1:])
+
+        if self.strategy == "antithetic":
+            flips  = np.stack((flips, -flips), axis=1).reshape(2 * m, n_steps)[:n]
+            normal = np.stack((normal, -normal), axis=1).reshape(2 * m, n_steps, 2)[:n]
+
+        if self.stratified:
+
+            # Every step deflects half of the replicates to each side, in random order
+            signs = np.resize([1.0, -1.0], n)
+            flips = self.rng.permuted(np.tile(signs[:, None], (1, n_steps)), axis=0)
+
+        return [NoisePath(flips[i], normal[i]) for i in range(n)]
@@ -1,9 +1,16 @@
-from typing import Dict, Tuple, List, Iterator, Optional, TypeVar
+from typing import Dict, Tuple, List, Iterator, Optional, TypeVar, Callable, Set
 import heapq
+import hashlib
+import os
+from functools import partial
 import numpy as np
 import cv2
+from scipy import ndimage
+from scipy.sparse import csgraph, csr_matrix
 
 T = TypeVar('T')
+# Directory of the on-disk grid cache, opt-in through the VOYAGER_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get("VOYAGER_CACHE_DIR")
 Position = Tuple[int, int]
 
 def heuristic(a: Position, b: Position) -> float:
@@ -21,6 +28,42 @@ def heuristic(a: Position, b: Position) -> float:
     (x2, y2) = b
     return abs(x1 - x2) + abs(y1 - y2)
 
+def diagonal_heuristic(a: Position, b: Position, minimum_cost: float = 1) -> float:
+    """Admissible distance measure between two positions on a grid with diagonal moves,
+    where no move costs less than a minimum cost.
+
+    Args:
+        a (Position): Current position
+        b (Position): Other position
+        minimum_cost (float, optional): The smallest cost of a move. Defaults to 1.
+
+    Returns:
+        float: A lower bound of the cost between the points
+    """
+
+    (x1, y1) = a
+    (x2, y2) = b
+    return minimum_cost * max(abs(x1 - x2), abs(y1 - y2))
+
+def goal_heuristic(heuristic: Callable[[Position, Position], float], goal: Position) -> Callable[[Position], float]:
+    """The heuristic to the goal of a single search. Heuristics of an object keeping costs per goal, such as Landmarks,
+    are built by its heuristic_to method.
+
+    Args:
+        heuristic (Callable[[Position, Position], float]): A heuristic between two positions
+        goal (Position): Goal position
+
+    Returns:
+        Callable[[Position], float]: The heuristic from a position to the goal
+    """
+
+    heuristic_to = getattr(getattr(heuristic, "__self__", None), "heuristic_to", None)
+
+    if heuristic_to is not None:
+        return heuristic_to(goal)
+
+    return lambda a: heuristic(a, goal)
+
 class Grid:
     """
     Represents the map as an approximately equidistant grid, with methods to find if
@@ -29,7 +72,7 @@ class Grid:
     def __init__(self, width: int, height: int):
         self.width = width
         self.height = height
-        self.walls: List[Position] = []
+        self.walls = np.zeros((width, height), dtype=bool)
     
     def in_bounds(self, id: Position) -> bool:
         """Checks if the current position is in bounds of the map.
@@ -52,7 +95,7 @@ class Grid:
         Returns:
             bool: Whether the position is passable, or if it has walls
         """
-        return id not in self.walls
+        return not self.walls[id]
     
     def neighbors(self, id: Position) -> Iterator[Position]:
         """Calculates the traversable neighbours of the current position as an iterator
@@ -84,32 +127,63 @@ class WeightedGrid(Grid):
 
     def __init__(self, width: int, height: int):
         super().__init__(width, height)
-        self.weights: Dict[Position, float] = {}
+        self.weights = np.ones((width, height))
         self.weighted_mask = None
+        self.abstractions: Dict[int, "Abstraction"] = {}
+        self.landmarks: Dict[int, "Landmarks"] = {}
+        self.cost_to_go: Dict[Position, np.ndarray] = {}
     
     def cost(self, from_node: Position, to_node: Position) -> float:
-        return self.weights.get(to_node, 1)
+        return self.weights[to_node]
 
     @classmethod
-    def from_map(cls, map: np.ndarray, **kwargs):
+    def from_map(cls, map: np.ndarray, weights=[5, 0.5], iterations=[1, 4], kernel_size=3, cache_dir=CACHE_DIR):
         """Generate a WeightedGrid from a numpy array, wehere the land is symbolized as NaN.
 
+        With a cache directory, the weighted mask is cached on disk as grid-<sha1>.npy, keyed by the land mask and
+        the shoreline parameters, such that a grid with the same settings is only computed once. The cache is never
+        evicted, remove the files to reclaim the space.
+
         Args:
             map (np.ndarray): An array with land as NaN
+            weights (list, optional): A list of weights for each contour. Defaults to [5, 0.5].
+            iterations (list, optional): Number of iterations to broaden the contour. Defaults to [1, 4].
+            kernel_size (int, optional): The kernel size used for broadening of the contour. Defaults to 3.
+            cache_dir (str, optional): Directory of the grid cache, None to disable caching. 
+                                       Defaults to CACHE_DIR, the VOYAGER_CACHE_DIR environment variable if set.
 
         Returns:
             WeightedGrid: A WeightedGrid instance
         """
 
-        map = map.values
+        map = getattr(map, "values", map)
 
-        mask = np.isnan(map).astype(np.float)
+        mask = np.isnan(map)
         grid = cls(*mask.shape)
 
-        grid.weighted_mask = cls.create_shoreline_contour(mask, **kwargs)
+        filename = None
+        if cache_dir is not None:
+            key = hashlib.sha1(np.packbits(mask).tobytes() + 
+                               repr((mask.shape, list(weights), list(iterations), kernel_size)).encode()).hexdigest()
+            filename = os.path.join(cache_dir, f"grid-{key}.npy")
+
+        if filename is not None and os.path.exists(filename):
+            grid.weighted_mask = np.load(filename)
+
+        else:
+            grid.weighted_mask = cls.create_shoreline_contour(mask, weights=weights, iterations=iterations, kernel_size=kernel_size)
+
+            if filename is not None:
+                os.makedirs(cache_dir, exist_ok=True)
 
-        grid.weights = cls.mask_to_graph(grid.weighted_mask)
-        grid.walls = [(x[0], x[1]) for x in np.argwhere(np.isnan(map))]
+                # Write atomically, other processes may be loading the same chart
+                tmp = f"{filename}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as file:
+                    np.save(file, grid.weighted_mask)
+                os.replace(tmp, filename)
+
+        grid.weights = grid.weighted_mask
+        grid.walls   = np.isnan(grid.weighted_mask)
 
         return grid
 
@@ -117,8 +191,9 @@ class WeightedGrid(Grid):
     def create_shoreline_contour(mask: np.ndarray, weights=[5, 0.5], iterations=[1, 4], kernel_size=3) -> np.ndarray:
         """Create a weight mask corresponding to the shoreline contour of the map.
 
-        The contours are created using dilation of the land for a number of iterations and a given kernel size. The result is 
-        a contour with a specific width, which is then assigned a specific weight.
+        The contours are bands of a specific width around the land, each assigned a specific weight. The width of a band
+        corresponds to dilating the land a number of iterations with a square kernel of a given size, and all bands 
+        are computed from a single chessboard distance transform of the land.
 
         This mimics the tendency to avoid close shorelines and open sea.
 
@@ -132,26 +207,22 @@ class WeightedGrid(Grid):
             np.ndarray: A weighted array corresponding to a map with contours around the land
         """
 
-        kernel = np.ones((kernel_size, kernel_size), np.uint8)
-        weighted_mask = np.ones(mask.shape)
+        land = np.asarray(mask).astype(bool)
+        weighted_mask = np.ones(land.shape)
 
-        for weight, iters in zip(weights, iterations):
+        if land.any():
 
-            # Calculate shorelines at different distance
-            shoreline = cv2.dilate(mask, kernel, iterations=iters)
+            # Chessboard distance from every sea cell to the closest land
+            distance = cv2.distanceTransform((~land).astype(np.uint8), cv2.DIST_C, 3)
 
-            # Start at zero and add shorelines with weights
-            weighted_mask[shoreline.astype(np.bool)] = weight
+            for weight, iters in zip(weights, iterations):
 
-        # # Start at zero and add shorelines with weights
-        weighted_mask[mask.astype(np.bool)] = np.nan    
+                # Dilating iters times with the kernel reaches this far from the land
+                weighted_mask[distance <= iters * (kernel_size // 2)] = weight
 
-        return weighted_mask
+        weighted_mask[land] = np.nan
 
-    @staticmethod
-    def mask_to_graph(mask):
-
-        return {index: value for index, value in np.ndenumerate(mask) if not np.isnan(value)}
+        return weighted_mask
 
 
 class PriorityQueue:
@@ -172,9 +243,10 @@ class Astar:
     # A traversal graph of the map is the set of indices on the mask of the map.
     # Distance is calculated per 
 
-    def __init__(self, graph: WeightedGrid) -> None:
+    def __init__(self, graph: WeightedGrid, heuristic: Callable[[Position, Position], float] = heuristic) -> None:
         
         self.graph  = graph
+        self.heuristic = heuristic
 
     def search(self, start: Position, goal: Position) -> Tuple[Dict[Position, Position], Dict[Position, float]]:
         """Find a route from a start position to a goal position.
@@ -188,6 +260,8 @@ class Astar:
             Tuple[Dict[Position, Position], Dict[Position, float]]: A dict as a graph pointing to the previous position, and the current cost of the route.
         """
 
+        estimate = goal_heuristic(self.heuristic, goal)
+
         frontier = PriorityQueue()
         frontier.put(start, 0)
         came_from: Dict[Position, Optional[Position]] = {}
@@ -205,7 +279,7 @@ class Astar:
                 new_cost = cost_so_far[current] + self.graph.cost(current, next)
                 if next not in cost_so_far or new_cost < cost_so_far[next]:
                     cost_so_far[next] = new_cost
-                    priority = new_cost + heuristic(next, goal)
+                    priority = new_cost + estimate(next)
                     frontier.put(next, priority)
                     came_from[next] = current
         
@@ -238,3 +312,564 @@ class Astar:
         path.reverse()
         return path
 
+
+
+class Corridor:
+    """
+    A view of a grid restricted to a set of allowed positions, used to limit searches to a region of the map.
+    """
+
+    def __init__(self, graph: WeightedGrid, allowed: Callable[[Position], bool]) -> None:
+
+        self.graph   = graph
+        self.allowed = allowed
+
+    def neighbors(self, id: Position) -> Iterator[Position]:
+        return filter(self.allowed, self.graph.neighbors(id))
+
+    def cost(self, from_node: Position, to_node: Position) -> float:
+        return self.graph.cost(from_node, to_node)
+
+
+def dijkstra(graph, start: Position, targets: Set[Position]) -> Dict[Position, float]:
+    """Finds the cost of the cheapest routes from a start position to a set of target positions.
+
+    Args:
+        graph (WeightedGrid): A grid, or a view of a grid such as a Corridor
+        start (Position): Start position
+        targets (Set[Position]): Target positions
+
+    Returns:
+        Dict[Position, float]: The cost to every reachable target position
+    """
+
+    frontier = PriorityQueue()
+    frontier.put(start, 0)
+    cost_so_far: Dict[Position, float] = {start: 0}
+    remaining = set(targets) - {start}
+    done = set()
+
+    while not frontier.empty() and remaining:
+        current: Position = frontier.get()
+
+        if current in done:
+            continue
+        done.add(current)
+        remaining.discard(current)
+
+        for next in graph.neighbors(current):
+            new_cost = cost_so_far[current] + graph.cost(current, next)
+            if next not in cost_so_far or new_cost < cost_so_far[next]:
+                cost_so_far[next] = new_cost
+                frontier.put(next, new_cost)
+
+    return {target: cost_so_far[target] for target in targets if target in cost_so_far}
+
+
+# Moves between neighbouring cells, as in Grid.neighbors
+MOVES = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1)]
+
+def adjacency(graph: WeightedGrid) -> csr_matrix:
+    """The grid as a sparse adjacency matrix over the flattened cells, where the cost of a move is the weight of the cell moved to.
+
+    Args:
+        graph (WeightedGrid): A grid
+
+    Returns:
+        csr_matrix: Matrix with shape (width * height, width * height)
+    """
+
+    width, height = graph.width, graph.height
+    passable = ~graph.walls
+
+    index = np.arange(width * height).reshape(width, height)
+
+    rows, columns, costs = [], [], []
+    for dx, dy in MOVES:
+
+        # Cells whose neighbour at (dx, dy) is in bounds
+        a = (slice(max(-dx, 0), width - max(dx, 0)), slice(max(-dy, 0), height - max(dy, 0)))
+        b = (slice(max(dx, 0), width - max(-dx, 0)), slice(max(dy, 0), height - max(-dy, 0)))
+
+        valid = passable[a] & passable[b]
+
+        rows.append(index[a][valid])
+        columns.append(index[b][valid])
+        costs.append(np.asarray(graph.weights, dtype=float)[b][valid])
+
+    return csr_matrix((np.concatenate(costs), (np.concatenate(rows), np.concatenate(columns))), shape=(width * height, width * height))
+
+def cost_fields(graph: WeightedGrid, goals: List[Position]) -> np.ndarray:
+    """Computes the exact cost-to-go from every cell to each of a list of goals.
+
+    Args:
+        graph (WeightedGrid): A grid
+        goals (List[Position]): Goal positions
+
+    Returns:
+        np.ndarray: Cost fields with shape (len(goals), width, height), infinite where a goal cannot be reached
+    """
+
+    if not goals:
+        return np.zeros((0, graph.width, graph.height))
+
+    indices = [x * graph.height + y for x, y in goals]
+
+    # The cost to go to a goal is the cost from the goal on the reversed moves
+    fields = csgraph.dijkstra(adjacency(graph).T.tocsr(), directed=True, indices=indices)
+
+    return fields.reshape(len(goals), graph.width, graph.height)
+
+def cost_field(graph: WeightedGrid, goal: Position) -> np.ndarray:
+    """The cost-to-go field of a goal, computed once and cached on the grid.
+
+    Args:
+        graph (WeightedGrid): A grid
+        goal (Position): Goal position
+
+    Returns:
+        np.ndarray: Cost field with shape (width, height), infinite where the goal cannot be reached
+    """
+
+    if goal not in graph.cost_to_go:
+        graph.cost_to_go[goal] = cost_fields(graph, [goal])[0]
+
+    return graph.cost_to_go[goal]
+
+def descend(graph: WeightedGrid, field: np.ndarray, start: Position) -> List[Position]:
+    """Follows a cost-to-go field from a start position down to its goal, giving a cheapest route.
+
+    Args:
+        graph (WeightedGrid): A grid
+        field (np.ndarray): A cost field from cost_fields
+        start (Position): Start position
+
+    Raises:
+        ValueError: Raised if the goal cannot be reached from the start
+
+    Returns:
+        List[Position]: The route from the start to the goal
+    """
+
+    if not np.isfinite(field[start]):
+        raise ValueError(f"No route from {start}")
+
+    route = [start]
+    current = start
+    while field[current] > 0:
+
+        # The move keeping the cost along the route equal to the cost-to-go
+        current = min(graph.neighbors(current), key=lambda next: graph.cost(current, next) + field[next])
+        route.append(current)
+
+    return route
+
+def nearest_passable(graph: WeightedGrid, id: Position) -> Position:
+    """Finds the passable position closest to a position, such as a harbour on a coast cell.
+
+    Args:
+        graph (WeightedGrid): A grid
+        id (Position): A position
+
+    Returns:
+        Position: The position itself if passable, otherwise the nearest passable one
+    """
+
+    if graph.passable(id):
+        return id
+
+    _, (x, y) = ndimage.distance_transform_edt(graph.walls, return_indices=True)
+
+    return int(x[id]), int(y[id])
+
+
+class Landmarks:
+    """
+    The Landmarks give tight admissible bounds of the cost between any two positions of a WeightedGrid (the ALT heuristic).
+
+    The exact costs from and to a few well-spread sea landmarks are precomputed. By the triangle inequality, the cost from a to b
+    is at least d(L, b) - d(L, a) and d(a, L) - d(b, L) for every landmark L. The landmarks are chosen one at a time as
+    the position furthest from the landmarks so far.
+    """
+
+    def __init__(self, graph: WeightedGrid, n_landmarks: int = 8) -> None:
+
+        self.graph = graph
+
+        matrix   = adjacency(graph)
+        passable = ~graph.walls.ravel()
+
+        # The smallest cost of a move, for the diagonal bound
+        weights = np.asarray(graph.weights, dtype=float).ravel()[passable]
+        self.minimum_cost = float(np.nanmin(weights)) if weights.size else 1.0
+
+        landmarks, forward = [], []
+        nearest = np.full(graph.width * graph.height, np.inf)
+        candidate = int(np.flatnonzero(passable)[0]) if passable.any() else None
+
+        while candidate is not None and len(landmarks) < n_landmarks:
+
+            cost = csgraph.dijkstra(matrix, directed=True, indices=candidate)
+
+            landmarks.append(candidate)
+            forward.append(cost)
+
+            # The next landmark is the reachable position furthest from all landmarks so far
+            nearest = np.minimum(nearest, cost)
+            score   = np.where(np.isfinite(nearest) & passable, nearest, -1)
+            score[landmarks] = -1
+
+            candidate = int(np.argmax(score)) if score.max() > 0 else None
+
+        self.landmarks = [(int(i // graph.height), int(i % graph.height)) for i in landmarks]
+
+        shape = (graph.width, graph.height, len(landmarks))
+
+        # Costs with the landmarks last, so the costs of a position are contiguous
+        self.from_landmarks = np.stack(forward, axis=-1).reshape(shape) if forward else np.zeros(shape)
+        self.to_landmarks   = csgraph.dijkstra(matrix.T.tocsr(), directed=True, indices=landmarks).T.reshape(shape) if landmarks else np.zeros(shape)
+
+        # Unreachable costs as NaN, such that their differences are ignored
+        self.from_landmarks[np.isinf(self.from_landmarks)] = np.nan
+        self.to_landmarks[np.isinf(self.to_landmarks)]     = np.nan
+
+    @classmethod
+    def for_grid(cls, graph: WeightedGrid, n_landmarks: int = 8):
+        """The landmarks of a grid, precomputed once and kept with the grid.
+
+        Args:
+            graph (WeightedGrid): A grid
+            n_landmarks (int, optional): Number of landmarks. Defaults to 8.
+
+        Returns:
+            Landmarks: A Landmarks instance
+        """
+
+        if n_landmarks not in graph.landmarks:
+            graph.landmarks[n_landmarks] = cls(graph, n_landmarks)
+
+        return graph.landmarks[n_landmarks]
+
+    def heuristic(self, a: Position, b: Position) -> float:
+        """Admissible lower bound of the cost from one position to another.
+
+        Args:
+            a (Position): Current position
+            b (Position): Other position
+
+        Returns:
+            float: A lower bound of the cost between the points
+        """
+
+        return self.heuristic_to(b)(a)
+
+    def heuristic_to(self, goal: Position) -> Callable[[Position], float]:
+        """The heuristic to a goal, with the costs of the goal looked up once. A search builds its own, see goal_heuristic, 
+        such that searches for other goals in other threads never share them.
+
+        Args:
+            goal (Position): Goal position
+
+        Returns:
+            Callable[[Position], float]: Admissible lower bound of the cost from a position to the goal
+        """
+
+        from_goal = self.from_landmarks[goal]
+        to_goal   = self.to_landmarks[goal]
+
+        def bound(a: Position) -> float:
+
+            landmark = np.fmax.reduce(np.fmax(from_goal - self.from_landmarks[a], self.to_landmarks[a] - to_goal)) if self.landmarks else np.nan
+
+            return max(diagonal_heuristic(a, goal, self.minimum_cost), landmark if landmark == landmark else 0)
+
+        return bound
+
+
+class Abstraction:
+    """
+    The Abstraction divides a WeightedGrid into square clusters, connected through entrances on the cluster borders.
+    The costs between all entrances of a cluster are precomputed under the grid weights, so that a route can be
+    searched on the much smaller graph of entrances.
+    """
+
+    def __init__(self, graph: WeightedGrid, cluster_size: int = 16) -> None:
+
+        self.graph = graph
+        self.cluster_size = cluster_size
+
+        # Directed edges between entrances, with their cost
+        self.edges: Dict[Position, Dict[Position, float]] = {}
+
+        # Entrances belonging to each cluster
+        self.entrances: Dict[Position, Set[Position]] = {}
+
+        self._connect_clusters()
+        self._connect_entrances()
+
+    def cluster(self, id: Position) -> Position:
+        """The cluster of a position.
+
+        Args:
+            id (Position): Position on the grid
+
+        Returns:
+            Position: Index of the cluster
+        """
+        (x, y) = id
+        return (x // self.cluster_size, y // self.cluster_size)
+
+    def in_cluster(self, cluster: Position) -> Callable[[Position], bool]:
+        return lambda id: self.cluster(id) == cluster
+
+    def _add_entrance(self, a: Position, b: Position):
+
+        for id in (a, b):
+            self.edges.setdefault(id, {})
+            self.entrances.setdefault(self.cluster(id), set()).add(id)
+
+        self.edges[a][b] = self.graph.cost(a, b)
+        self.edges[b][a] = self.graph.cost(b, a)
+
+    def _connect_clusters(self):
+        """Places entrances on every open segment of the borders between adjacent clusters.
+        Short segments get a single entrance in the middle, longer segments one at each end.
+        """
+
+        size = self.cluster_size
+
+        # Borders between clusters stacked along the first and second axis respectively
+        borders = [(x, (1, 0)) for x in range(size, self.graph.width, size)] + \
+                  [(y, (0, 1)) for y in range(size, self.graph.height, size)]
+
+        for border, (dx, dy) in borders:
+
+            length = self.graph.height if dx else self.graph.width
+
+            for offset in range(0, length, size):
+
+                segment = []
+                for k in range(offset, min(offset + size, length)):
+
+                    b = (border, k) if dx else (k, border)
+                    a = (b[0] - dx, b[1] - dy)
+
+                    if self.graph.passable(a) and self.graph.passable(b):
+                        segment.append((a, b))
+                        continue
+
+                    self._add_segment(segment)
+                    segment = []
+
+                self._add_segment(segment)
+
+    def _add_segment(self, segment: List[Tuple[Position, Position]]):
+
+        if not segment:
+            return
+
+        if len(segment) < 6:
+            self._add_entrance(*segment[len(segment) // 2])
+        else:
+            self._add_entrance(*segment[0])
+            self._add_entrance(*segment[-1])
+
+    def _connect_entrances(self):
+        """Precomputes the cost between every pair of entrances within each cluster."""
+
+        for cluster, entrances in self.entrances.items():
+
+            corridor = Corridor(self.graph, self.in_cluster(cluster))
+
+            for entrance in entrances:
+                for other, cost in dijkstra(corridor, entrance, entrances).items():
+                    if other != entrance:
+                        self.edges[entrance][other] = min(cost, self.edges[entrance].get(other, np.inf))
+
+    def connect(self, start: Position, goal: Position) -> Dict[Position, Dict[Position, float]]:
+        """Temporarily connects a start and goal position to the entrances of their clusters.
+
+        Args:
+            start (Position): Start position
+            goal (Position): End position
+
+        Returns:
+            Dict[Position, Dict[Position, float]]: Additional directed edges for the start and goal positions
+        """
+
+        edges: Dict[Position, Dict[Position, float]] = {start: {}}
+
+        start_cluster = self.cluster(start)
+        goal_cluster  = self.cluster(goal)
+
+        # From the start to the entrances of its cluster, and the goal if it is in the same cluster
+        targets = self.entrances.get(start_cluster, set()) | ({goal} if start_cluster == goal_cluster else set())
+        edges[start].update(dijkstra(Corridor(self.graph, self.in_cluster(start_cluster)), start, targets))
+
+        # From the entrances of the goal cluster to the goal. The cost only depends on the node entered,
+        # so the reverse search is corrected by the weights of the end points
+        reverse = dijkstra(Corridor(self.graph, self.in_cluster(goal_cluster)), goal, self.entrances.get(goal_cluster, set()))
+        for entrance, cost in reverse.items():
+            edges.setdefault(entrance, {})[goal] = cost - self.graph.cost(goal, entrance) + self.graph.cost(entrance, goal)
+
+        return edges
+
+
+class HierarchicalAstar(Astar):
+    """
+    Hierarchical A*, searching for a route on the abstract graph of cluster entrances and refining it
+    with A* on the grid only inside the corridor of clusters the abstract route passes through.
+
+    The abstraction of a grid is cached on the grid, and shared by every search with the same cluster size.
+    Increasing the margin of clusters around the corridor brings the route cost closer to flat A*, at the cost of speed.
+
+    With a tolerance, the refined route cost is compared to the exact flat A* cost when the cost-to-go field of the goal is
+    already cached on the grid, see cost_field. While the route costs more than the tolerance above it, the margin is doubled,
+    up to a corridor of the whole grid, which is flat A*. Without a cached field the corridor route is kept as is, and gap
+    reports how far its cost is at most above the flat A* cost.
+    """
+
+    def __init__(self, graph: WeightedGrid, cluster_size: int = 16, margin: int = 0, tolerance: float = None, heuristic = None) -> None:
+        """
+        Args:
+            graph (WeightedGrid): A grid
+            cluster_size (int, optional): Number of cells along the side of a cluster. Defaults to 16.
+            margin (int, optional): Number of clusters added around the corridor. Defaults to 0.
+            tolerance (float, optional): Relative tolerance of the route cost above the flat A* cost, applied when the
+                                         cost-to-go field of the goal is cached. Defaults to None, refining in the corridor only.
+            heuristic (optional): An admissible heuristic, such as Landmarks.heuristic. Defaults to None, the diagonal distance.
+        """
+
+        # The abstract route and its refinement are searched with an admissible heuristic
+        if heuristic is None:
+            minimum_cost = np.nanmin(graph.weights) if not np.all(graph.walls) else 1
+            heuristic = partial(diagonal_heuristic, minimum_cost=minimum_cost)
+
+        super().__init__(graph, heuristic=heuristic)
+
+        self.cluster_size = cluster_size
+        self.margin = margin
+        self.tolerance = tolerance
+
+        if cluster_size not in graph.abstractions:
+            graph.abstractions[cluster_size] = Abstraction(graph, cluster_size)
+
+        self.abstraction = graph.abstractions[cluster_size]
+
+    def abstract_search(self, start: Position, goal: Position) -> Optional[List[Position]]:
+        """Find a route of cluster entrances from a start position to a goal position.
+
+        Args:
+            start (Position): Start position
+            goal (Position): End position
+
+        Returns:
+            Optional[List[Position]]: The abstract route, or None if there is none
+        """
+
+        edges = self.abstraction.connect(start, goal)
+
+        estimate = goal_heuristic(self.heuristic, goal)
+
+        frontier = PriorityQueue()
+        frontier.put(start, 0)
+        came_from: Dict[Position, Optional[Position]] = {start: None}
+        cost_so_far: Dict[Position, float] = {start: 0}
+
+        while not frontier.empty():
+            current: Position = frontier.get()
+
+            if current == goal:
+                return [start, *self.reconstruct_path(came_from, start, goal)]
+
+            neighbors = {**self.abstraction.edges.get(current, {}), **edges.get(current, {})}
+
+            for next, cost in neighbors.items():
+                new_cost = cost_so_far[current] + cost
+                if next not in cost_so_far or new_cost < cost_so_far[next]:
+                    cost_so_far[next] = new_cost
+                    frontier.put(next, new_cost + estimate(next))
+                    came_from[next] = current
+
+        return None
+
+    def corridor(self, route: List[Position], margin: int = None) -> Set[Position]:
+        """The clusters passed through by an abstract route, broadened by the margin.
+
+        Args:
+            route (List[Position]): Abstract route
+            margin (int, optional): Number of clusters added around the corridor. Defaults to None, the margin of the search.
+
+        Returns:
+            Set[Position]: Indices of the clusters in the corridor
+        """
+
+        margin = self.margin if margin is None else margin
+
+        clusters = {self.abstraction.cluster(id) for id in route}
+
+        return {(x + dx, y + dy) for x, y in clusters
+                                 for dx in range(-margin, margin + 1)
+                                 for dy in range(-margin, margin + 1)}
+
+    def gap(self, start: Position, goal: Position, cost: float) -> float:
+        """The relative gap of a route cost above the heuristic from the start to the goal. As the heuristic is a lower
+        bound of the flat A* cost, the route costs at most this much more than flat A*.
+
+        Args:
+            start (Position): Start position
+            goal (Position): End position
+            cost (float): Cost of a route from the start to the goal
+
+        Returns:
+            float: The relative gap, infinite if the heuristic is zero between distinct positions
+        """
+
+        bound = self.heuristic(start, goal)
+
+        if bound <= 0:
+            return 0.0 if cost <= 0 else np.inf
+
+        return cost / bound - 1
+
+    def search(self, start: Position, goal: Position) -> Tuple[Dict[Position, Position], Dict[Position, float]]:
+        """Find a route from a start position to a goal position, searching the grid only inside
+        the corridor selected by the abstract search. Falls back to flat A* if there is no abstract route.
+        With a tolerance and a cached cost-to-go field of the goal, the corridor is widened until the route cost
+        is within the tolerance of the exact cost, see HierarchicalAstar.
+
+        Args:
+            start (Position): Start position
+            goal (Position): End position
+
+        Returns:
+            Tuple[Dict[Position, Position], Dict[Position, float]]: A dict as a graph pointing to the previous position, and the current cost of the route.
+        """
+
+        route = self.abstract_search(start, goal)
+
+        if route is None:
+            return super().search(start, goal)
+
+        # Only an exact cost is a sound acceptance test, a heuristic bound would widen nearly every route to flat A*
+        field = self.graph.cost_to_go.get(goal)
+        bound = (1 + self.tolerance) * field[start] if (self.tolerance is not None and field is not None) else np.inf
+
+        # Clusters along the longest side of the grid, beyond which the corridor covers the whole grid
+        n_clusters = -(-max(self.graph.width, self.graph.height) // self.cluster_size)
+
+        margin = self.margin
+
+        while margin < n_clusters:
+
+            clusters = self.corridor(route, margin)
+            corridor = Corridor(self.graph, lambda id, clusters=clusters: self.abstraction.cluster(id) in clusters)
+
+            came_from, cost_so_far = Astar(corridor, heuristic=self.heuristic).search(start, goal)
+
+            if cost_so_far.get(goal, np.inf) <= bound:
+                return came_from, cost_so_far
+
+            margin = max(1, 2 * margin)
+
+        return super().search(start, goal)
\ No newline at end of file
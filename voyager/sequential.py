@@ -0,0 +1,165 @@
+import numpy as np
+from scipy import stats
+from typing import *
+
+R_EARTH = 6371 # km
+
+N_SECONDS_IN_DAY = 86400
+
+class Replicates:
+    """
+    The Replicates keep running statistics of the replicate vessels launched from one departure point on one date:
+    the arrival probability, the mean transit time of the arrived vessels and the spread of the endpoints,
+    each with the half-width of its confidence interval.
+
+    Only the endpoints and sums are kept, so the vessels themselves may be discarded once added.
+    """
+
+    def __init__(self, dt: float, confidence: float = 0.95) -> None:
+        """
+        Args:
+            dt (float): Timestep of the simulation in seconds
+            confidence (float, optional): Confidence level of the intervals. Defaults to 0.95.
+        """
+
+        self.dt = dt
+        self.confidence = confidence
+        self.z = stats.norm.ppf((1 + confidence) / 2)
+
+        self.n = 0
+        self.arrivals = 0
+
+        # Sums of transit times in days of the arrived vessels
+        self.transit_sum    = 0.0
+        self.transit_sum_sq = 0.0
+
+        # Endpoints as longitude, latitude
+        self.endpoints = []
+
+    def add(self, vessel):
+        """Adds a simulated vessel to the statistics.
+
+        Args:
+            vessel (Vessel): A simulated Vessel object, or its Summary
+
+        Returns:
+            Replicates: The Replicates instance
+        """
+
+        self.n += 1
+
+        if vessel.arrived:
+            transit = vessel.steps * self.dt / N_SECONDS_IN_DAY
+
+            self.arrivals       += 1
+            self.transit_sum    += transit
+            self.transit_sum_sq += transit ** 2
+
+        self.endpoints.append(getattr(vessel, "end", None) or (float(vessel.x), float(vessel.y)))
+
+        return self
+
+    def arrival_probability(self) -> Tuple[float, float]:
+        """The arrival probability with the half-width of its Wilson score interval.
+
+        Returns:
+            Tuple[float, float]: The probability and the half-width
+        """
+
+        if self.n == 0:
+            return np.nan, np.inf
+
+        p = self.arrivals / self.n
+        z2 = self.z ** 2
+
+        half_width = self.z * np.sqrt(p * (1 - p) / self.n + z2 / (4 * self.n ** 2)) / (1 + z2 / self.n)
+
+        return p, float(half_width)
+
+    def transit_time(self) -> Tuple[float, float]:
+        """The mean transit time in days of the arrived vessels, with the half-width of its confidence interval.
+
+        Returns:
+            Tuple[float, float]: The mean transit time and the half-width
+        """
+
+        n = self.arrivals
+
+        if n == 0:
+            return np.nan, np.inf
+
+        mean = self.transit_sum / n
+
+        if n == 1:
+            return mean, np.inf
+
+        variance = max(self.transit_sum_sq - n * mean ** 2, 0) / (n - 1)
+
+        return mean, float(self.z * np.sqrt(variance / n))
+
+    def spread(self) -> Tuple[float, float]:
+        """The spread of the endpoints in km, as the root mean square distance to their centroid,
+        with the half-width of its confidence interval by the delta method.
+
+        Returns:
+            Tuple[float, float]: The spread and the half-width
+        """
+
+        n = self.n
+
+        if n < 2:
+            return np.nan, np.inf
+
+        endpoints = np.asarray(self.endpoints)
+        centroid  = endpoints.mean(axis=0)
+
+        # Squared distances to the centroid on a local plane in km
+        scale = np.deg2rad(1) * R_EARTH * np.array([np.cos(np.deg2rad(centroid[1])), 1])
+        d2 = (((endpoints - centroid) * scale) ** 2).sum(axis=1)
+
+        spread = np.sqrt(d2.mean())
+
+        if spread == 0:
+            return 0.0, 0.0
+
+        return float(spread), float(self.z * d2.std(ddof=1) / np.sqrt(n) / (2 * spread))
+
+    def converged(self, precision: Dict[str, float]) -> bool:
+        """Whether the statistics are known to a target precision.
+
+        Args:
+            precision (Dict[str, float]): Target half-widths of the confidence intervals, by "arrival", "transit" (days) or "spread" (km).
+                                          The transit time only counts once any vessel has arrived.
+
+        Returns:
+            bool: Whether every target precision is reached
+        """
+
+        half_widths = {"arrival": self.arrival_probability()[1],
+                       "transit": self.transit_time()[1] if self.arrivals > 0 else 0,
+                       "spread": self.spread()[1]}
+
+        return all(half_widths[key] <= value for key, value in precision.items())
+
+    def summary(self) -> Dict:
+        """The statistics as a dictionary.
+
+        Returns:
+            Dict: The number of replicates, and the estimate and half-width of every statistic
+        """
+
+        p, p_hw = self.arrival_probability()
+        t, t_hw = self.transit_time()
+        s, s_hw = self.spread()
+
+        return {
+            "replicates": self.n,
+            "arrivals": self.arrivals,
+            "arrival_probability": p,
+            "arrival_probability_hw": p_hw,
+            "transit_time": t,
+            "transit_time_hw": t_hw,
+            "spread": s,
+            "spread_hw": s_hw,
+            "confidence": self.confidence
+        }
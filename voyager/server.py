@@ -0,0 +1,630 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socketserver
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from typing import *
+
+from .chart import Chart
+from .models import Model
+from .vessel import Vessel
+from .sampling import Sampler
+from .batch import BatchPlanner
+from . import field
+from . import utils
+
+FIELDS = ("u_current", "v_current", "u_wind", "v_wind")
+
+# Windows attached by a worker process, see _attach
+_WINDOWS: OrderedDict = OrderedDict()
+_MAX_WINDOWS = 32
+
+class Window(SimpleNamespace):
+    """The velocity fields of an interpolated window, as used by a Model, with its key and duration."""
+
+
+class SimulationService:
+    """
+    The SimulationService answers trajectory and ensemble requests from charts, interpolated windows and routes kept in memory
+    between requests, evicting the least recently used ones.
+
+    A chart is loaded for a number of days beyond the window requested, so that requests for later dates share it. Concurrent requests waiting
+    for the same chart, window or route are coalesced: it is made once, by the first request, and the others wait for it.
+    The vessels of an ensemble are simulated in a process pool kept alive for the lifetime of the service. The velocity fields
+    of a window are put in shared memory once, and every worker attaches to them the first time it simulates the window,
+    so that only the names of the blocks are sent with the vessels.
+
+    Windows are interpolated once per chart and launch date, for the longest duration requested from the date so far.
+
+    The windows carry no grid, so routes are planned at launch and never replanned: requests with the "replan" or "patience"
+    model parameters are rejected.
+    """
+
+    def __init__(self, data_directory: str,
+                       vessel_config = 'configs/vessels.yml',
+                       chart_days: int = 30,
+                       max_charts: int = 4,
+                       max_windows: int = 32,
+                       max_routes: int = 1024,
+                       processes: int = 0,
+                       chart_kwargs: Dict = {},
+                       model_kwargs: Dict = {}) -> None:
+        """
+        Args:
+            data_directory (str): The root directory of the velocity data
+            vessel_config (optional): The vessel configuration, as a file or a dictionary. Defaults to 'configs/vessels.yml'.
+            chart_days (int, optional): Number of days a chart is loaded for beyond the requested window. Defaults to 30.
+            max_charts (int, optional): Maximal number of charts kept in memory. Defaults to 4.
+            max_windows (int, optional): Maximal number of interpolated windows kept in memory. Defaults to 32.
+            max_routes (int, optional): Maximal number of routes kept in memory. Defaults to 1024.
+            processes (int, optional): Number of worker processes simulating ensembles, 0 to simulate in the requesting thread. Defaults to 0.
+            chart_kwargs (Dict, optional): Parameters for loading the charts. Defaults to {}.
+            model_kwargs (Dict, optional): Default parameters for the models. Defaults to {}.
+        """
+
+        self.data_directory = data_directory
+        self.vessel_params  = utils.load_vessel_config(vessel_config)
+        self.chart_days     = chart_days
+        self.chart_kwargs   = chart_kwargs
+        self.model_kwargs   = model_kwargs
+
+        self.capacity = {"chart": max_charts, "window": max_windows, "route": max_routes}
+        self.caches: Dict[str, OrderedDict] = {kind: OrderedDict() for kind in self.capacity}
+
+        # Futures of the items being made, by key
+        self.pending: Dict[Tuple, Future] = {}
+        self.lock = threading.Lock()
+
+        self.stats = {"requests": 0, "errors": 0, "coalesced": 0,
+                      **{f"{kind}_hits": 0 for kind in self.capacity},
+                      **{f"{kind}_misses": 0 for kind in self.capacity}}
+
+        self.pool = None
+
+        if processes:
+            # The workers share the resource tracker of the service, which would otherwise unlink the shared windows
+            # attached by a worker when it exits
+            resource_tracker.ensure_running()
+            self.pool = mp.Pool(processes, initializer=_init_worker, initargs=(max_windows,))
+
+    def close(self):
+        """Stops the worker processes, and releases the shared memory of the windows."""
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        with self.lock:
+            windows = list(self.caches["window"].values())
+            self.caches["window"].clear()
+
+        for window in windows:
+            window.release()
+
+    def _cached(self, kind: str, key: Tuple, create: Callable[[], Any]) -> Any:
+        """The item of a cache, made once for concurrent requests.
+
+        Args:
+            kind (str): The cache, either "chart", "window" or "route"
+            key (Tuple): Key of the item
+            create (Callable[[], Any]): Makes the item if it is neither cached nor being made
+
+        Returns:
+            Any: The item
+        """
+
+        cache = self.caches[kind]
+        key   = (kind, *key)
+
+        with self.lock:
+
+            if key in cache:
+                cache.move_to_end(key)
+                self.stats[f"{kind}_hits"] += 1
+                return cache[key]
+
+            future = self.pending.get(key)
+            owner  = future is None
+
+            if owner:
+                future = self.pending[key] = Future()
+                self.stats[f"{kind}_misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            item = create()
+
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            cache[key] = item
+
+            while len(cache) > self.capacity[kind]:
+                cache.popitem(last=False)
+
+            del self.pending[key]
+
+        future.set_result(item)
+
+        return item
+
+    def chart(self, bbox: List[float], date: pd.Timestamp, duration: int) -> Tuple[Tuple, Chart, threading.Lock]:
+        """The chart covering a launch date and duration, loading it if it is not in memory.
+
+        Args:
+            bbox (List[float]): Bounding box of the chart
+            date (pd.Timestamp): Launch date
+            duration (int): Duration in days
+
+        Returns:
+            Tuple[Tuple, Chart, threading.Lock]: The key of the chart, the chart, and the lock guarding its interpolation
+        """
+
+        end = date + pd.Timedelta(duration, 'D')
+
+        # Any chart of the bounding box covering the window will do, also one still being loaded
+        with self.lock:
+            keys = [key[1:] for key in (*self.caches["chart"], *self.pending) if key[0] == "chart"]
+
+        covering = [key for key in keys if key[0] == tuple(bbox) and key[1] <= date and key[2] >= end]
+
+        start_date, end_date = (covering[0][1], covering[0][2]) if covering else (date, end + pd.Timedelta(self.chart_days, 'D'))
+
+        key = (tuple(bbox), start_date, end_date)
+
+        def load():
+            return Chart(list(bbox), start_date, end_date).load(self.data_directory, **self.chart_kwargs), threading.Lock()
+
+        return (key, *self._cached("chart", key, load))
+
+    def window(self, bbox: List[float], date: pd.Timestamp, duration: int) -> Window:
+        """The velocity fields interpolated from a launch date for at least a duration, as used by a Model.
+
+        Args:
+            bbox (List[float]): Bounding box of the chart
+            date (pd.Timestamp): Launch date
+            duration (int): Duration in days
+
+        Returns:
+            Window: The velocity fields of the window, its duration, and the shared memory of the fields with a process pool
+        """
+
+        key, chart, lock = self.chart(bbox, date, duration)
+
+        def interpolate():
+
+            # The chart holds a single window at a time, so it is copied out
+            with lock:
+                chart.interpolate(date, duration)
+                window = Window(key=(key, date, duration), duration=duration, **{name: getattr(chart, name) for name in FIELDS})
+
+            window.shared, memory = _share(window) if self.pool is not None else (None, [])
+
+            # The shared memory lives as long as the window, also when it is evicted while a request is still using it
+            window.release = weakref.finalize(window, _release, memory)
+
+            return window
+
+        window = self._cached("window", (key, date), interpolate)
+
+        # A longer window replaces the shorter one of the date, the shorter durations read the start of it
+        while window.duration < duration:
+
+            with self.lock:
+                if self.caches["window"].get(("window", key, date)) is window:
+                    del self.caches["window"][("window", key, date)]
+
+            window = self._cached("window", (key, date), interpolate)
+
+        return window
+
+    def route(self, bbox: List[float], date: pd.Timestamp, duration: int, departure: Tuple[float, float],
+                    destination: Tuple[float, float], interval: int = 5) -> List[Tuple[float, float]]:
+        """The route from a departure point to a destination on the grid of a chart, planned once per pair of grid cells.
+
+        Args:
+            bbox (List[float]): Bounding box of the chart
+            date (pd.Timestamp): Launch date
+            duration (int): Duration in days
+            departure (Tuple[float, float]): Departure point
+            destination (Tuple[float, float]): Destination
+            interval (int, optional): Interval of the route targets. Defaults to 5.
+
+        Returns:
+            List[Tuple[float, float]]: The route in reverse order, see Vessel.plan_route
+        """
+
+        key, chart, _ = self.chart(bbox, date, duration)
+
+        # The route only depends on the grid cells, shared by the charts of a bounding box
+        key = (key[0], chart.position(*departure), chart.position(*destination), interval)
+
+        return self._cached("route", key, lambda: Vessel.plan_route(departure, chart, destination, interval))
+
+    def simulate(self, request: Dict) -> Dict:
+        """Simulates a trajectory, or an ensemble of replicates, from a request.
+
+        Args:
+            request (Dict): The request, with the parameters of Traverser.trajectory: "mode", "craft", "duration", "timestep",
+                            "destination", "speed", "date", "bbox" and "departure_point", and optionally the number of "replicates",
+                            the "sampling" and "seed" of their noise, the route "interval", and "model" parameters
+
+        Returns:
+            Dict: The trajectories as GeoJSON compliant dictionary, one feature per replicate
+        """
+
+        mode        = request.get("mode", "drifting")
+        craft       = request.get("craft", 1)
+        duration    = request.get("duration", 60)
+        timestep    = request.get("timestep", 3600)
+        destination = request.get("destination") or None
+        speed       = request.get("speed", 2)
+        replicates  = request.get("replicates", 1)
+        seed        = request.get("seed")
+
+        date = pd.Timestamp(request["date"])
+        bbox = request["bbox"]
+        departure_point = tuple(request["departure_point"])
+
+        model_kwargs = {**self.model_kwargs, **request.get("model", {})}
+
+        if model_kwargs.get("replan") is not None or model_kwargs.get("patience") is not None:
+            raise ValueError("Routes are not replanned by the service, its windows carry no grid")
+
+        window = self.window(bbox, date, duration)
+        route  = self.route(bbox, date, duration, departure_point, tuple(destination), request.get("interval", 5)) if destination else None
+
+        model = Model(duration, timestep, **model_kwargs)
+
+        vessels = [Vessel(*departure_point,
+                          craft = craft,
+                          mode = mode,
+                          route = list(route) if route is not None else None,
+                          destination = destination,
+                          speed = speed,
+                          params = self.vessel_params[mode][craft])
+                   for _ in range(replicates)]
+
+        if seed is not None:
+            n_steps = len(np.arange(start=0, stop=duration, step=timestep/86400))
+            for vessel, noise in zip(vessels, Sampler(request.get("sampling", "random"), seed=seed).paths(replicates, n_steps)):
+                vessel.noise = noise
+
+        if self.pool is not None and replicates > 1:
+            # The workers attach to the window in shared memory, only its key and the names of the blocks are sent
+            vessels = self.pool.map(partial(_run_shared, window.key, window.shared, model), vessels)
+        else:
+            vessels = [model.use(window).run_vessel(vessel) for vessel in vessels]
+
+        start_date = date.strftime('%Y-%m-%d')
+        features = []
+        for vessel in vessels:
+            stop_date = (date + pd.Timedelta((vessel.steps + 1) * timestep, unit='s')).strftime('%Y-%m-%d')
+            features.extend(vessel.to_GeoJSON(start_date, stop_date, timestep)["features"])
+
+        return {"type": "FeatureCollection", "features": features}
+
+    def handle(self, request: Dict) -> Dict:
+        """Simulates a request, returning the error instead of raising it.
+
+        Args:
+            request (Dict): The request, see simulate
+
+        Returns:
+            Dict: The trajectories, or {"error": message}
+        """
+
+        with self.lock:
+            self.stats["requests"] += 1
+
+        try:
+            return self.simulate(request)
+
+        except Exception as e:
+            with self.lock:
+                self.stats["errors"] += 1
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def batch(self, requests: List[Dict]) -> List[Dict]:
+        """Simulates a batch of requests, grouped by the charts and windows they share, see BatchPlanner.
+
+        Args:
+            requests (List[Dict]): The requests, see simulate
+
+        Returns:
+            List[Dict]: The result of every request, in the order of the requests
+        """
+
+        try:
+            order = BatchPlanner(requests, self.chart_days).order()
+        except Exception:
+            # Malformed requests are answered with their error one by one
+            order = range(len(requests))
+
+        results = [None] * len(requests)
+        for index in order:
+            results[index] = self.handle(requests[index])
+
+        return results
+
+    def status(self) -> Dict:
+        """The cached items and the counts of requests, hits and misses.
+
+        Returns:
+            Dict: The status of the service
+        """
+
+        with self.lock:
+            return {"cached": {kind: len(cache) for kind, cache in self.caches.items()},
+                    "pending": len(self.pending),
+                    **self.stats}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serves a SimulationService:
+
+        GET  /status      the status of the service
+        POST /trajectory  a single request, see SimulationService.simulate
+        POST /batch       a list of requests, or {"requests": [...]}, answered in order
+    """
+
+    def do_GET(self):
+
+        if self.path.rstrip("/") == "/status":
+            return self._send(200, self.server.service.status())
+
+        self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body   = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as e:
+            return self._send(400, {"error": f"Invalid JSON: {e}"})
+
+        service = self.server.service
+        path    = self.path.rstrip("/")
+
+        if path == "/trajectory" and isinstance(body, dict):
+            result = service.handle(body)
+            return self._send(400 if "error" in result else 200, result)
+
+        if path == "/batch" and isinstance(body, (list, dict)):
+            requests = body.get("requests", []) if isinstance(body, dict) else body
+            return self._send(200, service.batch(requests))
+
+        self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def _send(self, status: int, payload):
+
+        data = json.dumps(payload, default=_to_json).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def _share(window: Window) -> Tuple[Dict, List[shared_memory.SharedMemory]]:
+    """Copies the values of the Fields of a window to shared memory.
+
+    Args:
+        window (Window): A window, see SimulationService.window
+
+    Returns:
+        Tuple[Dict, List[shared_memory.SharedMemory]]: The fields with the names of their blocks instead of their values, and the blocks
+    """
+
+    shared, memory = {}, []
+
+    for name in FIELDS:
+
+        f = getattr(window, name)
+
+        # Fields without values of their own, such as tiled fields, are sent as they are
+        if not isinstance(f, field.Field):
+            shared[name] = f
+            continue
+
+        state  = f.__getstate__().copy()
+        values = state.pop("values")
+
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.copyto(np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf), values)
+
+        shared[name] = (type(f), state, block.name, values.shape, values.dtype.str)
+        memory.append(block)
+
+    return shared, memory
+
+
+def _release(memory: List[shared_memory.SharedMemory]):
+
+    for block in memory:
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _init_worker(max_windows: int):
+
+    global _MAX_WINDOWS
+    _MAX_WINDOWS = max_windows
+
+
+def _attach(key: Tuple, shared: Dict) -> Window:
+    """The window of a key in a worker process, attached to its shared memory the first time.
+
+    Args:
+        key (Tuple): Key of the window
+        shared (Dict): The fields of the window, see _share
+
+    Returns:
+        Window: The velocity fields of the window
+    """
+
+    if key in _WINDOWS:
+        _WINDOWS.move_to_end(key)
+        return _WINDOWS[key][0]
+
+    fields, blocks = {}, []
+
+    for name, f in shared.items():
+
+        if not isinstance(f, tuple):
+            fields[name] = f
+            continue
+
+        cls, state, block_name, shape, dtype = f
+
+        # Attached blocks are not owned by the worker, the service unlinks them
+        block = shared_memory.SharedMemory(name=block_name)
+
+        x = cls.__new__(cls)
+        state = {**state, "values": np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)}
+
+        if hasattr(x, "__setstate__"):
+            x.__setstate__(state)
+        else:
+            x.__dict__.update(state)
+
+        fields[name] = x
+        blocks.append(block)
+
+    _WINDOWS[key] = (Window(key=key, **fields), blocks)
+
+    while len(_WINDOWS) > _MAX_WINDOWS:
+        _, (window, blocks) = _WINDOWS.popitem(last=False)
+        del window
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass
+
+    return _WINDOWS[key][0]
+
+
+def _run_shared(key: Tuple, shared: Dict, model: Model, vessel: Vessel):
+    """Runs a vessel in a worker process on a window in shared memory, see SimulationService.simulate."""
+
+    return model.use(_attach(key, shared)).run_vessel(vessel)
+
+
+def _to_json(x):
+
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+
+    raise TypeError(f"Object of type {type(x).__name__} is not JSON serializable")
+
+
+def serve(service: SimulationService, address: Union[Tuple[str, int], str], verbose: bool = False) -> socketserver.BaseServer:
+    """Creates a threaded HTTP server for a SimulationService, on a TCP address or a Unix socket.
+
+    Args:
+        service (SimulationService): The service answering the requests
+        address (Union[Tuple[str, int], str]): A (host, port) tuple, or the path of a Unix socket
+        verbose (bool, optional): Whether to log every request. Defaults to False.
+
+    Returns:
+        socketserver.BaseServer: The server, to be started with serve_forever
+    """
+
+    if isinstance(address, str):
+
+        if os.path.exists(address):
+            os.remove(address)
+
+        server = _UnixHTTPServer(address, _Handler)
+
+    else:
+        server = ThreadingHTTPServer(tuple(address), _Handler)
+
+    server.service = service
+    server.verbose = verbose
+
+    return server
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Serves trajectory requests from charts kept in memory")
+    parser.add_argument("data_directory", help="The root directory of the velocity data")
+    parser.add_argument("--vessel-config", default="configs/vessels.yml")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=None, help="Path of a Unix socket, instead of the host and port")
+    parser.add_argument("--processes", type=int, default=0)
+    parser.add_argument("--chart-days", type=int, default=30)
+    parser.add_argument("--max-charts", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true")
+
+    args = parser.parse_args()
+
+    service = SimulationService(args.data_directory,
+                                vessel_config=args.vessel_config,
+                                chart_days=args.chart_days,
+                                max_charts=args.max_charts,
+                                processes=args.processes)
+
+    server = serve(service, args.socket or (args.host, args.port), verbose=args.verbose)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import numpy as np
+from typing import *
+
+R_EARTH = 6371 # km
+
+def _project(coordinates: np.ndarray) -> np.ndarray:
+    """Projects WGS84 coordinates to kilometres on a local equirectangular plane, accurate for trajectory tolerances.
+
+    Args:
+        coordinates (np.ndarray): Coordinates with shape (N, 2) as longitude, latitude
+
+    Returns:
+        np.ndarray: Projected coordinates with shape (N, 2) in km
+    """
+
+    latitude = np.deg2rad(np.mean(coordinates[:, 1]))
+
+    return np.deg2rad(coordinates) * R_EARTH * np.array([np.cos(latitude), 1])
+
+def simplify(coordinates: np.ndarray, tolerance: float, times: np.ndarray = None) -> np.ndarray:
+    """Simplifies a trajectory with the Douglas-Peucker algorithm, keeping the vertices needed to stay within a tolerance.
+
+    With times, the simplification is time-aware: the distance of a vertex to a segment is measured to the position
+    interpolated in time along the segment (the synchronized euclidean distance), so that the kept vertices and their
+    times also preserve the speed along the trajectory.
+
+    Args:
+        coordinates (np.ndarray): Coordinates with shape (N, 2) as longitude, latitude
+        tolerance (float): Maximal distance in km from the simplified trajectory
+        times (np.ndarray, optional): Time of every vertex. Defaults to None.
+
+    Returns:
+        np.ndarray: Sorted indices of the kept vertices, always including the first and last
+    """
+
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    n = len(coordinates)
+
+    if n <= 2:
+        return np.arange(n)
+
+    xy = _project(coordinates)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+
+        first, last = stack.pop()
+
+        if last - first < 2:
+            continue
+
+        points = xy[first + 1:last]
+        a, b   = xy[first], xy[last]
+
+        if times is not None:
+            span = times[last] - times[first]
+            s = (times[first + 1:last] - times[first]) / span if span > 0 else np.zeros(len(points))
+            distance = np.linalg.norm(points - (a + s[:, None] * (b - a)), axis=1)
+
+        else:
+            ab = b - a
+            length = np.dot(ab, ab)
+            s = np.clip((points - a) @ ab / length, 0, 1) if length > 0 else np.zeros(len(points))
+            distance = np.linalg.norm(points - (a + s[:, None] * ab), axis=1)
+
+        furthest = np.argmax(distance)
+
+        if distance[furthest] > tolerance:
+            index = first + 1 + furthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return np.flatnonzero(keep)
+
+def delta_encode(coordinates: np.ndarray, precision: float = 1e-5) -> List[int]:
+    """Encodes coordinates as fixed-point integers, the first vertex absolute and the rest as differences to the previous vertex.
+
+    Args:
+        coordinates (np.ndarray): Coordinates with shape (N, 2) as longitude, latitude
+        precision (float, optional): Resolution of the fixed-point coordinates in degrees. Defaults to 1e-5.
+
+    Returns:
+        List[int]: The flattened encoded coordinates
+    """
+
+    fixed = np.round(np.asarray(coordinates, dtype=float).reshape(-1, 2) / precision).astype(np.int64)
+
+    deltas = np.diff(fixed, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+
+    return deltas.ravel().tolist()
+
+def delta_decode(encoded: List[int], precision: float = 1e-5) -> np.ndarray:
+    """Decodes coordinates encoded with delta_encode.
+
+    Args:
+        encoded (List[int]): The flattened encoded coordinates
+        precision (float, optional): Resolution of the fixed-point coordinates in degrees. Defaults to 1e-5.
+
+    Returns:
+        np.ndarray: Coordinates with shape (N, 2) as longitude, latitude
+    """
+
+    deltas = np.asarray(encoded, dtype=np.int64).reshape(-1, 2)
+
+    return np.cumsum(deltas, axis=0) * precision
@@ -0,0 +1,135 @@
+import itertools
+
+import pandas as pd
+from typing import *
+
+from .chart import Chart
+from .models import Vessel, Model
+from . import utils
+
+class Sweep:
+    """
+    The Sweep runs every combination of propulsion mode, craft, paddling speed and model settings over the same
+    date range, departures and destination.
+
+    The chart is loaded once, each launch window is interpolated once and the routes from the departure points are planned once,
+    and every configuration is simulated against these shared structures.
+    """
+
+    def __init__(self, modes = ['drifting'],
+                       crafts = [1],
+                       speeds = [2],
+                       model_settings = [{}],
+                       duration = 60,
+                       timestep = 1,
+                       destination = [],
+                       start_date = '',
+                       end_date = '',
+                       launch_freq = 5,
+                       bbox = [],
+                       departure_points = [],
+                       data_directory = '',
+                       vessel_config='configs/vessels.yml') -> None:
+
+        self.modes          = modes
+        self.crafts         = crafts
+        self.speeds         = speeds
+        self.model_settings = model_settings
+        self.duration       = duration
+        self.dt             = timestep
+        self.vessel_params  = utils.load_vessel_config(vessel_config)
+
+        self.destination    = destination
+        self.data_directory = data_directory
+
+        # Define datetime objects to limit simulation
+        self.start_date     = pd.to_datetime(start_date)
+        self.end_date       = pd.to_datetime(end_date)
+        self.dates          = pd.date_range(self.start_date, self.end_date)
+
+        # Interval in days to launch vessels
+        self.launch_day_frequency = launch_freq
+
+        # The bounding box limits the region of simulation
+        self.bbox = bbox
+
+        # Starting points for trajectories
+        self.departure_points = departure_points
+
+    def configurations(self) -> List[Dict]:
+        """The configurations of the sweep. Crafts missing for a mode in the vessel configuration are skipped,
+        and the speed is only varied for paddling.
+
+        Returns:
+            List[Dict]: Configurations with the mode, craft, speed and index of the model settings
+        """
+
+        configurations = []
+        for mode, craft, speed, model in itertools.product(self.modes, self.crafts, self.speeds, range(len(self.model_settings))):
+
+            if craft not in self.vessel_params.get(mode, {}):
+                continue
+
+            configuration = {"mode": mode, "craft": craft, "speed": speed if mode == 'paddling' else None, "model": model}
+
+            if configuration not in configurations:
+                configurations.append(configuration)
+
+        return configurations
+
+    def run(self, chart_kwargs={}) -> List[Dict]:
+        """Generates the trajectories of every configuration in the date range, with a certain launch day frequency for the vessels.
+
+        Args:
+            chart_kwargs (dict, optional): Parameter for the chart. Defaults to {}.
+
+        Returns:
+            List[Dict]: For every configuration, its mode, craft, speed and model settings, and
+                        a date-tagged dictionary of the simulated vessels under "results"
+        """
+
+        # The chart is shared by all configurations
+        chart = Chart(self.bbox, self.start_date, self.end_date).load(self.data_directory, **chart_kwargs)
+
+        # One model for each model settings
+        models = [Model(self.duration, self.dt, **settings) for settings in self.model_settings]
+
+        # The routes depend on the chart only, not on the vessel
+        routes = [Vessel.plan_route(point, chart, self.destination) for point in self.departure_points]
+
+        configurations = self.configurations()
+
+        results = [{**configuration, "model": self.model_settings[configuration["model"]], "results": {}}
+                   for configuration in configurations]
+
+        for date in self.dates[::self.launch_day_frequency]:
+
+            date_str = date.strftime('%Y-%m-%d')
+
+            # Interpolate the data for only the duration specified, once for all configurations
+            chart.interpolate(date, self.duration)
+
+            for model in models:
+                model.use(chart)
+
+            for configuration, result in zip(configurations, results):
+
+                model  = models[configuration["model"]]
+                params = self.vessel_params[configuration["mode"]][configuration["craft"]]
+
+                trajectories = []
+                for (x, y), route in zip(self.departure_points, routes):
+
+                    vessel = Vessel(x, y,
+                                    craft = configuration["craft"],
+                                    mode = configuration["mode"],
+                                    route = list(route) if route is not None else None,
+                                    destination = self.destination,
+                                    speed = configuration["speed"] or 0,
+                                    params = params)
+
+                    trajectories.append(model.run(vessel))
+
+                result["results"][date_str] = trajectories
+
+        return results
@@ -0,0 +1,234 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import *
+
+from . import utils
+from . import field
+
+Tile = Tuple[int, int]
+
+# Number of time windows kept per tile, see TileCache.field
+WINDOWS_PER_TILE = 4
+
+class TileCache:
+    """
+    The TileCache splits the bounding box of a Chart into fixed longitude-latitude tiles, loaded from the data directory
+    the first time they are sampled, and keeps the most recently used tiles in memory.
+
+    Every tile overlaps its neighbours by a margin of grid cells, so that positions close to the tile edges are interpolated
+    exactly as on the full chart.
+
+    The Fields of the time windows sampled from a tile are kept along with the tile, and dropped when it is evicted.
+    """
+
+    def __init__(self, bbox: List,
+                       start_date: pd.Timestamp,
+                       end_date: pd.Timestamp,
+                       data_dir: str,
+                       tile_size: float = 5,
+                       max_tiles: int = 64,
+                       margin: float = 1,
+                       precision: str = "float64") -> None:
+        """
+        Args:
+            bbox (List): Bounding box of the chart
+            start_date (pd.Timestamp): Start date of the chart
+            end_date (pd.Timestamp): End date of the chart
+            data_dir (str): The root directory of the velocity data
+            tile_size (float, optional): Width and height of the tiles in degrees. Defaults to 5.
+            max_tiles (int, optional): Maximal number of tiles kept in memory, for each source. Defaults to 64.
+            margin (float, optional): Overlap of the tiles in degrees, at least the grid resolution. Defaults to 1.
+            precision (str, optional): Precision the tiles are stored with. Defaults to "float64".
+        """
+
+        self.bbox = bbox
+        self.start_date = start_date
+        self.end_date = end_date
+        self.data_dir = data_dir
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.margin = margin
+        self.precision = precision
+
+        self.tiles: Dict[str, OrderedDict] = {"currents": OrderedDict(), "winds": OrderedDict()}
+        self.windows: Dict[str, Dict[Tile, OrderedDict]] = {"currents": {}, "winds": {}}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+
+        # Worker processes load the tiles they sample themselves
+        state = self.__dict__.copy()
+        state["tiles"] = {source: OrderedDict() for source in self.tiles}
+        state["windows"] = {source: {} for source in self.windows}
+        del state["lock"]
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def tile(self, longitude: np.ndarray, latitude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The tiles of a set of positions.
+
+        Args:
+            longitude (np.ndarray): Longitudes (WGS84)
+            latitude (np.ndarray): Latitudes (WGS84)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The tile indices along the longitude and latitude
+        """
+
+        n_x = max(int(np.ceil((self.bbox[2] - self.bbox[0]) / self.tile_size)), 1)
+        n_y = max(int(np.ceil((self.bbox[3] - self.bbox[1]) / self.tile_size)), 1)
+
+        i = np.clip(np.floor((longitude - self.bbox[0]) / self.tile_size), 0, n_x - 1).astype(int)
+        j = np.clip(np.floor((latitude  - self.bbox[1]) / self.tile_size), 0, n_y - 1).astype(int)
+
+        return i, j
+
+    def tile_bbox(self, tile: Tile) -> List[float]:
+        """The bounding box of a tile, including its margin.
+
+        Args:
+            tile (Tile): The tile indices
+
+        Returns:
+            List[float]: Bounding box of the tile
+        """
+
+        i, j = tile
+
+        return [max(self.bbox[0] + i * self.tile_size - self.margin, self.bbox[0]),
+                max(self.bbox[1] + j * self.tile_size - self.margin, self.bbox[1]),
+                min(self.bbox[0] + (i + 1) * self.tile_size + self.margin, self.bbox[2]),
+                min(self.bbox[1] + (j + 1) * self.tile_size + self.margin, self.bbox[3])]
+
+    def get(self, source: str, tile: Tile) -> Tuple[xr.DataArray, xr.DataArray]:
+        """The velocity fields of a tile, loading it if it is not in memory.
+
+        Args:
+            source (str): Data source, either "currents" or "winds"
+            tile (Tile): The tile indices
+
+        Returns:
+            Tuple[xr.DataArray, xr.DataArray]: The velocity x (east-west) and y (south-north) components of the tile
+        """
+
+        tiles = self.tiles[source]
+
+        with self.lock:
+            if tile in tiles:
+                tiles.move_to_end(tile)
+                return tiles[tile]
+
+        u, v = utils.load_data(start=self.start_date,
+                               end=self.end_date,
+                               bbox=self.tile_bbox(tile),
+                               data_directory=self.data_dir,
+                               source=source)
+
+        fields = (field.pack(u, self.precision), field.pack(v, self.precision))
+
+        with self.lock:
+            tiles[tile] = fields
+            tiles.move_to_end(tile)
+
+            while len(tiles) > self.max_tiles:
+                evicted, _ = tiles.popitem(last=False)
+                self.windows[source].pop(evicted, None)
+
+        return fields
+
+    def field(self, source: str, tile: Tile, component: int, start_date: pd.Timestamp, end_date: pd.Timestamp) -> field.Field:
+        """The Field of a velocity component of a tile within a time window, created once per tile and window.
+
+        Args:
+            source (str): Data source, either "currents" or "winds"
+            tile (Tile): The tile indices
+            component (int): The velocity component, 0 for x (east-west) and 1 for y (south-north)
+            start_date (pd.Timestamp): Start of the time window
+            end_date (pd.Timestamp): End of the time window
+
+        Returns:
+            field.Field: The Field of the tile within the window
+        """
+
+        key = (component, start_date, end_date)
+
+        with self.lock:
+            windows = self.windows[source].get(tile)
+            if windows is not None and key in windows:
+                windows.move_to_end(key)
+                return windows[key]
+
+        x = self.get(source, tile)[component]
+        f = field.Field.from_xarray(x.sel(time=slice(start_date, end_date)))
+
+        with self.lock:
+
+            # Only kept while the tile is in memory
+            if tile in self.tiles[source]:
+                windows = self.windows[source].setdefault(tile, OrderedDict())
+                windows[key] = f
+
+                while len(windows) > WINDOWS_PER_TILE:
+                    windows.popitem(last=False)
+
+        return f
+
+
+class TiledField:
+    """
+    The TiledField samples a velocity field of a TileCache within a time window, with the same interface as a Field.
+    Only the tiles containing the sampled positions are loaded.
+    """
+
+    def __init__(self, cache: TileCache, source: str, component: str, start_date: pd.Timestamp, end_date: pd.Timestamp) -> None:
+
+        self.cache = cache
+        self.source = source
+        self.component = ("u", "v").index(component)
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def __call__(self, points) -> np.ndarray:
+        """Samples the field.
+
+        Args:
+            points: A tuple of (time, longitude, latitude), or an array with the last dimension of size 3
+
+        Returns:
+            np.ndarray: The sampled values, NaN outside the field
+        """
+
+        if isinstance(points, tuple):
+            t, longitude, latitude = np.broadcast_arrays(*(np.asarray(p, dtype=np.float64) for p in points))
+        else:
+            points = np.asarray(points, dtype=np.float64)
+            t, longitude, latitude = points[..., 0], points[..., 1], points[..., 2]
+
+        shape = t.shape
+        t, longitude, latitude = t.ravel(), longitude.ravel(), latitude.ravel()
+
+        out = np.full(t.shape, np.nan)
+
+        inside = (longitude >= self.cache.bbox[0]) & (longitude <= self.cache.bbox[2]) & \
+                 (latitude  >= self.cache.bbox[1]) & (latitude  <= self.cache.bbox[3])
+
+        i, j = self.cache.tile(longitude, latitude)
+
+        for tile in set(zip(i[inside], j[inside])):
+
+            selected = inside & (i == tile[0]) & (j == tile[1])
+
+            f = self.cache.field(self.source, tile, self.component, self.start_date, self.end_date)
+
+            out[selected] = f((t[selected], longitude[selected], latitude[selected]))
+
+        return out.reshape(shape)
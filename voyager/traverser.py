@@ -1,11 +1,24 @@
 import multiprocessing as mp
+from functools import partial
 
+import numpy as np
 import pandas as pd
 from .chart import Chart
 from .models import Vessel, Model
+from .raster import Accumulator
+from .destinations import Destinations
+from .isochrone import IsochroneRouter
+from .sequential import Replicates
+from .sampling import Sampler
+from .batch import BatchPlanner
 from . import utils
 from typing import *
 
+N_SECONDS_IN_DAY = 86400
+
+# The model of the worker processes of Traverser.run_sequential, set by _init_model
+_MODEL = None
+
 class Traverser:
 
     def __init__(self, mode = 'drift', 
@@ -48,6 +61,9 @@ class Traverser:
         # Starting points for trajectories
         self.departure_points = departure_points
 
+        # Rasters accumulated during the last run, if requested
+        self.accumulator = None
+
     @classmethod
     def trajectory(
             cls,
@@ -65,7 +81,8 @@ class Traverser:
             chart_kwargs = {}, 
             model_kwargs = {}, 
             chart = None, 
-            model = None) -> Dict:
+            model = None,
+            routing = 'astar') -> Dict:
         """Generates a single set of trajectories from a single set of departure and destination points.
 
         Args:
@@ -84,6 +101,8 @@ class Traverser:
             model_kwargs (dict, optional): Parameters for the model configuration. Defaults to {}.
             chart (_type_, optional): Pre-supplied Chart object. Defaults to None.
             model (_type_, optional): Pre-supplied Model object. Defaults to None.
+            routing (str, optional): Route finding, either 'astar' on the shoreline weighted grid or 'isochrone' 
+                                     under the winds and currents at the date. Defaults to 'astar'.
 
         Returns:
             Dict: The trajectories as GeoJSON compliant dictionary
@@ -104,6 +123,16 @@ class Traverser:
         if not model:
             model = Model(duration, timestep, **model_kwargs)
 
+
+        # Interpolate the data for only the duration specified
+        chart.interpolate(chart.start_date, duration)
+
+        if routing == 'isochrone':
+            router = IsochroneRouter(chart, mode, vessel_params[mode][craft], speed=speed, craft=craft, timestep=timestep, duration=duration)
+        elif routing == 'astar':
+            router = None
+        else:
+            raise ValueError("Routing must be astar or isochrone")
         
         vessel = Vessel.from_position(departure_point, 
                                       craft = craft,
@@ -111,10 +140,8 @@ class Traverser:
                                       destination = destination,
                                       speed =speed,
                                       mode = mode,
-                                      params = vessel_params[mode][craft])
-
-        # Interpolate the data for only the duration specified
-        chart.interpolate(chart.start_date, duration)
+                                      params = vessel_params[mode][craft],
+                                      router = router)
 
         # Use the interpolated values in the model
         model.use(chart)
@@ -123,18 +150,47 @@ class Traverser:
         vessel = model.run(vessel)
 
         start_date_str = chart.start_date.strftime('%Y-%m-%d')
-        stop_date_str  = (chart.start_date + pd.Timedelta(len(vessel.trajectory)*timestep, unit='s')).strftime('%Y-%m-%d')
+        stop_date_str  = (chart.start_date + pd.Timedelta((vessel.steps + 1)*timestep, unit='s')).strftime('%Y-%m-%d')
 
         return vessel.to_GeoJSON(start_date_str, stop_date_str, timestep)
 
+    @classmethod
+    def trajectories(cls, specs: List[Dict], data_directory = '', vessel_params = 'configs/vessels.yml', chart_kwargs = {}, model_kwargs = {}, chart_days = 30) -> List[Dict]:
+        """Generates the trajectories of a list of specs, each with its own departure point, date, craft and duration.
+
+        The specs are grouped by the charts and launch windows they share, see BatchPlanner, so that every chart is loaded
+        and every window interpolated only once.
+
+        Args:
+            specs (List[Dict]): Trajectory specs with the parameters of trajectory: "mode", "craft", "duration", "timestep",
+                                "destination", "speed", "date", "bbox" and "departure_point". Missing parameters take the
+                                defaults of batch.DEFAULTS, which differ from those of trajectory in the mode and timestep.
+            data_directory (str, optional): The root directory of the velocity data. Defaults to ''.
+            vessel_params (optional): The vessel configuration, as a file or a dictionary. Defaults to 'configs/vessels.yml'.
+            chart_kwargs (dict, optional): Parameters for the chart configuration. Defaults to {}.
+            model_kwargs (dict, optional): Parameters for the model configuration. Defaults to {}.
+            chart_days (int, optional): Maximal span in days of a chart shared by specs. Defaults to 30.
+
+        Returns:
+            List[Dict]: The trajectories as GeoJSON compliant dictionaries, in the order of the specs
+        """
+
+        return BatchPlanner(specs, chart_days).run(data_directory, vessel_params, chart_kwargs, model_kwargs)
 
 
-    def run(self, model_kwargs={}, chart_kwargs={}) -> Dict[str, Dict]:
+
+    def run(self, model_kwargs={}, chart_kwargs={}, accumulate=False, destinations: Destinations = None) -> Dict[str, Dict]:
         """Generates a set of trajectories in a date range, with a certain launch day frequency for the vessels.
 
         Args:
-            model_kwargs (dict, optional): Parameters for the model. Defaults to {}.
+            model_kwargs (dict, optional): Parameters for the model, such as the recording mode. 
+                                           With record="summary" only the Summary of every vessel is kept. Defaults to {}.
             chart_kwargs (dict, optional): Parameter for the chart. Defaults to {}.
+            accumulate (bool, optional): Whether to accumulate visit and arrival rasters in self.accumulator. Defaults to False.
+            destinations (Destinations, optional): Candidate destinations, such as harbours or coast segments, where the vessels
+                                                   count as arrived at whichever they reach first, recorded as their landfall.
+                                                   The vessels of a launch date are then stepped together, see Model.run_batch.
+                                                   Defaults to None.
 
         Returns:
             Dict[str, Dict]: A date-tagged dictionary with GeoJSON compliant dictionary results
@@ -149,9 +205,17 @@ class Traverser:
         # traversal across the oceans over time
         model = Model(self.duration, self.dt, **model_kwargs)
 
+        vessel_params = utils.load_vessel_config(self.vessel_config)
+
+        # The accumulator collapses the trajectories into rasters on the chart grid
+        self.accumulator = Accumulator.from_chart(chart) if accumulate else None
+
         results = {}
         for date in self.dates[::self.launch_day_frequency]:
 
+            if self.accumulator is not None:
+                self.accumulator.start(date.strftime('%Y-%m-%d'))
+
             # Vessel objects are the individual agents traversing the ocean
             vessels = Vessel.from_positions(self.departure_points, 
                                             craft = self.craft,
@@ -159,19 +223,24 @@ class Traverser:
                                             destination = self.destination, 
                                             speed = self.speed, 
                                             mode = self.mode, 
-                                            vessel_config=self.vessel_config)
+                                            params = vessel_params[self.mode][self.craft])
             
             # Interpolate the data for only the duration specified
             chart.interpolate(date, self.duration)
 
             # Use the interpolated values in the model
-            model.use(chart)
+            model.use(chart).accumulate(self.accumulator).arrive_at(destinations)
+
+            vessels = model.run_batch(vessels)
 
             trajectories = []
 
-            for vessel in vessels:
+            for departure, vessel in enumerate(vessels):
 
-                trajectories.append(model.run(vessel))
+                if self.accumulator is not None:
+                    self.accumulator.tally(departure, vessel.arrived)
+
+                trajectories.append(vessel.summary() if model.record == "summary" else vessel)
 
             # Add the trajectories for the date
             results.update({date.strftime('%Y-%m-%d'): trajectories})
@@ -179,12 +248,14 @@ class Traverser:
         return results
 
 
-    def run_mp(self, model_kwargs={}, chart_kwargs={}) -> Dict[str, Dict]:
+    def run_mp(self, model_kwargs={}, chart_kwargs={}, accumulate=False) -> Dict[str, Dict]:
         """Pseudo-parallel generation of a set of trajectories in a date range, with a certain launch day frequency for the vessels.
 
         Args:
-            model_kwargs (dict, optional): Parameters for the model. Defaults to {}.
+            model_kwargs (dict, optional): Parameters for the model, such as the recording mode. 
+                                           With record="summary" only the Summary of every vessel is kept. Defaults to {}.
             chart_kwargs (dict, optional): Parameter for the chart. Defaults to {}.
+            accumulate (bool, optional): Whether to accumulate visit and arrival rasters in self.accumulator. Defaults to False.
 
         Returns:
             Dict[str, Dict]: A date-tagged dictionary with GeoJSON compliant dictionary results
@@ -198,9 +269,17 @@ class Traverser:
         # traversal across the oceans over time
         model = Model(self.duration, self.dt, **model_kwargs)
 
+        vessel_params = utils.load_vessel_config(self.vessel_config)
+
+        # The accumulator collapses the trajectories into rasters on the chart grid
+        self.accumulator = Accumulator.from_chart(chart) if accumulate else None
+
         results = {}
         for date in self.dates[::self.launch_day_frequency]:
 
+            if self.accumulator is not None:
+                self.accumulator.start(date.strftime('%Y-%m-%d'))
+
             # Vessel objects are the individual agents traversing the ocean
             vessels = Vessel.from_positions(self.departure_points, 
                                             craft = self.craft,
@@ -208,7 +287,7 @@ class Traverser:
                                             destination = self.destination, 
                                             speed = self.speed, 
                                             mode = self.mode, 
-                                            vessel_config=self.vessel_config)
+                                            params = vessel_params[self.mode][self.craft])
             
             # Interpolate the data for only the duration specified
             chart.interpolate(date, self.duration)
@@ -216,9 +295,31 @@ class Traverser:
             # Use the interpolated values in the model
             model.use(chart)
 
-            with mp.Pool(mp.cpu_count()) as p:
+            if self.accumulator is None:
+
+                with mp.Pool(mp.cpu_count()) as p:
+
+                    trajectories = p.map(model.run_vessel, vessels)
+
+            else:
+
+                # Every worker accumulates into its own empty rasters, merged afterwards
+                model.accumulate(self.accumulator.empty())
+
+                size   = -(-len(vessels) // mp.cpu_count())
+                chunks = [vessels[i:i+size] for i in range(0, len(vessels), size)]
+
+                with mp.Pool(mp.cpu_count()) as p:
+
+                    outputs = p.map(partial(_run_chunk, model), chunks)
+
+                trajectories = [vessel for chunk, _ in outputs for vessel in chunk]
+
+                for _, accumulator in outputs:
+                    self.accumulator.merge(accumulator)
 
-                trajectories = p.map(model.run, vessels)
+                for departure, vessel in enumerate(trajectories):
+                    self.accumulator.tally(departure, vessel.arrived)
 
             # Add the trajectories for the date
             results.update({date.strftime('%Y-%m-%d'): trajectories})
@@ -226,7 +327,181 @@ class Traverser:
         return results
 
 
+    def backtrack(self, replicates: int = 100, model_kwargs={}, chart_kwargs={}) -> Accumulator:
+        """Maps where drifting vessels arriving at the departure points in a date range may have been launched from.
+
+        Vessels are simulated backward in time from every departure point, taken as an arrival site, over the duration before 
+        every arrival date, see Model. The rasters of each arrival date are accumulated in self.accumulator: the ends of the 
+        vessels are the origin density of launches up to a full duration earlier, the visits the origin density of launches at any 
+        time within the duration, and the first visits the shortest drift in days from each cell to the arrival sites.
+
+        Vessels drifting back onto land or out of the chart stop there, so their ends are coastal or boundary origins of launches
+        less than the full duration earlier, counted along with the ends of the vessels that drifted back for the full duration.
+
+        One backward ensemble per arrival site answers the inverse question without simulating forward from every cell of the chart.
+
+        Args:
+            replicates (int, optional): Number of vessels simulated backward from every arrival site. Defaults to 100.
+            model_kwargs (dict, optional): Parameters for the model. Defaults to {}.
+            chart_kwargs (dict, optional): Parameter for the chart. Defaults to {}.
+
+        Returns:
+            Accumulator: The origin rasters, tagged by arrival date
+        """
+
+        # The windows end at the arrival dates
+        chart = Chart(self.bbox, self.start_date - pd.Timedelta(self.duration, unit='days'), self.end_date).load(self.data_directory, **chart_kwargs)
+
+        model = Model(self.duration, self.dt, **{"record": "summary", **model_kwargs, "backward": True})
+
+        vessel_params = utils.load_vessel_config(self.vessel_config)
+
+        self.accumulator = Accumulator.from_chart(chart)
+
+        for date in self.dates[::self.launch_day_frequency]:
+
+            self.accumulator.start(date.strftime('%Y-%m-%d'))
+
+            # Interpolate the data for the duration before the arrival date
+            chart.interpolate(date - pd.Timedelta(self.duration, unit='days'), self.duration)
+
+            model.use(chart).accumulate(self.accumulator)
+
+            for departure, point in enumerate(self.departure_points):
+                for _ in range(replicates):
+
+                    vessel = Vessel(*point, 
+                                    craft = self.craft, 
+                                    mode = "drifting", 
+                                    params = vessel_params["drifting"][self.craft])
+
+                    vessel = model.run(vessel)
+
+                    self.accumulator.tally(departure, vessel.arrived)
+
+        return self.accumulator
+
+
+    def run_sequential(self, precision={"arrival": 0.05}, 
+                             block_size=50, 
+                             min_reps=50, 
+                             max_reps=5000, 
+                             confidence=0.95, 
+                             parallel=True, 
+                             sampling="random",
+                             stratified=False,
+                             seed=None,
+                             model_kwargs={}, 
+                             chart_kwargs={}) -> Dict[str, List[Dict]]:
+        """Sequential sampling of replicate vessels in a date range, with a certain launch day frequency for the vessels.
+
+        Replicates are launched from every departure point in blocks, and each (date, departure) cell stops once the
+        confidence intervals of its statistics are within the target precision, or at the maximal number of replicates.
+        Only the statistics are kept, not the vessels.
+
+        Args:
+            precision (dict, optional): Target half-widths of the confidence intervals, by "arrival", "transit" (days) 
+                                        or "spread" (km). Defaults to {"arrival": 0.05}.
+            block_size (int, optional): Number of replicates launched at once per cell. Defaults to 50.
+            min_reps (int, optional): Minimal number of replicates per cell. Defaults to 50.
+            max_reps (int, optional): Maximal number of replicates per cell. Defaults to 5000.
+            confidence (float, optional): Confidence level of the intervals. Defaults to 0.95.
+            parallel (bool, optional): Whether to simulate the blocks in a process pool. Defaults to True.
+            sampling (str, optional): Sampling of the noise paths of the replicates, "random", "antithetic" or "sobol", see Sampler. Defaults to "random".
+            stratified (bool, optional): Whether to stratify the deflection signs of every block. Defaults to False.
+            seed (int, optional): Seed of the noise paths, making the statistics reproducible. Defaults to None.
+            model_kwargs (dict, optional): Parameters for the model. Defaults to {}.
+            chart_kwargs (dict, optional): Parameter for the chart. Defaults to {}.
+
+        Returns:
+            Dict[str, List[Dict]]: A date-tagged dictionary with the statistics of every departure point, see Replicates.summary
+        """
+
+        chart = Chart(self.bbox, self.start_date, self.end_date).load(self.data_directory, **chart_kwargs)
+
+        # Only the fixed-size records are needed for the statistics
+        model = Model(self.duration, self.dt, **{**model_kwargs, "record": "summary"})
+
+        vessel_params = utils.load_vessel_config(self.vessel_config)
+
+        # The routes depend on the chart only, not on the replicate
+        routes = [Vessel.plan_route(point, chart, self.destination) for point in self.departure_points]
+
+        n_steps = len(np.arange(start=0, stop=self.duration, step=self.dt/N_SECONDS_IN_DAY))
+
+        results = {}
+        for d, date in enumerate(self.dates[::self.launch_day_frequency]):
+
+            chart.interpolate(date, self.duration)
+            model.use(chart)
+
+            # The model and its interpolated chart are sent to the workers once per date, not with every vessel
+            pool = mp.Pool(mp.cpu_count(), initializer=_init_model, initargs=(model,)) if parallel else None
+
+            try:
+                cells  = [Replicates(self.dt, confidence) for _ in self.departure_points]
+                active = list(range(len(cells)))
+
+                # Every cell draws its noise paths from its own sequence
+                samplers = [Sampler(sampling, stratified, seed=None if seed is None else (seed, d, departure))
+                            for departure in range(len(cells))]
+
+                while active:
+
+                    vessels = []
+                    for departure in active:
+                        for noise in samplers[departure].paths(block_size, n_steps):
+
+                            vessel = Vessel(*self.departure_points[departure],
+                                            craft = self.craft,
+                                            mode = self.mode,
+                                            route = list(routes[departure]) if routes[departure] is not None else None,
+                                            destination = self.destination,
+                                            speed = self.speed,
+                                            params = vessel_params[self.mode][self.craft])
+                            vessel.noise = noise
+
+                            vessels.append(vessel)
+
+                    trajectories = pool.map(_run_model, vessels) if pool is not None else [model.run_vessel(vessel) for vessel in vessels]
+
+                    for i, vessel in enumerate(trajectories):
+                        cells[active[i // block_size]].add(vessel)
+
+                    active = [departure for departure in active
+                              if cells[departure].n < max_reps
+                              and not (cells[departure].n >= min_reps and cells[departure].converged(precision))]
+
+                results.update({date.strftime('%Y-%m-%d'): [cell.summary() for cell in cells]})
+
+            finally:
+                if pool is not None:
+                    pool.close()
+
+        return results
+
+
+def _init_model(model: Model):
+
+    global _MODEL
+    _MODEL = model
+
+
+def _run_model(vessel: Vessel):
+    """Runs a vessel in a worker process with the model sent by the pool initializer, see Traverser.run_sequential."""
+
+    return _MODEL.run_vessel(vessel)
+
 
+def _run_chunk(model: Model, vessels: List[Vessel]) -> Tuple[List[Vessel], Accumulator]:
+    """Runs a chunk of vessels in a worker process, returning the vessels along with the rasters accumulated by the worker.
 
+    Args:
+        model (Model): A Model object with a chart and an accumulator in use
+        vessels (List[Vessel]): List of vessels
 
+    Returns:
+        Tuple[List[Vessel], Accumulator]: The simulated vessels, or their Summary, and the accumulated rasters
+    """
 
+    return [model.run_vessel(vessel) for vessel in vessels], model.accumulator
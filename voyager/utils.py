@@ -1,9 +1,13 @@
 import numpy as np
 import json
 import os
+import warnings
 import glob
 import xarray as xr
+import yaml
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import *
 
 def lonlat_from_displacement(dx: float, dy: float, origin: Tuple[float, float]) -> Tuple[float, float]:
@@ -27,6 +31,28 @@ def lonlat_from_displacement(dx: float, dy: float, origin: Tuple[float, float])
 
     return np.asscalar(new_longitude), np.asscalar(new_latitude)
 
+def load_vessel_config(vessel_config: Union[str, Dict]) -> Dict:
+    """Reads the vessel configuration with the parameters of every craft for each mode of propulsion.
+
+    Args:
+        vessel_config (Union[str, Dict]): Path to a YAML configuration, relative paths also resolved against the package directory,
+                                          or an already loaded configuration
+
+    Returns:
+        Dict: The vessel configuration
+    """
+
+    if isinstance(vessel_config, dict):
+        return vessel_config
+
+    if not os.path.exists(vessel_config) and not os.path.isabs(vessel_config):
+        vessel_config = os.path.join(os.path.dirname(__file__), vessel_config)
+
+    with open(vessel_config, 'r') as file:
+        config = yaml.safe_load(file)
+
+    return config
+
 def normalize_longitude(lon: np.ndarray) -> np.ndarray:
     """Normalize the longitude such that longitudinal degrees left of the prime meridian count as the east, 
     and the degrees right of the meridian count as the west. Used to normalize data from ECMWF vs CMEMS.
@@ -45,12 +71,49 @@ def normalize_longitude(lon: np.ndarray) -> np.ndarray:
     return np.concatenate([east, west])
 
 
-def save_to_GeoJSON(data, filename):
+def to_GeoJSON(data: Dict[str, List], timestep: float = 1, **kwargs) -> Dict:
+    """Converts date-tagged simulation results into a single GeoJSON representation.
+
+    Args:
+        data (Dict[str, List]): A dictionary of launch dates as YYYY-MM-DD strings and the simulated vessels
+        timestep (float, optional): Timestep of the simulation in seconds. Defaults to 1.
+        **kwargs: Trajectory reduction options passed to Vessel.to_GeoJSON, tolerance and precision
+
+    Returns:
+        Dict: A dictionary compliant with GeoJSON
+    """
+
+    format_dict = {"type": "FeatureCollection",
+                   "features": []
+                   }
+
+    for date, vessels in data.items():
+        for vessel in vessels:
+
+            start_date = pd.Timestamp(date)
+            stop_date  = start_date + pd.Timedelta((vessel.steps + 1) * timestep, unit='s')
+
+            features = vessel.to_GeoJSON(start_date.strftime('%Y-%m-%d'), stop_date.strftime('%Y-%m-%d'), timestep, **kwargs)
 
-    format_dict = to_GeoJSON(data)
+            format_dict["features"].extend(features["features"])
+
+    return format_dict
+
+def save_to_GeoJSON(data, filename, timestep=1, indent=4, **kwargs):
+    """Saves date-tagged simulation results to a GeoJSON file.
+
+    Args:
+        data (Dict[str, List]): A dictionary of launch dates as YYYY-MM-DD strings and the simulated vessels
+        filename (str): The GeoJSON file
+        timestep (float, optional): Timestep of the simulation in seconds. Defaults to 1.
+        indent (int, optional): Indentation of the file, None for the most compact file. Defaults to 4.
+        **kwargs: Trajectory reduction options passed to Vessel.to_GeoJSON, tolerance and precision
+    """
+
+    format_dict = to_GeoJSON(data, timestep, **kwargs)
 
     with open(filename, 'w') as file:
-        json.dump(format_dict, file, indent=4)
+        json.dump(format_dict, file, indent=indent)
 
 
 def ecmwf_to_xr(winds: xr.Dataset) -> xr.Dataset:
@@ -95,9 +158,99 @@ def cmems_to_xr(currents: xr.Dataset) -> xr.Dataset:
 
     return currents
 
-def load_data(start: pd.Timestamp, end: pd.Timestamp, bbox: List, data_directory: str, source: str, parallel=False) -> Tuple[xr.DataArray, xr.DataArray]:
+def index_files(data_directory: str, source: str) -> Dict[pd.Period, str]:
+    """Indexes the monthly data files of a source, following the directory structure
+
+        <data_directory>/<source>/<YYYY>/<MM>.nc
+
+    Args:
+        data_directory (str): Root directory of the data files
+        source (str): Data source, either "currents" or "winds"
+
+    Files inside the source directory that do not follow this naming are skipped with a warning.
+
+    Returns:
+        Dict[pd.Period, str]: A mapping from monthly periods to the file covering that month
+    """
+
+    index     = {}
+    unmatched = []
+    for filename in glob.glob(os.path.join(data_directory, source, "*", "*.nc")):
+
+        year  = os.path.basename(os.path.dirname(filename))
+        month = os.path.splitext(os.path.basename(filename))[0]
+
+        # Skip files which do not follow the monthly naming
+        if not (year.isdigit() and month.isdigit()):
+            unmatched.append(filename)
+            continue
+
+        index[pd.Period(year=int(year), month=int(month), freq='M')] = filename
+
+    if unmatched:
+        warnings.warn(f"Skipping {len(unmatched)} {source} files not named <YYYY>/<MM>.nc: {', '.join(sorted(unmatched))}")
+
+    return index
+
+def select_files(index: Dict[pd.Period, str], start: pd.Timestamp, end: pd.Timestamp) -> List[str]:
+    """Selects the exact monthly files needed to cover a date range.
+
+    Args:
+        index (Dict[pd.Period, str]): A file index from index_files
+        start (pd.Timestamp): The start date
+        end (pd.Timestamp): The end date
+
+    Raises:
+        FileNotFoundError: Raised if a month in the date range has no data file
+
+    Returns:
+        List[str]: A list of filenames in chronological order
+    """
+
+    months  = pd.period_range(pd.Timestamp(start), pd.Timestamp(end), freq='M')
+    missing = [month for month in months if month not in index]
+
+    if missing:
+        raise FileNotFoundError(f"No data files for the months {', '.join(str(m) for m in missing)}")
+
+    return [index[month] for month in months]
+
+def _decode_file(filename: str, start: pd.Timestamp, end: pd.Timestamp, bbox: List, source: str) -> xr.Dataset:
+    """Decodes a single data file, normalizes it and crops it to the date range and bounding box.
+
+    Args:
+        filename (str): The data file
+        start (pd.Timestamp): The start date
+        end (pd.Timestamp): The end date
+        bbox (List): Bounding box of where to fetch data
+        source (str): Data source, either "currents" or "winds"
+
+    Returns:
+        xr.Dataset: The cropped data in memory
+    """
+
+    with xr.open_dataset(filename) as data:
+
+        if source == "currents":
+            data = cmems_to_xr(data)
+        else:
+            data = ecmwf_to_xr(data)
+
+        data = data.sel(time=slice(start, end), 
+                        longitude=slice(bbox[0], bbox[2]), 
+                        latitude=slice(bbox[1], bbox[3]))
+
+        return data[["u", "v"]].load()
+
+def load_data(start: pd.Timestamp, end: pd.Timestamp, bbox: List, data_directory: str, source: str, parallel=True, max_workers=None) -> Tuple[xr.DataArray, xr.DataArray]:
     """Reads the wind and current data from a directory with a specified structure, namely
 
+        <data_directory>/<source>/<YYYY>/<MM>.nc
+
+    Only the monthly files overlapping the date range are opened, and each file is decoded
+    and cropped to the bounding box on its own, in parallel if requested. The netCDF4/HDF5
+    library serialises reads behind a global lock, so the parallel gain is limited to the
+    non-HDF work of normalising, cropping and copying each month.
 
     Args:
         start (pd.Timestamp): The start date 
@@ -105,7 +258,8 @@ def load_data(start: pd.Timestamp, end: pd.Timestamp, bbox: List, data_directory
         bbox (List): Bounding box of where to fetch data
         data_directory (str): Root directory of the data files
         source (str): Data source, either "currents" or "winds"
-        parallel (bool, optional): Whether to load the data in parallel. Defaults to False.
+        parallel (bool, optional): Whether to decode the files in parallel. Defaults to True.
+        max_workers (int, optional): Maximal number of threads decoding files. Defaults to None.
 
     Raises:
         ValueError: Raised if the data source is not "currents" or "winds"
@@ -114,34 +268,24 @@ def load_data(start: pd.Timestamp, end: pd.Timestamp, bbox: List, data_directory
         Tuple[xr.DataArray, xr.DataArray]: A tuple of the velocity x (east-west) and y (south-north) components respectively.
     """
 
-    start_year = start.year
-    end_year   = end.year
-
-    years = pd.date_range(str(start_year), str(end_year)).to_period('Y')\
-                                                .format(formatter=lambda x: x.strftime('%Y'))
-    years = set(years)
-
-    dates = pd.date_range(start, end)
-    
-    filenames = []
-    for year in years:
-
-        pattern = os.path.join(data_directory, source, year, "*.nc")
-
-        filenames.extend(glob.glob(pattern))
+    if source not in ("currents", "winds"):
+        raise ValueError("Source must be currents or winds.")
 
-    if source == "currents":
-        data = xr.open_mfdataset(filenames, parallel=parallel)
-        data = cmems_to_xr(data)
+    start = pd.Timestamp(start)
+    end   = pd.Timestamp(end)
 
-    elif source == "winds":
-        data = xr.open_mfdataset(filenames, parallel=parallel)
-        data = ecmwf_to_xr(data)
+    dates     = pd.date_range(start, end)
+    filenames = select_files(index_files(data_directory, source), start, end)
 
+    decode = partial(_decode_file, start=start, end=end, bbox=bbox, source=source)
 
+    if parallel and len(filenames) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(executor.map(decode, filenames))
     else:
-        raise ValueError("Source must be currents or winds.")
+        parts = [decode(filename) for filename in filenames]
 
-    data = data.sel(time=dates, longitude=slice(bbox[0], bbox[2]), latitude=slice(bbox[1], bbox[3])).load()
+    data = xr.concat(parts, dim="time") if len(parts) > 1 else parts[0]
+    data = data.sel(time=dates)
 
     return data.u, data.v
\ No newline at end of file
@@ -1,8 +1,93 @@
 
-from . import geo, search, chart
+from . import geo, search, chart, simplify
 import numpy as np
 from typing import *
 
+class Summary(NamedTuple):
+    """
+    A fixed-size record of a simulated vessel, kept instead of the Vessel when only the arrival statistics are needed.
+    """
+
+    start: Tuple[float, float]
+    end: Tuple[float, float]
+    arrived: bool
+    steps: int
+    distance: float
+    mean_speed: float
+    landfall: Optional[Dict] = None
+
+    def to_dict(self):
+
+        return self._asdict()
+
+    def to_GeoJSON(self, start_date: str, stop_date: str, dt: float, **kwargs) -> Dict:
+        """Converts the record into a GeoJSON representation, with a line from the start to the end position.
+
+        Args:
+            start_date (str): The start date of the trajectory
+            stop_date (str): The end date of the trajectory
+            dt (float): Timestep
+
+        Returns:
+            Dict: A dictionary compliant with GeoJSON
+        """
+
+        properties = {
+            "start_date": start_date,
+            "stop_date": stop_date,
+            "timestep": dt,
+            "times": [0, self.steps * dt],
+            "arrived": self.arrived,
+            "distance": self.distance,
+            "mean_speed": self.mean_speed
+        }
+
+        if self.landfall is not None:
+            properties["landfall"] = self.landfall
+
+        return {"type": "FeatureCollection",
+                "features": [{"type": "Feature",
+                              "geometry": {"type": "LineString", "coordinates": [list(self.start), list(self.end)]},
+                              "properties": properties}]}
+
+
+class Trajectory:
+    """
+    A trajectory recorded into a preallocated array with a given precision, instead of a list of float64 pairs.
+    The array doubles in size when it is full.
+    """
+
+    def __init__(self, positions, capacity: int, precision: str = "float32") -> None:
+
+        positions = np.asarray(positions, dtype=precision).reshape(-1, 2)
+
+        self.positions = np.empty((max(capacity, len(positions), 1), 2), dtype=precision)
+        self.positions[:len(positions)] = positions
+        self.n = len(positions)
+
+    def append(self, position: List[float]):
+
+        if self.n == len(self.positions):
+            self.positions = np.concatenate((self.positions, np.empty_like(self.positions)))
+
+        self.positions[self.n] = position
+        self.n += 1
+
+    def extend(self, positions: List[List[float]]):
+
+        for position in positions:
+            self.append(position)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, index):
+        return self.positions[:self.n][index]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.positions[:self.n], dtype=dtype)
+
+
 class Vessel:
 
     def __init__(self, x, 
@@ -26,72 +111,112 @@ class Vessel:
 
         # Initialize parameters to save
         self.trajectory = [[self.x, self.y]]
+        self.steps = 0
         self.distance = 0
         self.mean_speed = 0
+        self.arrived = False
 
-        self.route  = route
+        # The target reached in multi-destination mode, and when
+        self.landfall = None
+
+        # The steps of the recorded positions, None when every step is recorded
+        self.recorded_steps = None
+
+        # Pre-drawn random terms of every step, see sampling.Sampler, None to draw them while simulating
+        self.noise = None
+
+        # Number of times the route was replanned on the way
+        self.replans = 0
+
+        self.route  = route if route is not None else []
         self.route_taken = [[float(x),float(y)] for x,y in self.route]
-        self.target = self.route.pop()
+        self.target = self.route.pop() if self.route else None
 
         # Read the features of the vessel
         self.params = params
 
 
-    @classmethod
-    def from_position(cls, point: Tuple[float, float], chart: chart.Chart = None, destination: Tuple[float, float] = None, interval: int =5, **kwargs):
-        """Creates a vessel from a start position, using a pre-supplied Chart object and destination.
-        The chart and interval parameters are used to create a route from the start position and the destination, the interval
-        deciding the number of milestones along the way.
+    @staticmethod
+    def plan_route(point: Tuple[float, float], chart: chart.Chart = None, destination: Tuple[float, float] = None, interval: int = 5, router = None) -> List[Tuple[float, float]]:
+        """Plans a route of milestones from a start position to a destination, the last milestone first.
+        The interval decides the number of milestones along the way.
 
         Args:
             point (Tuple[float, float]): Start position
             chart (chart.Chart, optional): A Chart object. Defaults to None.
             destination (Tuple[float, float], optional): Destination position. Defaults to None.
             interval (int, optional): Interval to create route targets. Defaults to 5.
+            router (IsochroneRouter, optional): Router for time-dependent routes under the winds and currents. 
+                                                Defaults to None, using A* on the shoreline weighted grid.
 
         Raises:
             RuntimeError: Raised if there is no possible route between start and end
 
         Returns:
-            Vessel: A Vessel instance
+            List[Tuple[float, float]]: The route in reverse order, or None without a destination
         """
-        
 
         x, y = point
 
-        if (destination is not None) and (chart is not None):
+        if (destination is not None) and (router is not None):
+
+            # Find the fastest route under the winds and currents
+            route = router.route((x, y), destination)
+            route = [route[0], *route[1:-2:interval], route[-1]]
+            route.reverse()
 
-            # Find the closest latlon to the start and destination
-            i = geo.closest_coordinate_index(chart.longitudes, x)
-            j = geo.closest_coordinate_index(chart.latitudes, y)
+            return route
 
-            i_goal = geo.closest_coordinate_index(chart.longitudes, destination[0])
-            j_goal = geo.closest_coordinate_index(chart.latitudes, destination[1]) 
+        elif (destination is not None) and (chart is not None):
+
+            # Find the closest grid positions to the start and destination
+            start = chart.position(x, y)
+            goal  = chart.position(*destination)
 
             # Find the optimal route to the target
-            astar = search.Astar(chart.grid)
-            came_from, cost_so_far = astar.search(start=(j, i), goal=(j_goal, i_goal))
+            astar = chart.astar
+            came_from, cost_so_far = astar.search(start=start, goal=goal)
 
             # Chart the route
             try:
-                route = astar.reconstruct_path(came_from, start=(j, i), goal=(j_goal, i_goal))
-                route = [(chart.longitudes[i], chart.latitudes[j]) for j, i in route]
+                route = astar.reconstruct_path(came_from, start=start, goal=goal)
+                route = [chart.coordinates(id) for id in route]
                 route = [route[0], *route[1:-2:interval], route[-1]]
                 route.reverse()
 
             except Exception as e:
                 raise RuntimeError("No possible route") from e
 
+            return route
 
-            # Create a vessel
-            vessel = cls(x, y, route=route, destination=destination, **kwargs)
+        return None
 
-        else:
+    @classmethod
+    def from_position(cls, point: Tuple[float, float], chart: chart.Chart = None, destination: Tuple[float, float] = None, interval: int =5, router = None, **kwargs):
+        """Creates a vessel from a start position, using a pre-supplied Chart object and destination.
+        The chart and interval parameters are used to create a route from the start position and the destination, the interval
+        deciding the number of milestones along the way.
+
+        Args:
+            point (Tuple[float, float]): Start position
+            chart (chart.Chart, optional): A Chart object. Defaults to None.
+            destination (Tuple[float, float], optional): Destination position. Defaults to None.
+            interval (int, optional): Interval to create route targets. Defaults to 5.
+            router (IsochroneRouter, optional): Router for time-dependent routes under the winds and currents. 
+                                                Defaults to None, using A* on the shoreline weighted grid.
+
+        Raises:
+            RuntimeError: Raised if there is no possible route between start and end
+
+        Returns:
+            Vessel: A Vessel instance
+        """
+
+        x, y = point
 
-            # Create a vessel without a route
-            vessel = cls(x, y, destination=destination, **kwargs)
+        route = cls.plan_route(point, chart, destination, interval, router)
 
-        return vessel
+        return cls(x, y, route=route, destination=destination, **kwargs)
 
 
     @classmethod
@@ -112,26 +237,41 @@ class Vessel:
         vessels = []
         for point in points:
 
-            vessel = cls.from_position(point, chart, destination, interval, kwargs)
+            vessel = cls.from_position(point, chart, destination, interval, **kwargs)
 
             vessels.append(vessel)
 
 
         return vessels
 
-    def update_position(self, x: float, y: float):
+    def update_position(self, x: float, y: float, record: bool = True):
         """Updates position and records it to the trajectory
 
         Args:
             x (float): longitudinal position
             y (float): latitudinal position
+            record (bool, optional): Whether to record the position to the trajectory. Defaults to True.
         """
             
         self.x = x
         self.y = y
+        self.steps += 1
 
         # Record position to trajectory
-        self.trajectory.append([x, y])
+        if record:
+            self.record_position()
+
+        return self
+
+    def record_position(self):
+        """Records the current position to the trajectory, unless it is already recorded."""
+
+        if self.recorded_steps is None:
+            self.trajectory.append([self.x, self.y])
+
+        elif self.recorded_steps[-1] != self.steps:
+            self.trajectory.append([self.x, self.y])
+            self.recorded_steps.append(self.steps)
 
         return self
 
@@ -156,7 +296,7 @@ class Vessel:
         """
 
         N_SECONDS_PER_HOUR = 3600
-        self.mean_speed = self.distance / (len(self.trajectory) * dt / N_SECONDS_PER_HOUR) # km/h
+        self.mean_speed = self.distance / ((self.steps + 1) * dt / N_SECONDS_PER_HOUR) # km/h
 
         return self
 
@@ -172,6 +312,9 @@ class Vessel:
             bool: Whether the vessel has arrived or not
         """
 
+        if self.target is None:
+            return False
+
         is_close = geo.distance((longitude, latitude), self.target) <= target_tol
 
         if is_close:
@@ -182,29 +325,144 @@ class Vessel:
         else:
             return False
 
+    def reroute(self, route: List[Tuple[float, float]]):
+        """Replaces the remaining route, such as when it is replanned from the current position.
+
+        Args:
+            route (List[Tuple[float, float]]): The new route in reverse order, see plan_route
+
+        Returns:
+            Vessel: The Vessel instance
+        """
+
+        self.route  = route
+        self.target = self.route.pop() if self.route else self.target
+        self.replans += 1
+
+        return self
+
+    def reserve(self, capacity: int, precision: str = "float32"):
+        """Records the trajectory into a preallocated array with a given precision, see Trajectory.
+
+        Args:
+            capacity (int): Number of positions expected to be recorded
+            precision (str, optional): The floating point precision. Defaults to "float32".
+
+        Returns:
+            Vessel: The Vessel instance
+        """
+
+        self.trajectory = Trajectory(self.trajectory, len(self.trajectory) + capacity, precision)
+
+        return self
+
+    def compact(self, precision: str = "float32"):
+        """Stores the recorded trajectory as a contiguous array with a given precision.
+
+        Args:
+            precision (str, optional): The floating point precision. Defaults to "float32".
+        """
+
+        self.trajectory = np.asarray(self.trajectory, dtype=precision).reshape(-1, 2)
+
+        return self
+
+    def coordinates(self) -> List[List[float]]:
+        """The recorded trajectory as a list of [longitude, latitude] pairs.
+
+        Returns:
+            List[List[float]]: The trajectory coordinates
+        """
+
+        return np.asarray(self.trajectory, dtype=float).reshape(-1, 2).tolist()
+
+    def summary(self) -> Summary:
+        """The fixed-size record of the vessel.
+
+        Returns:
+            Summary: The start and end position, arrival, number of steps, distance and mean speed
+        """
+
+        start = np.asarray(self.trajectory[0], dtype=float)
+
+        return Summary(start=(float(start[0]), float(start[1])),
+                       end=(float(self.x), float(self.y)),
+                       arrived=bool(self.arrived),
+                       steps=self.steps,
+                       distance=float(self.distance),
+                       mean_speed=float(self.mean_speed),
+                       landfall=self.landfall)
+
     def to_dict(self):
 
         return {
-            "trajectory": self.trajectory,
+            "trajectory": self.coordinates(),
             "distance": self.distance,
             "route": self.route_taken,
             "mean_speed": self.mean_speed,
-            "destination": self.destination
+            "destination": self.destination,
+            "landfall": self.landfall
         }
 
-    def to_GeoJSON(self, start_date: str, stop_date: str, dt: float) -> Dict:
+    def to_GeoJSON(self, start_date: str, stop_date: str, dt: float, tolerance: float = None, precision: float = None) -> Dict:
         """Converts vessel data into a GeoJSON representation
 
+        The trajectory can be reduced on output. With a tolerance it is simplified to the vertices needed to stay within
+        the tolerance in km, in time-aware manner, and the times of the kept vertices are stored in the "times" property.
+        Trajectories recorded at only some steps, see Model, also store the times of their vertices in the "times" property.
+        With a precision the coordinates are delta encoded as fixed-point integers in the "encoded" property, see simplify.delta_decode,
+        and the geometry is left empty.
+
         Args:
             vessel (Vessel): A Vessel object
             start_date (str): The start date of the trajectory
             stop_date (str): The end date of the trajectory
             dt (float): Timestep
+            tolerance (float, optional): Tolerance in km of the trajectory simplification. Defaults to None.
+            precision (float, optional): Resolution in degrees of delta encoded coordinates. Defaults to None.
 
         Returns:
             Dict: A dictionary compliant with GeoJSON
         """
 
+        coordinates = np.asarray(self.trajectory, dtype=float).reshape(-1, 2)
+
+        if self.recorded_steps is not None:
+            times = np.asarray(self.recorded_steps) * dt
+        else:
+            times = np.arange(len(coordinates)) * dt
+
+        properties = {
+            "start_date": start_date,
+            "stop_date": stop_date,
+            "timestep": dt,
+            "distance": self.distance,
+            "mean_speed": self.mean_speed,
+            "destination": self.destination,
+            "route": self.route_taken
+        }
+
+        if self.landfall is not None:
+            properties["landfall"] = self.landfall
+
+        if tolerance is not None:
+            kept        = simplify.simplify(coordinates, tolerance, times)
+            coordinates = coordinates[kept]
+            properties["times"] = times[kept].tolist()
+
+        elif self.recorded_steps is not None:
+            properties["times"] = times.tolist()
+
+        geometry = {
+            "type": "LineString",
+            "coordinates": coordinates.tolist(),
+        }
+
+        if precision is not None:
+            properties["encoded"]   = simplify.delta_encode(coordinates, precision)
+            properties["precision"] = precision
+            geometry = None
+
         format_dict = {"type": "FeatureCollection",
                     "features": []
                     }
@@ -212,22 +470,9 @@ class Vessel:
         format_dict["features"].append(
             {
                 "type": "Feature",
-                "geometry": {
-                    "type": "LineString",
-                    # "coordinates": [[y, x] for x, y in vessel.trajectory],
-                    "coordinates": self.trajectory,
-
-                },
-                "properties": {
-                    "start_date": start_date,
-                    "stop_date": stop_date,
-                    "timestep": dt,
-                    "distance": self.distance,
-                    "mean_speed": self.mean_speed,
-                    "destination": self.destination,
-                    "route": self.route_taken
-                }          
+                "geometry": geometry,
+                "properties": properties          
             }
         )
 
-        return format_dict
\ No newline at end of file
+        return format_dict